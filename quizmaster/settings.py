@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'quizzes.middleware.primary_stickiness_middleware',
 ]
 
 ROOT_URLCONF = 'quizmaster.urls'
@@ -81,6 +82,58 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile (QUIZ_DB_PROFILE=production). WAL lets readers
+# run while a submission is being written, and the pragmas are applied to
+# every new connection. IMMEDIATE transactions take the write lock at BEGIN,
+# so two submissions never deadlock upgrading a read lock; the loser waits
+# out busy_timeout instead of failing with "database is locked".
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,         # ms
+    'mmap_size': 256 * 1024 ** 2,  # bytes
+    'cache_size': -64 * 1024,     # KiB when negative
+    'temp_store': 'MEMORY',
+}
+
+QUIZ_DB_PROFILE = os.environ.get('QUIZ_DB_PROFILE', 'development')
+if QUIZ_DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRODUCTION_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    })
+
+# Read replica (QUIZ_REPLICA_DB=/path/to/replica.sqlite3). Views marked with
+# quizzes.routers.use_replica read from it; refresh it from the primary with
+# `manage.py refresh_replica --interval 30`. Users who just wrote something
+# stay on the primary for REPLICA_STICKY_SECONDS.
+QUIZ_REPLICA_DB = os.environ.get('QUIZ_REPLICA_DB')
+if QUIZ_REPLICA_DB:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': QUIZ_REPLICA_DB,
+        'TEST': {'MIRROR': 'default'},
+    }
+REPLICA_STICKY_SECONDS = 10
+
+# Submission shards (QUIZ_SUBMISSION_SHARDS=N). Submissions, answers and queued
+# grades of a quiz go to submissions_<crc32(quiz id) % N>.sqlite3 so writes to
+# different quizzes take different locks. Create the tables with
+# `manage.py migrate --database shard_<i>` for each shard, and move existing
+# rows (or rows after N changes) with `manage.py rebalance_shards`.
+QUIZ_SUBMISSION_SHARDS = int(os.environ.get('QUIZ_SUBMISSION_SHARDS', 0))
+for number in range(QUIZ_SUBMISSION_SHARDS):
+    DATABASES[f'shard_{number}'] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'submissions_{number}.sqlite3',
+    }
+
+DATABASE_ROUTERS = ['quizzes.routers.ShardRouter', 'quizzes.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -132,3 +185,35 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Quiz grading
+# 'sync' grades take_quiz submissions in the request; 'queued' stores the raw
+# answers and leaves grading to `manage.py grade_submissions`.
+QUIZ_GRADING_MODE = os.environ.get('QUIZ_GRADING_MODE', 'sync')
+
+# 'rows' stores one Answer row per question; 'packed' stores a submission's
+# answers as one JSON value on QuizSubmission. Convert existing submissions
+# with `manage.py pack_answers` (or back with --unpack).
+ANSWER_STORAGE = os.environ.get('QUIZ_ANSWER_STORAGE', 'rows')
+
+# Share of a quiz's points a submission needs to count as a pass on the
+# admin results page.
+QUIZ_PASS_PERCENTAGE = 60
+
+# `manage.py archive_submissions` moves graded submissions older than
+# SUBMISSION_ARCHIVE_DAYS into one SQLite file per year in this directory.
+SUBMISSION_ARCHIVE_DIR = os.environ.get('QUIZ_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+SUBMISSION_ARCHIVE_DAYS = int(os.environ.get('QUIZ_ARCHIVE_DAYS', '365'))
+
+# Notifications
+# Open tabs hold an event stream served by the ASGI app (e.g.
+# `uvicorn quizmaster.asgi:application`). Streams re-read the unread state
+# from the database every NOTIFICATION_HEARTBEAT seconds, so changes made on
+# another worker reach them within that time.
+NOTIFICATION_HEARTBEAT = 25
+
+# Unread notifications of one of these types within this many seconds are
+# folded into one row titled with the count (see quizzes/notifications.py);
+# 0 keeps one row per event. Broadcasts fold the same way.
+NOTIFICATION_DIGEST_WINDOW = 3600
+NOTIFICATION_DIGEST_TYPES = ['achievement', 'quiz_result', 'rank_change', 'new_quiz', 'system']
@@ -0,0 +1,212 @@
+"""Achievement rule engine.
+
+Achievements are evaluated when a submission is recorded rather than on every
+profile view. The catalog is synced to the ``Achievement`` table once per
+process and indexed by the event each rule reacts to, so evaluating a
+submission is a few comparisons in memory; the database is only touched when
+some threshold is actually reached.
+
+Events and the value each rule's ``requirement`` is compared against:
+
+* ``quiz_count``: the profile's ``total_quizzes_taken``
+* ``high_score``: the submission's percentage score
+* ``streak``: the user's current study streak in days
+"""
+from collections import defaultdict
+from threading import Lock
+
+from django.db.models import FloatField, Max
+from django.db.models.functions import Cast, NullIf
+
+from . import sharding
+from .models import Achievement, ArchivedSubmission, QuizSubmission, StudyStreak, UserAchievement, UserProfile
+
+
+CATALOG = [
+    {
+        'name': 'First Steps',
+        'description': 'Complete your first quiz',
+        'icon': 'fa-star',
+        'color': 'text-success',
+        'requirement': 1,
+        'type': 'quiz_count'
+    },
+    {
+        'name': 'Quiz Master',
+        'description': 'Complete 10 quizzes',
+        'icon': 'fa-trophy',
+        'color': 'text-warning',
+        'requirement': 10,
+        'type': 'quiz_count'
+    },
+    {
+        'name': 'Perfect Score',
+        'description': 'Score 100% on a quiz',
+        'icon': 'fa-gem',
+        'color': 'text-primary',
+        'requirement': 100,
+        'type': 'high_score'
+    },
+    {
+        'name': 'Consistent Performer',
+        'description': 'Complete 25 quizzes',
+        'icon': 'fa-chart-line',
+        'color': 'text-info',
+        'requirement': 25,
+        'type': 'quiz_count'
+    },
+    {
+        'name': 'On a Roll',
+        'description': 'Take a quiz 7 days in a row',
+        'icon': 'fa-fire',
+        'color': 'text-danger',
+        'requirement': 7,
+        'type': 'streak'
+    },
+]
+
+_rules = None
+_rules_lock = Lock()
+
+
+def load_rules():
+    """Sync the catalog and return ``{event: [(achievement, requirement), ...]}``"""
+    global _rules
+    if _rules is not None:
+        return _rules
+
+    with _rules_lock:
+        if _rules is None:
+            names = [entry['name'] for entry in CATALOG]
+            existing = {achievement.name: achievement for achievement in Achievement.objects.filter(name__in=names)}
+            missing = [
+                Achievement(
+                    name=entry['name'],
+                    description=entry['description'],
+                    icon=entry['icon'],
+                    color=entry['color'],
+                    requirement=entry['requirement'],
+                    achievement_type=entry['type'],
+                )
+                for entry in CATALOG if entry['name'] not in existing
+            ]
+            if missing:
+                Achievement.objects.bulk_create(missing)
+                existing = {achievement.name: achievement for achievement in Achievement.objects.filter(name__in=names)}
+
+            rules = defaultdict(list)
+            for entry in CATALOG:
+                rules[entry['type']].append((existing[entry['name']], entry['requirement']))
+            _rules = dict(rules)
+    return _rules
+
+
+def reset_rules():
+    """Forget the loaded catalog (e.g. after editing achievements)"""
+    global _rules
+    with _rules_lock:
+        _rules = None
+
+
+def _reached(events):
+    rules = load_rules()
+    return {
+        achievement.id: achievement
+        for event, value in events.items() if value is not None
+        for achievement, requirement in rules.get(event, ())
+        if value >= requirement
+    }
+
+
+def _higher(a, b):
+    if a is None or b is None:
+        return b if a is None else a
+    return max(a, b)
+
+
+def award(user_id, events):
+    """Award every achievement whose threshold ``events`` reaches.
+
+    Returns the newly earned ``Achievement`` objects.
+    """
+    reached = _reached(events)
+    if not reached:
+        return []
+
+    earned = set(
+        UserAchievement.objects.filter(user_id=user_id, achievement_id__in=reached)
+        .values_list('achievement_id', flat=True)
+    )
+    new = [achievement for achievement_id, achievement in reached.items() if achievement_id not in earned]
+    UserAchievement.objects.bulk_create(
+        [UserAchievement(user_id=user_id, achievement=achievement) for achievement in new],
+        ignore_conflicts=True,
+    )
+    return new
+
+
+def evaluate_submission(submission, profile, streak=None):
+    """Award achievements unlocked by a newly graded submission"""
+    return award(submission.user_id, {
+        'quiz_count': profile.total_quizzes_taken,
+        'high_score': submission.percentage_score,
+        'streak': streak.current_streak if streak is not None else None,
+    })
+
+
+def backfill(batch_size=500):
+    """Evaluate every user with at least one quiz, ``batch_size`` at a time.
+
+    Yields the number of achievements awarded after each batch.
+    """
+    load_rules()
+    percentage = Cast('score', FloatField()) * 100 / NullIf('total_points', 0)
+    last_id = 0
+    while True:
+        profiles = list(
+            UserProfile.objects.filter(id__gt=last_id, total_quizzes_taken__gt=0)
+            .order_by('id')
+            .values_list('id', 'user_id', 'total_quizzes_taken')[:batch_size]
+        )
+        if not profiles:
+            break
+        last_id = profiles[-1][0]
+        user_ids = [user_id for _, user_id, _ in profiles]
+
+        best_scores = {
+            row['user_id']: row['best']
+            for row in sharding.merged_rows(
+                QuizSubmission.objects.filter(user_id__in=user_ids, status='graded')
+                .values('user_id')
+                .annotate(best=Max(percentage))
+                .order_by(),
+                keys=('user_id',),
+                combine={'best': _higher},
+                also=[
+                    ArchivedSubmission.objects.filter(user_id__in=user_ids)
+                    .values('user_id')
+                    .annotate(best=Max(percentage))
+                    .order_by()
+                ],
+            )
+        }
+        streaks = dict(
+            StudyStreak.objects.filter(user_id__in=user_ids).values_list('user_id', 'longest_streak')
+        )
+        earned = set(
+            UserAchievement.objects.filter(user_id__in=user_ids).values_list('user_id', 'achievement_id')
+        )
+
+        new = []
+        for _, user_id, quizzes_taken in profiles:
+            reached = _reached({
+                'quiz_count': quizzes_taken,
+                'high_score': best_scores.get(user_id),
+                'streak': streaks.get(user_id),
+            })
+            new.extend(
+                UserAchievement(user_id=user_id, achievement_id=achievement_id)
+                for achievement_id in reached if (user_id, achievement_id) not in earned
+            )
+        UserAchievement.objects.bulk_create(new, ignore_conflicts=True)
+        yield len(new)
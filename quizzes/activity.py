@@ -0,0 +1,95 @@
+"""Per-user monthly activity rollup.
+
+``MonthlyActivity`` holds one row per user and calendar month, updated by a
+single counter increment when a submission is recorded. The stats API reads a
+user's last twelve months with one range query on the ``(user, month)``
+unique index instead of one ``COUNT`` per month.
+"""
+import operator
+from datetime import timedelta
+
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import sharding
+from .counters import bump
+from .models import ArchivedSubmission, MonthlyActivity, QuizSubmission
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def record_activity(submission, score_delta=None, quizzes_delta=1):
+    """Add a graded submission to its user's month"""
+    bump(
+        MonthlyActivity,
+        {'user_id': submission.user_id, 'month': month_start(timezone.localdate(submission.submitted_at))},
+        quizzes_taken=quizzes_delta,
+        total_score=submission.score if score_delta is None else score_delta,
+    )
+
+
+def last_months(today=None, count=12):
+    """First days of the last ``count`` months, oldest first"""
+    month = month_start(today or timezone.localdate())
+    months = [month]
+    for _ in range(count - 1):
+        month = month_start(month - timedelta(days=1))
+        months.append(month)
+    return months[::-1]
+
+
+def monthly_quizzes(user, count=12):
+    """``[(month, quizzes_taken), ...]`` for the last ``count`` months"""
+    months = last_months(count=count)
+    taken = dict(
+        MonthlyActivity.objects.filter(user=user, month__gte=months[0])
+        .values_list('month', 'quizzes_taken')
+    )
+    return [(month, taken.get(month, 0)) for month in months]
+
+
+def rebuild(batch_size=5000):
+    """Rebuild the rollup from ``QuizSubmission`` with one grouped query"""
+    def grouped(queryset):
+        return (
+            queryset.annotate(month=TruncMonth('submitted_at', output_field=DateField()))
+            .values('user_id', 'month')
+            .annotate(quizzes=Count('id'), score=Sum('score'))
+            .order_by()
+        )
+
+    rows = sharding.merged_rows(
+        grouped(QuizSubmission.objects.filter(status='graded')),
+        keys=('user_id', 'month'),
+        combine={'quizzes': operator.add, 'score': operator.add},
+        chunk_size=batch_size,
+        also=[grouped(ArchivedSubmission.objects.all())],
+    )
+    written = 0
+    batch = []
+    for row in rows:
+        batch.append(MonthlyActivity(
+            user_id=row['user_id'],
+            month=row['month'],
+            quizzes_taken=row['quizzes'],
+            total_score=row['score'],
+        ))
+        if len(batch) >= batch_size:
+            written += _write(batch)
+            batch = []
+    if batch:
+        written += _write(batch)
+    return written
+
+
+def _write(batch):
+    MonthlyActivity.objects.bulk_create(
+        batch,
+        update_conflicts=True,
+        unique_fields=['user', 'month'],
+        update_fields=['quizzes_taken', 'total_score'],
+    )
+    return len(batch)
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Quiz, Question, Choice, QuizSubmission, Answer, UserProfile
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
+from .models import Quiz, Question, Choice, QuizSubmission, Answer, UserProfile, Subject
 
 
 class ChoiceInline(admin.TabularInline):
@@ -12,10 +14,17 @@ class QuestionInline(admin.TabularInline):
     extra = 1
 
 
+@admin.register(Subject)
+class SubjectAdmin(admin.ModelAdmin):
+    list_display = ['name', 'slug']
+    search_fields = ['name']
+    prepopulated_fields = {'slug': ('name',)}
+
+
 @admin.register(Quiz)
 class QuizAdmin(admin.ModelAdmin):
-    list_display = ['title', 'creator', 'created_at', 'is_active', 'total_questions', 'total_submissions']
-    list_filter = ['is_active', 'created_at', 'creator']
+    list_display = ['title', 'subject', 'creator', 'created_at', 'is_active', 'total_questions', 'total_submissions']
+    list_filter = ['is_active', 'subject', 'created_at', 'creator']
     search_fields = ['title', 'description', 'creator__username']
     inlines = [QuestionInline]
     
@@ -44,10 +53,23 @@ class QuizSubmissionAdmin(admin.ModelAdmin):
     list_display = ['user', 'quiz', 'score', 'total_points', 'percentage_score', 'submitted_at']
     list_filter = ['submitted_at', 'quiz', 'score']
     search_fields = ['user__username', 'quiz__title']
-    readonly_fields = ['submitted_at']
+    readonly_fields = ['submitted_at', 'answer_list']
+    exclude = ['packed_answers']
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user', 'quiz')
+    
+    @admin.display(description='Answers')
+    def answer_list(self, obj):
+        # Works for both Answer rows and packed answers
+        return format_html_join(
+            mark_safe('<br>'), '{} {}: {}',
+            (
+                ('✓' if answer.is_correct else '✗', answer.question.question_text[:50],
+                 answer.selected_choice.choice_text if answer.selected_choice else answer.text_answer)
+                for answer in obj.get_answers()
+            ),
+        )
 
 
 @admin.register(Answer)
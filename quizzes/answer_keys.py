@@ -0,0 +1,173 @@
+"""Compiled, versioned answer keys.
+
+Grading only needs to know, for each question, its type, its point value and
+which choices are correct. That information is compiled once per quiz version
+and kept in a small in-process LRU backed by Django's cache, so grading a
+submission does not touch the ``Question`` and ``Choice`` tables.
+
+``Quiz.answer_key_version`` is bumped whenever a question or choice of the
+quiz changes (see ``signals.py``); cache entries are keyed by that version, so
+stale keys are never served and simply age out.
+
+Short answer questions are compiled into a ``ShortAnswerMatcher`` (a set of
+normalized answers, or one combined regular expression) at the same time, so
+the per-submission cost of matching free text is a set lookup or one regex
+match.
+"""
+import re
+import unicodedata
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import Question, Quiz
+
+
+# Bump when the pickled layout of AnswerKey changes so old shared-cache
+# entries are ignored rather than unpickled into the wrong shape.
+KEY_FORMAT = 2
+
+KeyEntry = namedtuple('KeyEntry', ['type', 'points', 'choice_ids', 'correct_ids', 'correct_text', 'matcher'])
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_answer(text):
+    """Casefold text and drop punctuation and repeated whitespace"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    text = _PUNCTUATION.sub('', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class ShortAnswerMatcher:
+    """Accepted answers of a short answer question, compiled for matching"""
+
+    def __init__(self, mode, accepted):
+        self.mode = mode
+        self.values = frozenset()
+        self.pattern = None
+        if mode == 'regex':
+            patterns = []
+            for pattern in accepted:
+                try:
+                    re.compile(pattern)
+                except re.error:
+                    continue
+                patterns.append(f'(?:{pattern})')
+            if patterns:
+                self.pattern = re.compile('|'.join(patterns))
+        elif mode == 'exact':
+            self.values = frozenset(answer.strip() for answer in accepted)
+        else:
+            self.values = frozenset(normalize_answer(answer) for answer in accepted)
+
+    def matches(self, text):
+        if not text:
+            return False
+        if self.mode == 'regex':
+            return self.pattern is not None and self.pattern.fullmatch(text.strip()) is not None
+        if self.mode == 'exact':
+            return text.strip() in self.values
+        return normalize_answer(text) in self.values
+
+
+class AnswerKey:
+    """Answer key of one version of a quiz"""
+
+    def __init__(self, quiz_id, version, entries):
+        self.quiz_id = quiz_id
+        self.version = version
+        self.entries = entries
+        self.total_points = sum(entry.points for entry in entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f'<AnswerKey quiz={self.quiz_id} v{self.version} questions={len(self)}>'
+
+
+class _LRU:
+    """Tiny thread-safe LRU mapping"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard_quiz(self, quiz_id):
+        with self._lock:
+            for key in [key for key in self._data if key[0] == quiz_id]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_keys = _LRU(getattr(settings, 'ANSWER_KEY_LRU_SIZE', 256))
+
+
+def _cache_key(quiz_id, version):
+    return f'quizzes:answer_key:{KEY_FORMAT}:{quiz_id}:{version}'
+
+
+def compile_answer_key(quiz_id, version):
+    """Build an answer key from the ORM (two queries)"""
+    entries = {}
+    questions = Question.objects.filter(quiz_id=quiz_id).prefetch_related('choices')
+    for question in questions:
+        choices = list(question.choices.all())
+        correct = [choice for choice in choices if choice.is_correct]
+        entries[question.id] = KeyEntry(
+            type=question.question_type,
+            points=question.points,
+            choice_ids=frozenset(choice.id for choice in choices),
+            correct_ids=frozenset(choice.id for choice in correct),
+            correct_text=correct[0].choice_text if correct else None,
+            matcher=(
+                ShortAnswerMatcher(question.answer_match, question.accepted_answers)
+                if question.question_type == 'sa' else None
+            ),
+        )
+    return AnswerKey(quiz_id, version, entries)
+
+
+def get_answer_key(quiz):
+    """Return the current answer key for a quiz, compiling it if needed"""
+    lookup = (quiz.id, quiz.answer_key_version)
+    key = _local_keys.get(lookup)
+    if key is not None:
+        return key
+
+    key = cache.get(_cache_key(*lookup))
+    if key is None:
+        key = compile_answer_key(*lookup)
+        cache.set(_cache_key(*lookup), key, getattr(settings, 'ANSWER_KEY_CACHE_TIMEOUT', 60 * 60 * 24))
+
+    _local_keys.set(lookup, key)
+    return key
+
+
+def invalidate_answer_key(quiz_id):
+    """Retire the current answer key of a quiz"""
+    Quiz.objects.filter(pk=quiz_id).update(answer_key_version=F('answer_key_version') + 1)
+    _local_keys.discard_quiz(quiz_id)
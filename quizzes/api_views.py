@@ -1,9 +1,17 @@
-from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.db import connections
 from django.utils import timezone
-from .models import Notification, StudyStreak, QuizFeedback, UserProfile
+from django.utils.http import parse_etags
+from .models import Notification, StudyStreak, QuizFeedback, UserProfile, QuizSubmission
+from .notifications import digest_window, event_stream, fold, publish_on_commit, state
+from .ranking import profiles_ranked
+from .routers import use_replica
+from . import archive
+from datetime import timedelta
 import json
 
 @login_required
@@ -11,6 +19,15 @@ import json
 def get_notifications(request):
     """Get user notifications"""
     if request.method == 'GET':
+        # The stamp changes whenever this user's unread notifications do, so
+        # an unchanged ETag is answered after one query on the unread index
+        stamp, unread = state(request.user.id)
+        etag = f'"{request.user.id}-{stamp}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        
         notifications = Notification.objects.filter(user=request.user, read=False)[:10]
         
         data = []
@@ -20,13 +37,17 @@ def get_notifications(request):
                 'type': notification.type,
                 'title': notification.title,
                 'message': notification.message,
+                'count': notification.count,
                 'created_at': notification.created_at.isoformat(),
             })
         
-        return JsonResponse({
+        response = JsonResponse({
             'notifications': data,
-            'unread_count': notifications.count()
+            'unread_count': unread
         })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
@@ -37,8 +58,10 @@ def mark_notification_read(request, notification_id):
     if request.method == 'POST':
         try:
             notification = Notification.objects.get(id=notification_id, user=request.user)
-            notification.read = True
-            notification.save()
+            if not notification.read:
+                notification.read = True
+                notification.save(update_fields=['read'])
+                publish_on_commit(request.user.id, {'event': 'read', 'id': notification.id})
             return JsonResponse({'success': True})
         except Notification.DoesNotExist:
             return JsonResponse({'error': 'Notification not found'}, status=404)
@@ -50,7 +73,9 @@ def mark_notification_read(request, notification_id):
 def mark_all_notifications_read(request):
     """Mark all notifications as read"""
     if request.method == 'POST':
-        Notification.objects.filter(user=request.user, read=False).update(read=True)
+        updated = Notification.objects.filter(user=request.user, read=False).update(read=True)
+        if updated:
+            publish_on_commit(request.user.id, {'event': 'read_all'})
         return JsonResponse({'success': True})
     
     return JsonResponse({'error': 'Method not allowed'}, status=405)
@@ -69,7 +94,7 @@ def submit_quiz_feedback(request, quiz_id):
                 return JsonResponse({'error': 'Invalid rating'}, status=400)
             
             from .models import Quiz
-            quiz = Quiz.objects.get(id=quiz_id)
+            quiz = Quiz.objects.get(id=quiz_id, deleted_at__isnull=True)
             
             feedback, created = QuizFeedback.objects.get_or_create(
                 quiz=quiz,
@@ -90,6 +115,61 @@ def submit_quiz_feedback(request, quiz_id):
     
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
+@login_required
+async def notification_stream(request):
+    """Push notification events to the browser as server-sent events"""
+    # A stream would tie up a whole WSGI worker thread; 204 tells the
+    # EventSource not to reconnect, so the page falls back to polling
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    
+    user = await request.auser()
+    # The stream stays open for minutes; don't keep a database connection
+    # parked on this request's worker thread while it idles
+    await sync_to_async(connections.close_all)()
+    
+    response = StreamingHttpResponse(event_stream(user.id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+def submission_status(request, submission_id):
+    """Get the grading status of a submission"""
+    try:
+        submission = archive.find_submission(id=submission_id, user=request.user)
+    except QuizSubmission.DoesNotExist:
+        return JsonResponse({'error': 'Submission not found'}, status=404)
+    
+    return JsonResponse({
+        'status': submission.status,
+        'score': submission.score,
+        'total_points': submission.total_points,
+    })
+
+@login_required
+@use_replica
+def rankings(request):
+    """Get the users ranked ``start`` to ``end`` by total score"""
+    try:
+        start = max(int(request.GET.get('start', 1)), 1)
+        end = int(request.GET.get('end', start + 49))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid range'}, status=400)
+    
+    # Cap the page size so one request cannot ask for the whole table
+    end = min(end, start + 99)
+    
+    profiles = profiles_ranked(start, end)
+    return JsonResponse({
+        'rankings': [{
+            'username': profile.user.username,
+            'total_score': profile.total_score,
+            'total_quizzes': profile.total_quizzes_taken,
+            'rank': profile.rank,
+        } for profile in profiles],
+    })
+
 @login_required
 def get_user_streak(request):
     """Get user's study streak"""
@@ -102,13 +182,45 @@ def get_user_streak(request):
     })
 
 def create_notification(user, notification_type, title, message):
-    """Helper function to create notifications"""
-    Notification.objects.create(
+    """Helper function to create notifications.
+    
+    For the types in NOTIFICATION_DIGEST_TYPES, the latest unread notification
+    of the same type created within NOTIFICATION_DIGEST_WINDOW seconds absorbs
+    the new one (see ``notifications.fold``): its title becomes a count, the
+    new message is added to its own, and it moves back to the top.
+    """
+    window = digest_window(notification_type)
+    now = timezone.now()
+    # A few compare-and-set rounds; a row that keeps changing gets a sibling instead
+    for _ in range(3 if window else 0):
+        latest = (
+            Notification.objects.filter(
+                user=user, read=False, type=notification_type,
+                created_at__gte=now - timedelta(seconds=window),
+            )
+            .order_by('-created_at')
+            .only('id', 'type', 'count', 'message')
+            .first()
+        )
+        if latest is None:
+            break
+        folded_title, folded_message, count = fold(latest, message)
+        # Compare-and-set: retried if the row was read or folded into in between
+        if Notification.objects.filter(id=latest.id, read=False, count=latest.count).update(
+            title=folded_title, message=folded_message, count=count, created_at=now
+        ):
+            publish_on_commit(user.id, {'event': 'updated', 'id': latest.id, 'type': notification_type})
+            latest.title, latest.message, latest.count, latest.created_at = folded_title, folded_message, count, now
+            return latest
+    
+    notification = Notification.objects.create(
         user=user,
         type=notification_type,
         title=title,
         message=message
     )
+    publish_on_commit(user.id, {'event': 'created', 'id': notification.id, 'type': notification_type})
+    return notification
 
 def update_user_streak(user):
     """Update user's study streak"""
@@ -124,8 +236,11 @@ def update_user_streak(user):
             f'{streak.current_streak} Day Streak!',
             f'Congratulations! You\'ve maintained a {streak.current_streak} day study streak!'
         )
+    
+    return streak
 
 @login_required
+@use_replica
 def dashboard_stats(request):
     """Get comprehensive dashboard statistics"""
     profile, created = UserProfile.objects.get_or_create(user=request.user)
@@ -155,6 +270,7 @@ def dashboard_stats(request):
             'type': n.type,
             'title': n.title,
             'message': n.message,
+            'count': n.count,
             'created_at': n.created_at.isoformat(),
         } for n in notifications],
         'feedback_count': feedback_count,
@@ -0,0 +1,238 @@
+"""Cold storage for old submissions.
+
+Graded submissions older than ``SUBMISSION_ARCHIVE_DAYS`` are moved, with
+their answers, into one SQLite file per year under ``SUBMISSION_ARCHIVE_DIR``
+(``submissions_<year>.sqlite3``), written with the standard library so the
+files need no migrations. Each archived submission leaves a narrow
+``ArchivedSubmission`` row on the primary: enough for the ``rebuild_*``
+commands to keep counting it, for ``take_quiz`` to refuse a second attempt,
+and for ``get_submission_or_404`` to find the year file that holds it.
+
+Rollups (profile totals, leaderboard buckets, monthly activity, score
+histograms, subject totals) are never decremented, so archiving does not
+change them. Archived scores are final: ``regrade_quiz`` only sees live rows.
+
+``archive_batch`` writes the year files first, then the stand-ins, then
+deletes the live rows. Rows are written with ``INSERT OR REPLACE``, so a run
+that stops part-way is simply repeated by the next one.
+"""
+import json
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+
+from . import sharding
+from .models import Answer, ArchivedSubmission, QuizSubmission
+from .packed_answers import pack
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS submission (
+    id INTEGER PRIMARY KEY,
+    quiz_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    total_points INTEGER NOT NULL,
+    submitted_at TEXT NOT NULL,
+    time_taken_us INTEGER,
+    answers TEXT NOT NULL
+);
+'''
+
+
+def archive_dir():
+    return Path(getattr(settings, 'SUBMISSION_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def archive_path(year):
+    return archive_dir() / f'submissions_{year}.sqlite3'
+
+
+def _connect(year, create=False):
+    path = archive_path(year)
+    if not create and not path.exists():
+        return None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    if create:
+        conn.executescript(SCHEMA)
+    return conn
+
+
+def cutoff(days=None):
+    if days is None:
+        days = getattr(settings, 'SUBMISSION_ARCHIVE_DAYS', 365)
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable(alias, before):
+    """Graded submissions on ``alias`` submitted before ``before``, oldest first"""
+    return (
+        sharding.using(QuizSubmission, alias)
+        .filter(status='graded', submitted_at__lt=before)
+        .order_by('submitted_at', 'id')
+    )
+
+
+def _archive_row(submission, answers):
+    time_taken = submission.time_taken
+    return (
+        submission.id,
+        submission.quiz_id,
+        submission.user_id,
+        submission.score,
+        submission.total_points,
+        submission.submitted_at.isoformat(),
+        None if time_taken is None else time_taken // timedelta(microseconds=1),
+        json.dumps(answers, separators=(',', ':')),
+    )
+
+
+def archive_batch(alias, before, batch_size=500):
+    """Archive up to ``batch_size`` submissions from ``alias``; returns how many"""
+    submissions = list(archivable(alias, before)[:batch_size])
+    if not submissions:
+        return 0
+    ids = [submission.id for submission in submissions]
+    rows = {}
+    answers = sharding.using(Answer, alias).filter(submission_id__in=ids).order_by('submission_id', 'id')
+    for answer in answers.values('submission_id', 'question_id', 'selected_choice_id', 'text_answer', 'is_correct'):
+        rows.setdefault(answer['submission_id'], []).append(answer)
+
+    by_year = {}
+    for submission in submissions:
+        packed = submission.packed_answers
+        if packed is None:
+            packed = pack(rows.get(submission.id, []))
+        by_year.setdefault(submission.submitted_at.year, []).append(_archive_row(submission, packed))
+
+    # 1. Cold copies, committed before anything is removed
+    for year, archive_rows in by_year.items():
+        with closing(_connect(year, create=True)) as conn, conn:
+            conn.executemany('INSERT OR REPLACE INTO submission VALUES (?, ?, ?, ?, ?, ?, ?, ?)', archive_rows)
+
+    # 2. Stand-ins on the primary, then 3. the live rows
+    with transaction.atomic():
+        ArchivedSubmission.objects.bulk_create(
+            [
+                ArchivedSubmission(
+                    id=submission.id,
+                    quiz_id=submission.quiz_id,
+                    user_id=submission.user_id,
+                    score=submission.score,
+                    total_points=submission.total_points,
+                    submitted_at=submission.submitted_at,
+                    year=submission.submitted_at.year,
+                )
+                for submission in submissions
+            ],
+            ignore_conflicts=True,
+        )
+    with transaction.atomic(using=alias):
+        sharding.using(QuizSubmission, alias).filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive(days=None, batch_size=500, pause=0.0, limit=None):
+    """Archive in batches, yielding ``(alias, submissions, seconds)`` for each one"""
+    before = cutoff(days)
+    archived = 0
+    for alias in sharding.shard_aliases():
+        while limit is None or archived < limit:
+            size = batch_size if limit is None else min(batch_size, limit - archived)
+            started = time.perf_counter()
+            count = archive_batch(alias, before, size)
+            if not count:
+                break
+            archived += count
+            yield alias, count, time.perf_counter() - started
+            if pause:
+                time.sleep(pause)
+
+
+def load(stub):
+    """The archived submission behind an ``ArchivedSubmission``, as an unsaved object"""
+    conn = _connect(stub.year)
+    if conn is None:
+        raise QuizSubmission.DoesNotExist
+    with closing(conn):
+        row = conn.execute(
+            'SELECT id, quiz_id, user_id, score, total_points, submitted_at, time_taken_us, answers '
+            'FROM submission WHERE id = ?',
+            (stub.id,),
+        ).fetchone()
+    if row is None:
+        raise QuizSubmission.DoesNotExist
+    submission_id, quiz_id, user_id, score, total_points, submitted_at, time_taken_us, answers = row
+    return QuizSubmission(
+        id=submission_id,
+        quiz_id=quiz_id,
+        user_id=user_id,
+        score=score,
+        total_points=total_points,
+        submitted_at=datetime.fromisoformat(submitted_at),
+        time_taken=None if time_taken_us is None else timedelta(microseconds=time_taken_us),
+        status='graded',
+        packed_answers=json.loads(answers),
+    )
+
+
+def packed_answers(stubs):
+    """``{submission id: packed answers}`` for ``(id, year)`` pairs, one query per year file"""
+    by_year = {}
+    for submission_id, year in stubs:
+        by_year.setdefault(year, []).append(submission_id)
+    found = {}
+    for year, ids in by_year.items():
+        conn = _connect(year)
+        if conn is None:
+            continue
+        with closing(conn):
+            rows = conn.execute(
+                f'SELECT id, answers FROM submission WHERE id IN ({", ".join("?" * len(ids))})', ids
+            )
+            found.update((submission_id, json.loads(answers)) for submission_id, answers in rows)
+    return found
+
+
+def find_submission(**lookup):
+    """A live submission, or else an archived one, matching ``lookup``"""
+    try:
+        return sharding.find_submission(**lookup)
+    except QuizSubmission.DoesNotExist:
+        stub = ArchivedSubmission.objects.filter(**lookup).first()
+        if stub is None:
+            raise
+        return load(stub)
+
+
+def get_submission_or_404(**lookup):
+    try:
+        return find_submission(**lookup)
+    except QuizSubmission.DoesNotExist:
+        raise Http404('No QuizSubmission matches the given query.')
+
+
+def has_taken(quiz, user):
+    """Whether ``user`` has a live or archived submission for ``quiz``"""
+    return (
+        sharding.for_quiz(QuizSubmission, quiz.id).filter(quiz=quiz, user=user).exists()
+        or ArchivedSubmission.objects.filter(quiz=quiz, user=user).exists()
+    )
+
+
+def year_stats():
+    """``[(year, submissions in file, bytes)]`` for every archive file"""
+    stats = []
+    for path in sorted(archive_dir().glob('submissions_*.sqlite3')):
+        with closing(sqlite3.connect(path)) as conn:
+            count = conn.execute('SELECT COUNT(*) FROM submission').fetchone()[0]
+        stats.append((int(path.stem.split('_')[1]), count, path.stat().st_size))
+    return stats
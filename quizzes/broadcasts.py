@@ -0,0 +1,160 @@
+"""Batched delivery of notifications to every active user.
+
+Announcing something to the whole user base through ``create_notification``
+would run one INSERT per user inside the request. Instead the request only
+records a ``NotificationBroadcast``; ``manage.py send_broadcasts`` then walks
+the user table by primary key and bulk-inserts ``NOTIFICATION_BATCH_SIZE``
+notifications per transaction.
+
+Each batch advances the broadcast's ``last_user_id`` cursor in the same
+transaction as its inserts, so a worker that dies mid-broadcast resumes at
+the first undelivered user and nobody is notified twice. The cursor is
+advanced with a compare-and-set, so two workers on the same broadcast cannot
+both deliver a batch.
+
+Recipients who still have an unread notification of the broadcast's type
+within the digest window get it folded into that row (see
+``notifications.fold``) rather than a new one, as ``create_notification``
+does for single notifications.
+
+A new quiz is announced once, when its first questions are added. Deleting
+the quiz cancels an announcement that is still being delivered.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import notifications
+from .models import Notification, NotificationBroadcast, Quiz
+
+
+class CursorMoved(Exception):
+    """Another worker delivered the batch first"""
+
+
+def batch_size():
+    return getattr(settings, 'NOTIFICATION_BATCH_SIZE', 1000)
+
+
+def enqueue(notification_type, title, message, quiz=None, exclude_user=None):
+    """Record a broadcast for the worker; cheap enough to call from a request"""
+    return NotificationBroadcast.objects.create(
+        type=notification_type,
+        title=title,
+        message=message,
+        quiz=quiz,
+        exclude_user=exclude_user,
+    )
+
+
+def announce_quiz(quiz):
+    """Tell every other user that ``quiz`` is available, once it has questions
+
+    Returns the broadcast, or None when the quiz is empty, deleted or
+    already announced.
+    """
+    if quiz.deleted_at is not None or not quiz.questions.exists():
+        return None
+    with transaction.atomic():
+        if quiz.broadcasts.filter(type='new_quiz').exists():
+            return None
+        return enqueue(
+            'new_quiz',
+            'New Quiz Available',
+            f'"{quiz.title}" is ready to take.',
+            quiz=quiz,
+            exclude_user=quiz.creator,
+        )
+
+
+def cancel_for_quiz(quiz_id):
+    """Stop delivering the broadcasts about a deleted quiz; returns how many"""
+    return NotificationBroadcast.objects.filter(quiz_id=quiz_id, status='pending').update(
+        status='cancelled', completed_at=timezone.now()
+    )
+
+
+def _recipients(broadcast, size):
+    users = User.objects.filter(is_active=True, id__gt=broadcast.last_user_id)
+    if broadcast.exclude_user_id is not None:
+        users = users.exclude(id=broadcast.exclude_user_id)
+    return list(users.order_by('id').values_list('id', flat=True)[:size])
+
+
+def _fold_into_unread(broadcast, user_ids):
+    """Fold ``broadcast`` into the recipients' digest rows; return the user ids it went to"""
+    window = notifications.digest_window(broadcast.type)
+    if not window:
+        return set()
+    now = timezone.now()
+    rows = (
+        Notification.objects.select_for_update()
+        .filter(
+            user_id__in=user_ids, read=False, type=broadcast.type,
+            created_at__gte=now - timedelta(seconds=window),
+        )
+        .order_by('user_id', '-created_at')
+        .only('id', 'user_id', 'type', 'count', 'message')
+    )
+    latest = {}
+    for row in rows:
+        latest.setdefault(row.user_id, row)
+    for row in latest.values():
+        row.title, row.message, row.count = notifications.fold(row, broadcast.message)
+        row.created_at = now
+    Notification.objects.bulk_update(latest.values(), ['title', 'message', 'count', 'created_at'])
+    return set(latest)
+
+
+def deliver_batch(broadcast, size=None):
+    """Deliver the next batch of ``broadcast``; return how many were sent"""
+    if broadcast.quiz_id is not None and Quiz.objects.filter(
+        pk=broadcast.quiz_id, deleted_at__isnull=False
+    ).exists():
+        # The quiz was deleted while its announcement was going out
+        cancel_for_quiz(broadcast.quiz_id)
+        broadcast.status = 'cancelled'
+        return 0
+
+    user_ids = _recipients(broadcast, size or batch_size())
+    if not user_ids:
+        NotificationBroadcast.objects.filter(id=broadcast.id, status='pending').update(
+            status='done', completed_at=timezone.now()
+        )
+        broadcast.status = 'done'
+        return 0
+
+    with transaction.atomic():
+        moved = NotificationBroadcast.objects.filter(
+            id=broadcast.id, last_user_id=broadcast.last_user_id
+        ).update(last_user_id=user_ids[-1], sent_count=broadcast.sent_count + len(user_ids))
+        if not moved:
+            raise CursorMoved(broadcast.id)
+        folded = _fold_into_unread(broadcast, user_ids)
+        Notification.objects.bulk_create([
+            Notification(user_id=user_id, type=broadcast.type, title=broadcast.title, message=broadcast.message)
+            for user_id in user_ids if user_id not in folded
+        ])
+
+    broadcast.last_user_id = user_ids[-1]
+    broadcast.sent_count += len(user_ids)
+    return len(user_ids)
+
+
+def process(broadcast, size=None):
+    """Deliver ``broadcast`` to completion, yielding it after every batch"""
+    while broadcast.status == 'pending':
+        try:
+            if not deliver_batch(broadcast, size):
+                break
+        except CursorMoved:
+            broadcast.refresh_from_db()
+            continue
+        yield broadcast
+
+
+def pending():
+    return NotificationBroadcast.objects.filter(status='pending').order_by('id')
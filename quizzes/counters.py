@@ -0,0 +1,15 @@
+"""Helpers for denormalized counter tables."""
+from django.db.models import F
+
+
+def bump(model, lookup, **deltas):
+    """Add ``deltas`` to the counter row matching ``lookup``, creating it if needed.
+
+    The common case (row exists) is a single ``UPDATE``; a missing row is
+    inserted with ``ignore_conflicts`` so concurrent first writers do not fail.
+    """
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    model.objects.bulk_create([model(**lookup)], ignore_conflicts=True)
+    model.objects.filter(**lookup).update(**changes)
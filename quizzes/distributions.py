@@ -0,0 +1,140 @@
+"""Per-quiz score distributions.
+
+Every graded submission increments the ``QuizScoreBucket`` row for its quiz
+and score. Scores are whole points, so a quiz has at most ``total_points + 1``
+buckets and every distribution question (count, mean, extremes, "you beat X%")
+is answered from those few rows instead of scanning ``QuizSubmission``.
+"""
+import operator
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from . import sharding
+from .counters import bump
+from .models import ArchivedSubmission, QuizScoreBucket, QuizSubmission
+
+
+def record_score(submission, old_score=None):
+    """Count a graded submission, or move it from ``old_score`` after a regrade"""
+    if old_score is not None:
+        if old_score == submission.score:
+            return
+        bump(QuizScoreBucket, {'quiz_id': submission.quiz_id, 'score': old_score}, submissions=-1)
+    bump(QuizScoreBucket, {'quiz_id': submission.quiz_id, 'score': submission.score}, submissions=1)
+
+
+def score_counts(quiz_id):
+    """``[(score, submissions), ...]`` in ascending score order"""
+    return list(
+        QuizScoreBucket.objects.filter(quiz_id=quiz_id, submissions__gt=0)
+        .order_by('score')
+        .values_list('score', 'submissions')
+    )
+
+
+def percentile(quiz_id, score):
+    """Percentage of a quiz's submissions that scored below ``score``"""
+    totals = QuizScoreBucket.objects.filter(quiz_id=quiz_id).aggregate(
+        total=Sum('submissions'),
+        below=Sum('submissions', filter=Q(score__lt=score)),
+    )
+    if not totals['total']:
+        return 0
+    return round((totals['below'] or 0) * 100 / totals['total'], 1)
+
+
+def pass_percentage():
+    return getattr(settings, 'QUIZ_PASS_PERCENTAGE', 60)
+
+
+def summary(counts, total_points=None):
+    """Count, mean, minimum and maximum of a ``score_counts`` list
+
+    With ``total_points`` the share of submissions at or above the pass mark
+    is included as ``pass_rate``.
+    """
+    total = sum(submissions for score, submissions in counts)
+    if not total:
+        return {'count': 0, 'average': 0, 'min': 0, 'max': 0, 'pass_rate': 0}
+    stats = {
+        'count': total,
+        'average': round(sum(score * submissions for score, submissions in counts) / total, 2),
+        'min': counts[0][0],
+        'max': counts[-1][0],
+    }
+    if total_points is not None:
+        passed = sum(
+            submissions for score, submissions in counts
+            if score * 100 >= pass_percentage() * total_points
+        )
+        stats['pass_rate'] = round(passed * 100 / total, 1)
+    return stats
+
+
+def chart(counts, total_points, bins=10):
+    """Group ``score_counts`` into at most ``bins`` bars for display"""
+    if total_points <= 0:
+        return []
+    width = max(1, -(-(total_points + 1) // bins))
+    bars = []
+    for low in range(0, total_points + 1, width):
+        high = min(low + width - 1, total_points)
+        bars.append({
+            'label': f'{low}' if low == high else f'{low}-{high}',
+            'count': 0,
+        })
+    for score, submissions in counts:
+        index = min(max(score, 0) // width, len(bars) - 1)
+        bars[index]['count'] += submissions
+    tallest = max(bar['count'] for bar in bars) or 1
+    for bar in bars:
+        bar['height'] = round(bar['count'] * 100 / tallest)
+    return bars
+
+
+def quiz_totals(quiz_ids):
+    """``{quiz_id: (graded submissions, score sum)}`` for several quizzes"""
+    rows = (
+        QuizScoreBucket.objects.filter(quiz_id__in=quiz_ids)
+        .values('quiz_id')
+        .annotate(total=Sum('submissions'), score_sum=Sum(F('score') * F('submissions')))
+        .order_by()
+        .values_list('quiz_id', 'total', 'score_sum')
+    )
+    return {quiz_id: (total, score_sum) for quiz_id, total, score_sum in rows}
+
+
+def rebuild(quiz_id=None, batch_size=5000):
+    """Recompute buckets from ``QuizSubmission`` with one grouped query"""
+    submissions = QuizSubmission.objects.filter(status='graded')
+    archived = ArchivedSubmission.objects.all()
+    buckets = QuizScoreBucket.objects.all()
+    if quiz_id is not None:
+        submissions = submissions.filter(quiz_id=quiz_id)
+        archived = archived.filter(quiz_id=quiz_id)
+        buckets = buckets.filter(quiz_id=quiz_id)
+
+    def grouped(queryset):
+        return queryset.values('quiz_id', 'score').annotate(submissions=Count('id')).order_by()
+
+    rows = sharding.merged_rows(
+        grouped(submissions),
+        keys=('quiz_id', 'score'),
+        combine={'submissions': operator.add},
+        chunk_size=batch_size,
+        also=[grouped(archived)],
+    )
+    with transaction.atomic():
+        buckets.delete()
+        written = 0
+        batch = []
+        for row in rows:
+            batch.append(QuizScoreBucket(**row))
+            if len(batch) >= batch_size:
+                QuizScoreBucket.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        QuizScoreBucket.objects.bulk_create(batch)
+    return written + len(batch)
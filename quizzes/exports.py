@@ -0,0 +1,199 @@
+"""Streaming exports of quiz results.
+
+``submission_rows`` yields one dict per submission of a quiz and
+``answer_rows`` one per answer, live submissions first and then archived
+ones, each in id order. Submissions are read with ``.iterator(chunk_size=...)``
+and each chunk is completed with a fixed number of queries (usernames, answer
+rows, archive files); the quiz's questions and choices are loaded once up
+front. Memory therefore depends on ``chunk_size``, not on the size of the
+quiz.
+
+``stream`` encodes rows as CSV or NDJSON a buffer at a time, for a
+``StreamingHttpResponse`` or a file. CSV cells that a spreadsheet would run
+as a formula are escaped; NDJSON keeps the values as they are.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.contrib.auth.models import User
+
+from . import archive, sharding
+from .models import Answer, ArchivedSubmission, Choice, Question, QuizSubmission
+from .packed_answers import entries
+
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+SUBMISSION_FIELDS = [
+    'submission_id', 'username', 'score', 'total_points', 'percentage', 'status',
+    'submitted_at', 'time_taken_seconds', 'archived',
+]
+ANSWER_FIELDS = [
+    'submission_id', 'username', 'question_id', 'question_order', 'question',
+    'choice', 'text_answer', 'is_correct',
+]
+
+CHUNK_SIZE = 1000
+BUFFER_SIZE = 64 * 1024
+
+# Leading characters that make Excel and friends read a CSV cell as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _usernames(user_ids):
+    return dict(User.objects.filter(id__in=set(user_ids)).values_list('id', 'username'))
+
+
+def _live(quiz, fields, chunk_size):
+    return _chunks(
+        sharding.for_quiz(QuizSubmission, quiz.id).filter(quiz_id=quiz.id)
+        .order_by('id')
+        .values_list(*fields)
+        .iterator(chunk_size=chunk_size),
+        chunk_size,
+    )
+
+
+def _archived(quiz, fields, chunk_size):
+    return _chunks(
+        ArchivedSubmission.objects.filter(quiz_id=quiz.id)
+        .order_by('id')
+        .values_list(*fields)
+        .iterator(chunk_size=chunk_size),
+        chunk_size,
+    )
+
+
+def _submission_row(names, submission_id, user_id, score, total_points, status, submitted_at, time_taken, archived):
+    return {
+        'submission_id': submission_id,
+        'username': names.get(user_id, ''),
+        'score': score,
+        'total_points': total_points,
+        'percentage': round(score * 100 / total_points, 1) if total_points else 0,
+        'status': status,
+        'submitted_at': submitted_at.isoformat(),
+        'time_taken_seconds': None if time_taken is None else time_taken.total_seconds(),
+        'archived': archived,
+    }
+
+
+def submission_rows(quiz, chunk_size=CHUNK_SIZE):
+    """One dict per submission of ``quiz``, with the keys in ``SUBMISSION_FIELDS``"""
+    fields = ('id', 'user_id', 'score', 'total_points', 'status', 'submitted_at', 'time_taken')
+    for chunk in _live(quiz, fields, chunk_size):
+        names = _usernames(row[1] for row in chunk)
+        for row in chunk:
+            yield _submission_row(names, *row, archived=False)
+
+    # Archived submissions are graded by definition; their time is kept in the year file
+    fields = ('id', 'user_id', 'score', 'total_points', 'submitted_at')
+    for chunk in _archived(quiz, fields, chunk_size):
+        names = _usernames(row[1] for row in chunk)
+        for submission_id, user_id, score, total_points, submitted_at in chunk:
+            yield _submission_row(
+                names, submission_id, user_id, score, total_points, 'graded', submitted_at, None, archived=True,
+            )
+
+
+def answer_rows(quiz, chunk_size=CHUNK_SIZE):
+    """One dict per answer to ``quiz``, with the keys in ``ANSWER_FIELDS``"""
+    questions = {
+        question_id: (order, text)
+        for question_id, order, text in Question.objects.filter(quiz_id=quiz.id).values_list('id', 'order', 'question_text')
+    }
+    choices = dict(Choice.objects.filter(question__quiz_id=quiz.id).values_list('id', 'choice_text'))
+
+    def rows(names, submission_id, user_id, answers):
+        for question_id, choice_id, text, is_correct in answers:
+            # Answers to deleted questions are dropped, as on the results page
+            if question_id not in questions:
+                continue
+            order, question_text = questions[question_id]
+            yield {
+                'submission_id': submission_id,
+                'username': names.get(user_id, ''),
+                'question_id': question_id,
+                'question_order': order,
+                'question': question_text,
+                'choice': choices.get(choice_id, ''),
+                'text_answer': text,
+                'is_correct': is_correct,
+            }
+
+    for chunk in _live(quiz, ('id', 'user_id', 'packed_answers'), chunk_size):
+        names = _usernames(row[1] for row in chunk)
+        stored = {}
+        answers = (
+            sharding.for_quiz(Answer, quiz.id)
+            .filter(submission_id__in=[submission_id for submission_id, _, packed in chunk if packed is None])
+            .order_by('submission_id', 'id')
+            .values_list('submission_id', 'question_id', 'selected_choice_id', 'text_answer', 'is_correct')
+        )
+        for submission_id, *answer in answers:
+            stored.setdefault(submission_id, []).append(answer)
+        for submission_id, user_id, packed in chunk:
+            answers = stored.get(submission_id, ()) if packed is None else entries(packed)
+            yield from rows(names, submission_id, user_id, answers)
+
+    for chunk in _archived(quiz, ('id', 'user_id', 'year'), chunk_size):
+        names = _usernames(row[1] for row in chunk)
+        packed = archive.packed_answers((submission_id, year) for submission_id, _, year in chunk)
+        for submission_id, user_id, _ in chunk:
+            if submission_id in packed:
+                yield from rows(names, submission_id, user_id, entries(packed[submission_id]))
+
+
+class _Echo:
+    """File-like object whose ``write`` hands back the line ``csv`` produced"""
+
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    """``value`` with a leading ``'`` if a spreadsheet would run it as a formula"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _lines(rows, fields, fmt):
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([_cell(row[field]) for field in fields])
+    else:
+        for row in rows:
+            yield json.dumps(row, separators=(',', ':')) + '\n'
+
+
+def stream(quiz, fmt='csv', answers=False, chunk_size=CHUNK_SIZE):
+    """Encoded export of ``quiz``, as strings of about ``BUFFER_SIZE`` characters"""
+    if answers:
+        lines = _lines(answer_rows(quiz, chunk_size), ANSWER_FIELDS, fmt)
+    else:
+        lines = _lines(submission_rows(quiz, chunk_size), SUBMISSION_FIELDS, fmt)
+    # One write per line would make each CSV row its own response chunk
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
@@ -1,3 +1,5 @@
+import re
+
 from django import forms
 from .models import Quiz, Question, Choice
 
@@ -5,12 +7,15 @@ from .models import Quiz, Question, Choice
 class QuizForm(forms.ModelForm):
     class Meta:
         model = Quiz
-        fields = ['title', 'description', 'time_limit', 'max_attempts']
+        fields = ['title', 'description', 'subject', 'time_limit', 'max_attempts']
         widgets = {
             'title': forms.TextInput(attrs={
                 'class': 'form-control',
                 'placeholder': 'Enter quiz title'
             }),
+            'subject': forms.Select(attrs={
+                'class': 'form-select'
+            }),
             'description': forms.Textarea(attrs={
                 'class': 'form-control',
                 'rows': 4,
@@ -32,9 +37,18 @@ class QuizForm(forms.ModelForm):
 
 
 class QuestionForm(forms.ModelForm):
+    accepted_answers = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={
+            'class': 'form-control',
+            'rows': 3,
+            'placeholder': 'One accepted answer per line'
+        })
+    )
+    
     class Meta:
         model = Question
-        fields = ['question_text', 'question_type', 'points']
+        fields = ['question_text', 'question_type', 'points', 'accepted_answers', 'answer_match']
         widgets = {
             'question_text': forms.Textarea(attrs={
                 'class': 'form-control',
@@ -50,8 +64,32 @@ class QuestionForm(forms.ModelForm):
                 'min': 1,
                 'max': 10,
                 'value': 1
+            }),
+            'answer_match': forms.Select(attrs={
+                'class': 'form-select'
             })
         }
+    
+    def clean_accepted_answers(self):
+        value = self.cleaned_data.get('accepted_answers') or ''
+        return [line.strip() for line in value.splitlines() if line.strip()]
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('question_type') != 'sa':
+            cleaned_data['accepted_answers'] = []
+            return cleaned_data
+        
+        accepted = cleaned_data.get('accepted_answers') or []
+        if not accepted:
+            self.add_error('accepted_answers', 'Enter at least one accepted answer.')
+        elif cleaned_data.get('answer_match') == 'regex':
+            for pattern in accepted:
+                try:
+                    re.compile(pattern)
+                except re.error as exc:
+                    self.add_error('accepted_answers', f'Invalid regular expression "{pattern}": {exc}')
+        return cleaned_data
 
 
 class ChoiceForm(forms.ModelForm):
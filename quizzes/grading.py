@@ -0,0 +1,405 @@
+"""Set-based grading of quiz submissions.
+
+A submission is graded entirely in memory against the quiz's compiled answer
+key (see ``answer_keys.py``) and written back with a fixed number of queries,
+however many questions the quiz has.
+
+With ``QUIZ_GRADING_MODE = 'queued'`` the request only stores the raw answers
+in a ``PendingGrade`` row; the ``grade_submissions`` management command drains
+that queue in batches.
+
+Answers are written as rows or packed onto the submission depending on
+``ANSWER_STORAGE`` (see ``packed_answers.py``); regrading handles both.
+
+Submission rows are written through ``sharding`` so they land on the quiz's
+shard when ``QUIZ_SUBMISSION_SHARDS`` is set; rollups stay on ``default``.
+"""
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from . import achievements, activity, distributions, leaderboards, ranking, sharding, subjects
+from .answer_keys import get_answer_key
+from .api_views import create_notification, update_user_streak
+from .models import Answer, PendingGrade, Quiz, QuizSubmission, UserProfile
+from .packed_answers import answer_storage, pack, repack, unpack
+
+
+MAX_GRADING_ATTEMPTS = 5
+
+
+def grading_mode():
+    """Return ``'sync'`` or ``'queued'``"""
+    return getattr(settings, 'QUIZ_GRADING_MODE', 'sync')
+
+
+def check_answer(entry, choice_id=None, text=''):
+    """Return whether an answer is correct under an answer key entry"""
+    if entry.type == 'mc':
+        return choice_id in entry.correct_ids
+    if entry.type == 'tf':
+        return entry.correct_text is not None and text == entry.correct_text
+    if entry.type == 'sa':
+        return entry.matcher is not None and entry.matcher.matches(text)
+    return False
+
+
+def grade_answers(key, data):
+    """Grade submitted form data against an answer key.
+
+    Returns ``(score, answers)`` where ``answers`` is a list of unsaved
+    ``Answer`` keyword dicts. No queries are issued.
+    """
+    score = 0
+    answers = []
+    for question_id, entry in key.entries.items():
+        value = data.get(f'question_{question_id}')
+
+        if entry.type == 'mc':
+            if not value:
+                continue
+            try:
+                choice_id = int(value)
+            except (TypeError, ValueError):
+                continue
+            # Ignore choices that do not belong to this question
+            if choice_id not in entry.choice_ids:
+                continue
+            is_correct = check_answer(entry, choice_id=choice_id)
+            answers.append({
+                'question_id': question_id,
+                'selected_choice_id': choice_id,
+                'is_correct': is_correct,
+            })
+        elif entry.type in ('tf', 'sa'):
+            is_correct = check_answer(entry, text=value or '')
+            answers.append({
+                'question_id': question_id,
+                'text_answer': value or '',
+                'is_correct': is_correct,
+            })
+        else:
+            continue
+
+        if is_correct:
+            score += entry.points
+
+    return score, answers
+
+
+def submit_quiz(quiz, user, data, key):
+    """Grade and record a quiz submission in a single transaction"""
+    score, answers = grade_answers(key, data)
+    packed = pack(answers) if answer_storage() == 'packed' else None
+    submission_id = sharding.next_submission_id()
+    alias = sharding.shard_for_quiz(quiz.id)
+
+    with sharding.atomic(alias):
+        submission = sharding.using(QuizSubmission, alias).create(
+            id=submission_id,
+            quiz=quiz,
+            user=user,
+            score=score,
+            total_points=key.total_points,
+            packed_answers=packed,
+        )
+        if packed is None:
+            sharding.using(Answer, alias).bulk_create(
+                [Answer(submission=submission, **answer) for answer in answers]
+            )
+        record_submission(submission)
+
+    return submission
+
+
+def record_submission(submission):
+    """Apply a graded submission to the user's running totals"""
+    profile, created = UserProfile.objects.get_or_create(user_id=submission.user_id)
+    UserProfile.objects.filter(pk=profile.pk).update(
+        total_quizzes_taken=F('total_quizzes_taken') + 1,
+        total_score=F('total_score') + submission.score,
+    )
+    # Read back inside the transaction so the rank index sees the committed totals
+    profile.refresh_from_db(fields=['total_quizzes_taken', 'total_score'])
+    old_score = profile.total_score - submission.score if profile.total_quizzes_taken > 1 else None
+    ranking.apply_moves([(old_score, profile.total_score)])
+    leaderboards.record_daily_score(submission)
+    activity.record_activity(submission)
+    distributions.record_score(submission)
+    subjects.record_attempt(submission, submission.quiz.subject_id)
+
+    streak = update_user_streak(submission.user)
+    for achievement in achievements.evaluate_submission(submission, profile, streak):
+        create_notification(
+            submission.user,
+            'achievement',
+            f'Achievement Unlocked: {achievement.name}',
+            achievement.description,
+        )
+
+
+def enqueue_submission(quiz, user, data, key):
+    """Store the raw answers of a submission for the grading worker"""
+    answers = {}
+    for question_id in key.entries:
+        field = f'question_{question_id}'
+        if data.get(field):
+            answers[field] = data.get(field)
+    submission_id = sharding.next_submission_id()
+    alias = sharding.shard_for_quiz(quiz.id)
+
+    with sharding.atomic(alias):
+        submission = sharding.using(QuizSubmission, alias).create(
+            id=submission_id,
+            quiz=quiz,
+            user=user,
+            total_points=key.total_points,
+            status='pending',
+        )
+        sharding.using(PendingGrade, alias).create(submission=submission, answers=answers)
+
+    return submission
+
+
+def claim_pending(batch_size, worker='worker', claim_timeout=300):
+    """Claim up to ``batch_size`` queued submissions for this worker.
+
+    Claims older than ``claim_timeout`` seconds are considered abandoned (the
+    worker died) and can be claimed again. Shards are drained in turn.
+    """
+    now = timezone.now()
+    claimable = Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - timedelta(seconds=claim_timeout))
+    token = f'{worker}:{uuid.uuid4().hex[:12]}'
+    claimed = []
+    for alias in sharding.shard_aliases():
+        queue = sharding.using(PendingGrade, alias).filter(claimable, attempts__lt=MAX_GRADING_ATTEMPTS)
+        ids = list(queue.values_list('id', flat=True)[:batch_size - len(claimed)])
+        if not ids:
+            continue
+        queue.filter(id__in=ids).update(claimed_at=now, claimed_by=token, attempts=F('attempts') + 1)
+        claimed.extend(sharding.using(PendingGrade, alias).filter(claimed_by=token).select_related('submission'))
+        if len(claimed) >= batch_size:
+            break
+    return claimed
+
+
+def grade_pending(pending):
+    """Grade claimed queue rows and record them, one transaction per shard"""
+    quizzes = Quiz.objects.in_bulk({item.submission.quiz_id for item in pending})
+    submissions = []
+    for alias, items in _by_shard(pending).items():
+        submissions.extend(_grade_shard(alias, items, quizzes))
+    return submissions
+
+
+def _by_shard(rows):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row._state.db].append(row)
+    return groups
+
+
+def _grade_shard(alias, pending, quizzes):
+    packed = answer_storage() == 'packed'
+    submissions = []
+    answers = []
+    for item in pending:
+        submission = item.submission
+        submission.quiz = quizzes[submission.quiz_id]
+        key = get_answer_key(submission.quiz)
+        score, rows = grade_answers(key, item.answers)
+        submission.score = score
+        submission.total_points = key.total_points
+        submission.status = 'graded'
+        submissions.append(submission)
+        if packed:
+            submission.packed_answers = pack(rows)
+        else:
+            answers.extend(Answer(submission=submission, **row) for row in rows)
+
+    with sharding.atomic(alias):
+        sharding.using(Answer, alias).bulk_create(answers)
+        sharding.using(QuizSubmission, alias).bulk_update(
+            submissions, ['score', 'total_points', 'status', 'packed_answers']
+        )
+        for submission in submissions:
+            record_submission(submission)
+        sharding.using(PendingGrade, alias).filter(id__in=[item.id for item in pending]).delete()
+
+    return submissions
+
+
+def release_pending(pending, error):
+    """Put claimed rows back on the queue after a failed grading attempt.
+
+    Submissions that have used up ``MAX_GRADING_ATTEMPTS`` are marked
+    ``failed`` instead of waiting forever; returns how many.
+    """
+    failed = 0
+    for alias, items in _by_shard(pending).items():
+        sharding.using(PendingGrade, alias).filter(id__in=[item.id for item in items]).update(
+            claimed_at=None,
+            claimed_by='',
+            last_error=str(error),
+        )
+        exhausted = [item.submission_id for item in items if item.attempts >= MAX_GRADING_ATTEMPTS]
+        if exhausted:
+            failed += sharding.using(QuizSubmission, alias).filter(
+                id__in=exhausted, status='pending',
+            ).update(status='failed')
+    return failed
+
+
+def fail_exhausted(claim_timeout=300):
+    """Mark submissions whose last attempt was abandoned by its worker as ``failed``"""
+    idle = Q(claimed_at__isnull=True) | Q(claimed_at__lt=timezone.now() - timedelta(seconds=claim_timeout))
+    failed = 0
+    for alias in sharding.shard_aliases():
+        ids = list(
+            sharding.using(PendingGrade, alias)
+            .filter(idle, attempts__gte=MAX_GRADING_ATTEMPTS, submission__status='pending')
+            .values_list('submission_id', flat=True)
+        )
+        if ids:
+            failed += sharding.using(QuizSubmission, alias).filter(
+                id__in=ids, status='pending',
+            ).update(status='failed')
+    return failed
+
+
+def retry_failed():
+    """Queue every failed submission again with fresh attempts; returns how many"""
+    retried = 0
+    for alias in sharding.shard_aliases():
+        with sharding.atomic(alias):
+            ids = list(
+                sharding.using(QuizSubmission, alias).filter(status='failed').values_list('id', flat=True)
+            )
+            sharding.using(PendingGrade, alias).filter(submission_id__in=ids).update(
+                attempts=0, claimed_at=None, claimed_by='',
+            )
+            retried += sharding.using(QuizSubmission, alias).filter(id__in=ids).update(status='pending')
+    return retried
+
+
+def record_score_changes(changes):
+    """Apply re-graded scores to running totals.
+
+    ``changes`` is a list of ``(submission, old_score, old_total_points)``
+    tuples whose ``submission`` already holds the new values.
+    """
+    deltas = {}
+    for submission, old_score, old_total_points in changes:
+        delta = submission.score - old_score
+        points_delta = submission.total_points - old_total_points
+        if delta:
+            deltas[submission.user_id] = deltas.get(submission.user_id, 0) + delta
+            leaderboards.record_daily_score(submission, score_delta=delta, quizzes_delta=0)
+            activity.record_activity(submission, score_delta=delta, quizzes_delta=0)
+            distributions.record_score(submission, old_score=old_score)
+        if delta or points_delta:
+            subjects.record_attempt(
+                submission, submission.quiz.subject_id,
+                score_delta=delta, attempts_delta=0, points_delta=points_delta,
+            )
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    UserProfile.objects.filter(user_id__in=deltas).update(
+        total_score=F('total_score') + Case(
+            *[When(user_id=user_id, then=Value(delta)) for user_id, delta in deltas.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+    totals = UserProfile.objects.filter(user_id__in=deltas, total_quizzes_taken__gt=0).values_list('user_id', 'total_score')
+    ranking.apply_moves([(total - deltas[user_id], total) for user_id, total in totals])
+
+
+def regrade_quiz(quiz, chunk_size=2000):
+    """Re-score every graded submission of a quiz against its current key.
+
+    Submissions are read ``chunk_size`` at a time by keyset (``id`` after the
+    last one seen), each chunk with its own answer rows; packed submissions
+    carry their own answers. Every read finishes before the chunk is written
+    back with bulk updates in its own transaction, so no cursor stays open
+    across the writes. Yields ``(submissions_seen, submissions_changed)``
+    after every chunk.
+    """
+    key = get_answer_key(quiz)
+    alias = sharding.shard_for_quiz(quiz.id)
+    submissions = (
+        sharding.using(QuizSubmission, alias).filter(quiz=quiz, status='graded')
+        .only('id', 'quiz_id', 'user_id', 'score', 'total_points', 'submitted_at', 'packed_answers')
+        .order_by('id')
+    )
+
+    seen = changed = 0
+    last_id = 0
+    while chunk := list(submissions.filter(id__gt=last_id)[:chunk_size]):
+        last_id = chunk[-1].id
+        stored = {}
+        answers = (
+            sharding.using(Answer, alias)
+            .filter(submission_id__in=[submission.id for submission in chunk if submission.packed_answers is None])
+            .only('id', 'submission_id', 'question_id', 'selected_choice_id', 'text_answer', 'is_correct')
+            .order_by('submission_id', 'id')
+        )
+        for answer in answers:
+            stored.setdefault(answer.submission_id, []).append(answer)
+
+        changed_answers = []
+        repacked = []
+        changes = []
+        for submission in chunk:
+            submission.quiz = quiz
+            is_packed = submission.packed_answers is not None
+            rows = unpack(submission) if is_packed else stored.get(submission.id, [])
+
+            score = 0
+            rows_changed = False
+            for row in rows:
+                entry = key.entries.get(row.question_id)
+                is_correct = entry is not None and check_answer(
+                    entry, choice_id=row.selected_choice_id, text=row.text_answer
+                )
+                if is_correct:
+                    score += entry.points
+                if is_correct != row.is_correct:
+                    row.is_correct = is_correct
+                    rows_changed = True
+                    if not is_packed:
+                        changed_answers.append(row)
+            if is_packed and rows_changed:
+                submission.packed_answers = repack(rows)
+                repacked.append(submission)
+
+            if score != submission.score or key.total_points != submission.total_points:
+                changes.append((submission, submission.score, submission.total_points))
+                submission.score = score
+                submission.total_points = key.total_points
+
+        seen += len(chunk)
+        changed += _flush_regrade(alias, changed_answers, repacked, changes, chunk_size)
+        yield seen, changed
+
+
+def _flush_regrade(alias, answers, repacked, changes, batch_size):
+    with sharding.atomic(alias):
+        if answers:
+            sharding.using(Answer, alias).bulk_update(answers, ['is_correct'], batch_size=batch_size)
+        if repacked:
+            sharding.using(QuizSubmission, alias).bulk_update(repacked, ['packed_answers'], batch_size=batch_size)
+        if changes:
+            sharding.using(QuizSubmission, alias).bulk_update(
+                [change[0] for change in changes],
+                ['score', 'total_points'],
+                batch_size=batch_size,
+            )
+            record_score_changes(changes)
+    return len(changes)
@@ -0,0 +1,148 @@
+"""Weekly, monthly and all-time leaderboards.
+
+Each graded submission adds its points to the user's ``DailyScoreBucket`` for
+that day (one counter update). A window's leaderboard merges the buckets from
+the window's first day onwards, which touches at most ``users x days`` small
+rows instead of aggregating ``QuizSubmission``. The window's bucket ids come
+from a range search on the ``(day, user)`` index; grouping the buckets
+directly would make SQLite walk the whole ``(user, day)`` unique index in
+user order instead. The merged top list is cached for
+``LEADERBOARD_CACHE_TIMEOUT`` seconds. The all-time board is read from the
+running totals on ``UserProfile``, which equal the sum of every bucket.
+"""
+import operator
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import Cast, TruncDate
+from django.utils import timezone
+
+from . import sharding
+from .counters import bump
+from .models import ArchivedSubmission, DailyScoreBucket, QuizSubmission, UserProfile
+
+
+WINDOWS = (
+    ('week', 'This Week'),
+    ('month', 'This Month'),
+    ('all', 'All Time'),
+)
+
+
+class LeaderboardEntry(namedtuple('LeaderboardEntry', ['user_id', 'username', 'is_admin', 'total_quizzes_taken', 'total_score'])):
+    __slots__ = ()
+
+    @property
+    def average_score(self):
+        if self.total_quizzes_taken > 0:
+            return round(self.total_score / self.total_quizzes_taken, 2)
+        return 0
+
+
+def window_start(window, today=None):
+    """First day of a window, or ``None`` for all time"""
+    today = today or timezone.localdate()
+    if window == 'week':
+        return today - timedelta(days=today.weekday())
+    if window == 'month':
+        return today.replace(day=1)
+    return None
+
+
+def record_daily_score(submission, score_delta=None, quizzes_delta=1):
+    """Add a graded submission to its user's bucket for the day"""
+    bump(
+        DailyScoreBucket,
+        {'user_id': submission.user_id, 'day': timezone.localdate(submission.submitted_at)},
+        quizzes_taken=quizzes_delta,
+        total_score=submission.score if score_delta is None else score_delta,
+    )
+
+
+def top_users(window='all', limit=50):
+    """Top ``limit`` users of a window, ordered by average points per quiz"""
+    start = window_start(window)
+    cache_key = f'quizzes:leaderboard:{window}:{start}:{limit}'
+    entries = cache.get(cache_key)
+    if entries is not None:
+        return entries
+
+    average = Cast('score', FloatField()) / F('quizzes')
+    if start is None:
+        rows = (
+            UserProfile.objects.filter(total_quizzes_taken__gt=0)
+            .annotate(score=F('total_score'), quizzes=F('total_quizzes_taken'), average=average)
+            .order_by('-average', '-score', 'user_id')
+            .values('user_id', 'user__username', 'is_admin', 'score', 'quizzes')[:limit]
+        )
+    else:
+        in_window = DailyScoreBucket.objects.filter(day__gte=start).values('id')
+        rows = (
+            DailyScoreBucket.objects.filter(id__in=in_window)
+            .values('user_id')
+            .annotate(score=Sum('total_score'), quizzes=Sum('quizzes_taken'))
+            .filter(quizzes__gt=0)
+            .annotate(average=average)
+            .order_by('-average', '-score', 'user_id')
+            .values('user_id', 'user__username', 'user__userprofile__is_admin', 'score', 'quizzes')[:limit]
+        )
+
+    entries = [
+        LeaderboardEntry(
+            user_id=row['user_id'],
+            username=row['user__username'],
+            is_admin=bool(row.get('is_admin', row.get('user__userprofile__is_admin'))),
+            total_quizzes_taken=row['quizzes'],
+            total_score=row['score'],
+        )
+        for row in rows
+    ]
+    cache.set(cache_key, entries, getattr(settings, 'LEADERBOARD_CACHE_TIMEOUT', 60))
+    return entries
+
+
+def backfill(chunk_size=5000):
+    """Rebuild every bucket from ``QuizSubmission`` in one streaming pass"""
+    def grouped(queryset):
+        return (
+            queryset.annotate(day=TruncDate('submitted_at'))
+            .values('user_id', 'day')
+            .annotate(quizzes=Count('id'), score=Sum('score'))
+            .order_by()
+        )
+
+    rows = sharding.merged_rows(
+        grouped(QuizSubmission.objects.filter(status='graded')),
+        keys=('user_id', 'day'),
+        combine={'quizzes': operator.add, 'score': operator.add},
+        chunk_size=chunk_size,
+        also=[grouped(ArchivedSubmission.objects.all())],
+    )
+    written = 0
+    batch = []
+    for row in rows:
+        batch.append(DailyScoreBucket(
+            user_id=row['user_id'],
+            day=row['day'],
+            quizzes_taken=row['quizzes'],
+            total_score=row['score'],
+        ))
+        if len(batch) >= chunk_size:
+            written += _write_buckets(batch)
+            batch = []
+    if batch:
+        written += _write_buckets(batch)
+    return written
+
+
+def _write_buckets(batch):
+    DailyScoreBucket.objects.bulk_create(
+        batch,
+        update_conflicts=True,
+        unique_fields=['user', 'day'],
+        update_fields=['quizzes_taken', 'total_score'],
+    )
+    return len(batch)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import archive
+
+
+class Command(BaseCommand):
+    help = 'Move graded submissions older than N days into yearly SQLite archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Keep submissions newer than this many days (default: SUBMISSION_ARCHIVE_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Submissions per batch')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after this many submissions')
+        parser.add_argument('--stats', action='store_true',
+                            help='Only list the archive files')
+
+    def handle(self, *args, **options):
+        if not options['stats']:
+            total = 0
+            for alias, count, seconds in archive.archive(
+                options['days'], options['batch_size'], options['pause'], options['limit']
+            ):
+                total += count
+                self.stdout.write(f'  {alias}: archived {count} submissions in {seconds * 1000:.1f}ms')
+            self.stdout.write(self.style.SUCCESS(f'Archived {total} submissions.'))
+
+        for year, count, size in archive.year_stats():
+            self.stdout.write(f'{year}: {count} submissions, {size / 1024 / 1024:.1f} MiB')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import achievements
+
+
+class Command(BaseCommand):
+    help = 'Evaluate achievement rules for every user who has taken a quiz'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Users evaluated per batch')
+
+    def handle(self, *args, **options):
+        awarded = 0
+        for batch, count in enumerate(achievements.backfill(batch_size=options['batch_size']), start=1):
+            awarded += count
+            self.stdout.write(f'Batch {batch}: awarded {count} achievements')
+
+        self.stdout.write(self.style.SUCCESS(f'Done. Awarded {awarded} achievements.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import leaderboards
+from quizzes.models import DailyScoreBucket
+
+
+class Command(BaseCommand):
+    help = 'Build the per-user daily score buckets behind the windowed leaderboards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Buckets streamed and written per batch')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete existing buckets first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = DailyScoreBucket.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} buckets')
+
+        written = leaderboards.backfill(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} daily score buckets.'))
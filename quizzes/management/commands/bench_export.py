@@ -0,0 +1,55 @@
+import resource
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+
+from quizzes import exports
+from quizzes.models import Quiz
+from quizzes.routers import async_replica_iterator
+
+
+class Command(BaseCommand):
+    help = 'Export a quiz to nowhere, as under WSGI and ASGI, and report throughput and peak RSS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_id', type=int)
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--answers', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE)
+        parser.add_argument('--materialize', action='store_true',
+                            help='Also build the whole export as one string afterwards, for comparison')
+
+    def handle(self, *args, **options):
+        try:
+            quiz = Quiz.objects.get(id=options['quiz_id'])
+        except Quiz.DoesNotExist:
+            raise CommandError(f'Quiz {options["quiz_id"]} does not exist.')
+
+        # ru_maxrss only grows, so the streamed runs have to come first
+        self.run('wsgi', lambda: sum(len(chunk) for chunk in self.stream(quiz, options)))
+        self.run('asgi', lambda: async_to_sync(self.consume)(quiz, options))
+        if options['materialize']:
+            self.run('materialized', lambda: len(''.join(list(self.stream(quiz, options)))))
+
+    def stream(self, quiz, options):
+        return exports.stream(quiz, options['format'], options['answers'], options['chunk_size'])
+
+    async def consume(self, quiz, options):
+        # The body as the ASGI handler reads it, one chunk per worker thread call
+        size = 0
+        async for chunk in async_replica_iterator(self.stream(quiz, options)):
+            size += len(chunk)
+        return size
+
+    def run(self, label, export):
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        size = export()
+        seconds = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(
+            f'{label:>12}: {size / 1024 / 1024:.1f} MiB in {seconds:.2f}s '
+            f'({size / 1024 / 1024 / seconds if seconds else 0:.1f} MiB/s), '
+            f'peak RSS {rss_after / 1024:.1f} MiB (+{(rss_after - rss_before) / 1024:.1f} MiB)'
+        )
@@ -0,0 +1,129 @@
+import asyncio
+import resource
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+from quizmaster.asgi import application
+from quizzes import notifications
+
+
+class Connection:
+    """One fake browser tab driving the ASGI app directly"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.status = None
+        self.ready = asyncio.Event()
+        self.notified = asyncio.Event()
+        self.disconnect = asyncio.Event()
+        self.requested = False
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            if self.status != 200:
+                self.ready.set()
+        elif message['type'] == 'http.response.body':
+            body = message.get('body', b'')
+            if b'event: ready' in body:
+                self.ready.set()
+            if b'event: notification' in body:
+                self.notified.set()
+
+    async def run(self):
+        await application(self.scope, self.receive, self.send)
+
+
+class Command(BaseCommand):
+    help = 'Open idle notification streams against the ASGI app and measure what one worker holds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--username', help='User to connect as (default: the first user)')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--timeout', type=float, default=60)
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['username']:
+            users = users.filter(username=options['username'])
+        user = users.first()
+        if user is None:
+            raise CommandError('No user to connect as.')
+
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        try:
+            asyncio.run(self.bench(user, session.session_key, options))
+        finally:
+            session.delete()
+
+    async def bench(self, user, session_key, options):
+        path = '/api/notifications/stream/'
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': b'',
+            'headers': [
+                (b'host', options['host'].encode()),
+                (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()),
+            ],
+            'client': ('127.0.0.1', 0),
+            'server': (options['host'], 80),
+        }
+        count = options['connections']
+        timeout = options['timeout']
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        connections = [Connection(scope) for _ in range(count)]
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(connection.run()) for connection in connections]
+        await asyncio.wait_for(asyncio.gather(*(c.ready.wait() for c in connections)), timeout)
+        open_seconds = time.perf_counter() - started
+
+        refused = [c.status for c in connections if c.status != 200]
+        if refused:
+            raise CommandError(f'{len(refused)} streams were refused (first status: {refused[0]}).')
+
+        held = notifications.connection_count()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(f'Opened {held} streams in {open_seconds:.2f}s')
+        self.stdout.write(
+            f'Peak RSS grew by {(rss_after - rss_before) / 1024:.1f} MiB '
+            f'(~{(rss_after - rss_before) / max(held, 1):.1f} KiB per stream)'
+        )
+
+        started = time.perf_counter()
+        await sync_to_async(notifications.publish)(user.id, {'event': 'bench'})
+        await asyncio.wait_for(asyncio.gather(*(c.notified.wait() for c in connections)), timeout)
+        self.stdout.write(f'One event reached all {count} streams in {(time.perf_counter() - started) * 1000:.1f}ms')
+
+        for connection in connections:
+            connection.disconnect.set()
+        await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout)
+        left = notifications.connection_count()
+        if left:
+            raise CommandError(f'{left} streams were still subscribed after disconnecting.')
+        self.stdout.write(self.style.SUCCESS('All streams closed cleanly.'))
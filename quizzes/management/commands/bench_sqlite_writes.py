@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+SCHEMA = '''
+CREATE TABLE profile (id INTEGER PRIMARY KEY, total_score INTEGER NOT NULL, quizzes INTEGER NOT NULL);
+CREATE TABLE submission (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, score INTEGER NOT NULL);
+CREATE TABLE answer (id INTEGER PRIMARY KEY, submission_id INTEGER NOT NULL, question INTEGER NOT NULL, correct INTEGER NOT NULL);
+CREATE INDEX answer_submission ON answer (submission_id);
+'''
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent submission throughput under default and production SQLite settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--answers', type=int, default=10,
+                            help='Answer rows written per submission')
+        parser.add_argument('--users', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        profiles = [
+            ('default', {}, 'BEGIN'),
+            ('production', settings.SQLITE_PRODUCTION_PRAGMAS, 'BEGIN IMMEDIATE'),
+        ]
+        for name, pragmas, begin in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                result = self.run(os.path.join(directory, 'bench.sqlite3'), pragmas, begin, options)
+            self.stdout.write(
+                f'{name:>10}: {result["commits"] / result["seconds"]:8.1f} submissions/s, '
+                f'{result["reads"] / result["seconds"]:8.1f} reads/s, '
+                f'{result["locked"]} "database is locked" errors'
+            )
+
+    def connect(self, path, pragmas):
+        # isolation_level=None leaves BEGIN/COMMIT to us, like Django does
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        for pragma, value in pragmas.items():
+            conn.execute(f'PRAGMA {pragma}={value}')
+        return conn
+
+    def run(self, path, pragmas, begin, options):
+        setup = self.connect(path, pragmas)
+        setup.executescript(SCHEMA)
+        setup.executemany('INSERT INTO profile VALUES (?, 0, 0)', [(i,) for i in range(options['users'])])
+        setup.close()
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        totals = {'commits': 0, 'reads': 0, 'locked': 0}
+
+        def count(key):
+            with lock:
+                totals[key] += 1
+
+        def writer(number):
+            conn = self.connect(path, pragmas)
+            user = number
+            while not stop.is_set():
+                user = (user + options['writers']) % options['users']
+                try:
+                    conn.execute(begin)
+                    # Read first, as grading does, so a deferred transaction
+                    # has to upgrade its lock to write
+                    conn.execute('SELECT total_score FROM profile WHERE id = ?', (user,)).fetchone()
+                    submission = conn.execute(
+                        'INSERT INTO submission (user_id, score) VALUES (?, ?)', (user, 7)
+                    ).lastrowid
+                    conn.executemany(
+                        'INSERT INTO answer (submission_id, question, correct) VALUES (?, ?, 1)',
+                        [(submission, question) for question in range(options['answers'])],
+                    )
+                    conn.execute(
+                        'UPDATE profile SET total_score = total_score + 7, quizzes = quizzes + 1 WHERE id = ?',
+                        (user,),
+                    )
+                    conn.execute('COMMIT')
+                    count('commits')
+                except sqlite3.OperationalError as exc:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    if 'locked' not in str(exc):
+                        raise
+                    count('locked')
+            conn.close()
+
+        def reader():
+            conn = self.connect(path, pragmas)
+            while not stop.is_set():
+                try:
+                    conn.execute(
+                        'SELECT id, total_score FROM profile ORDER BY total_score DESC LIMIT 10'
+                    ).fetchall()
+                    count('reads')
+                except sqlite3.OperationalError as exc:
+                    if 'locked' not in str(exc):
+                        raise
+                    count('locked')
+            conn.close()
+
+        threads = [threading.Thread(target=writer, args=(number,)) for number in range(options['writers'])]
+        threads += [threading.Thread(target=reader) for _ in range(options['readers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        totals['seconds'] = time.perf_counter() - started
+        return totals
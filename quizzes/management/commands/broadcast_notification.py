@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import broadcasts
+
+
+class Command(BaseCommand):
+    help = 'Queue a system notification for every active user (delivered by send_broadcasts)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('title')
+        parser.add_argument('message')
+
+    def handle(self, *args, **options):
+        broadcast = broadcasts.enqueue('system', options['title'], options['message'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Queued broadcast {broadcast.id}. Run send_broadcasts to deliver it.'
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from quizzes import query_plans
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN QUERY PLAN on the queries the hot views issue and fail on full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--allow', action='append', default=[], metavar='TABLE',
+                            help='Table that may be scanned in full (repeatable)')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print the plan of every query, not just failing ones')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('check_query_plans reads SQLite query plans; the default database is not SQLite.')
+
+        allowed = query_plans.ALLOWED_SCANS | set(options['allow'])
+        failures = 0
+        warnings = 0
+        seen = set()
+        for query in query_plans.capture():
+            if query.sql in seen:
+                continue
+            seen.add(query.sql)
+            scans = query_plans.full_scans(query.sql, allowed, view=query.view)
+            if scans:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f'[{query.view}] full scan of {", ".join(scans)}'))
+            missing = query_plans.missing_searches(query.view, query.sql)
+            if missing:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f'[{query.view}] plan lacks {"; ".join(missing)}'))
+            sorts = query_plans.temp_sorts(query.sql)
+            if sorts and not scans:
+                warnings += 1
+                self.stdout.write(self.style.WARNING(f'[{query.view}] sorts without an index: {"; ".join(sorts)}'))
+            if scans or missing or options['verbose_plans']:
+                self.stdout.write(f'  {query.sql}')
+                for line in query_plans.explain(query.sql):
+                    self.stdout.write(f'    {line}')
+
+        if failures:
+            raise CommandError(f'{failures} of {len(seen)} queries scan a whole table or miss their expected index.')
+        self.stdout.write(self.style.SUCCESS(
+            f'All {len(seen)} queries use an index ({warnings} sort rows in a temporary B-tree).'
+        ))
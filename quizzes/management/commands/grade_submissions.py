@@ -0,0 +1,67 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from quizzes.grading import (
+    MAX_GRADING_ATTEMPTS, claim_pending, fail_exhausted, grade_pending, release_pending, retry_failed,
+)
+
+
+class Command(BaseCommand):
+    help = 'Grade submissions queued by take_quiz when QUIZ_GRADING_MODE is "queued"'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of submissions graded per transaction')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--claim-timeout', type=int, default=300,
+                            help='Seconds after which an unfinished claim is retried')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit instead of polling')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Queue submissions that ran out of attempts again before grading')
+
+    def handle(self, *args, **options):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        graded = 0
+        failed = 0
+
+        if options['retry_failed']:
+            self.stdout.write(f'Queued {retry_failed()} failed submissions again')
+
+        while True:
+            # Last attempts whose worker died are not claimed again
+            failed += self.report_failed(fail_exhausted(options['claim_timeout']))
+            pending = claim_pending(options['batch_size'], worker, options['claim_timeout'])
+            if not pending:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            try:
+                graded += len(grade_pending(pending))
+            except Exception as exc:
+                failed += self.report_failed(release_pending(pending, exc))
+                self.stderr.write(self.style.ERROR(f'Failed to grade {len(pending)} submissions: {exc}'))
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            self.stdout.write(f'Graded {graded} submissions')
+
+        summary = f'Done. Graded {graded} submissions.'
+        if failed:
+            summary += f' {failed} failed permanently (retry with --retry-failed).'
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def report_failed(self, count):
+        if count:
+            self.stderr.write(self.style.ERROR(
+                f'{count} submissions failed {MAX_GRADING_ATTEMPTS} times and were marked failed'
+            ))
+        return count
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quizzes import broadcasts, question_bank
+from quizzes.models import Quiz
+
+
+class Command(BaseCommand):
+    help = 'Append the questions of a JSON or CSV question bank to a quiz'
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=question_bank.FORMATS,
+                            help='Bank format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=question_bank.CHUNK_SIZE,
+                            help='Questions inserted per bulk_create')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only validate the bank')
+
+    def handle(self, *args, **options):
+        try:
+            quiz = Quiz.objects.get(id=options['quiz_id'], deleted_at__isnull=True)
+        except Quiz.DoesNotExist:
+            raise CommandError(f'Quiz {options["quiz_id"]} does not exist.')
+        fmt = options['format'] or question_bank.format_for(options['path'])
+
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            try:
+                if options['dry_run']:
+                    count, errors = question_bank.validate(stream, fmt)
+                    if errors:
+                        raise question_bank.QuestionBankError(errors)
+                    self.stdout.write(self.style.SUCCESS(f'{count} questions are valid.'))
+                    return
+                count = question_bank.import_questions(quiz, stream, fmt, options['chunk_size'])
+            except question_bank.QuestionBankError as exc:
+                for error in exc.errors:
+                    self.stderr.write(error)
+                raise CommandError('Nothing was imported.')
+
+        broadcasts.announce_quiz(quiz)
+        self.stdout.write(self.style.SUCCESS(f'Imported {count} questions into "{quiz.title}".'))
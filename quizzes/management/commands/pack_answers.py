@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import packed_answers
+
+
+def _size(value):
+    if value is None:
+        return 'n/a'
+    return f'{value / 1024 / 1024:.1f} MiB'
+
+
+class Command(BaseCommand):
+    help = 'Convert graded submissions\' Answer rows into packed answers (or back with --unpack)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Submissions converted per transaction')
+        parser.add_argument('--unpack', action='store_true',
+                            help='Write packed answers back out as Answer rows')
+        parser.add_argument('--stats', action='store_true',
+                            help='Only report storage metrics')
+
+    def handle(self, *args, **options):
+        self.report('Before' if not options['stats'] else 'Answer storage')
+        if options['stats']:
+            return
+
+        total = 0
+        for alias, converted in packed_answers.convert(options['batch_size'], reverse=options['unpack']):
+            total += converted
+            self.stdout.write(f'  {alias}: {total} submissions')
+
+        action = 'Unpacked' if options['unpack'] else 'Packed'
+        self.stdout.write(self.style.SUCCESS(f'{action} {total} submissions.'))
+        self.report('After')
+
+    def report(self, label):
+        stats = packed_answers.storage_stats()
+        self.stdout.write(
+            f'{label}: {stats["submissions"] or 0} submissions ({stats["packed"] or 0} packed, '
+            f'{_size(stats["submission_bytes"])}), {stats["answer_rows"] or 0} answer rows '
+            f'({_size(stats["answer_bytes"])})'
+        )
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import retention
+
+
+def _size(value):
+    if value is None:
+        return 'n/a'
+    return f'{value / 1024 / 1024:.1f} MiB'
+
+
+class Command(BaseCommand):
+    help = 'Delete or archive read notifications older than N days, in short batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90,
+                            help='Keep read notifications newer than this many days')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per transaction; keep small to release the write lock often')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after this many rows')
+        parser.add_argument('--archive', action='store_true',
+                            help='Move rows to ArchivedNotification instead of deleting them')
+        parser.add_argument('--stats', action='store_true',
+                            help='Only report table metrics')
+
+    def handle(self, *args, **options):
+        self.report('Before' if not options['stats'] else 'Notification table')
+        if options['stats']:
+            return
+
+        total = 0
+        busy = 0.0
+        slowest = 0.0
+        for rows, seconds in retention.prune(
+            options['days'], options['batch_size'], options['archive'], options['pause'], options['limit']
+        ):
+            total += rows
+            busy += seconds
+            slowest = max(slowest, seconds)
+            self.stdout.write(f'  {total} rows, batch of {rows} took {seconds * 1000:.1f}ms')
+
+        action = 'Archived' if options['archive'] else 'Deleted'
+        rate = total / busy if busy else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {total} notifications ({rate:.0f} rows/s in transactions, '
+            f'longest write lock {slowest * 1000:.1f}ms).'
+        ))
+        self.report('After')
+
+    def report(self, label):
+        stats = retention.table_stats()
+        self.stdout.write(
+            f'{label}: {stats["notifications"]} notifications ({stats["unread"]} unread, '
+            f'{_size(stats["notification_bytes"])}), {stats["archived"]} archived '
+            f'({_size(stats["archive_bytes"])})'
+        )
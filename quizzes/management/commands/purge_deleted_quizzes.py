@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quizzes import purge
+
+
+class Command(BaseCommand):
+    help = 'Remove soft-deleted quizzes and their rows in short batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per DELETE; keep small to release the write lock often')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--quiz', type=int, default=None,
+                            help='Only purge this quiz')
+
+    def handle(self, *args, **options):
+        quizzes = purge.pending()
+        if options['quiz'] is not None:
+            quizzes = quizzes.filter(pk=options['quiz'])
+
+        purged = total = 0
+        for quiz in quizzes:
+            started = time.perf_counter()
+            counts = {}
+            self.stdout.write(f'Purging "{quiz.title}" (#{quiz.id}, deleted {quiz.deleted_at:%Y-%m-%d %H:%M})')
+            for label, rows in purge.purge_quiz(quiz, options['batch_size'], options['pause']):
+                counts[label] = counts.get(label, 0) + rows
+                total += rows
+                self.stdout.write(f'  {label}: {counts[label]}')
+            purged += 1
+            summary = ', '.join(f'{rows} {label}' for label, rows in counts.items()) or 'nothing'
+            self.stdout.write(f'  removed {summary} in {time.perf_counter() - started:.1f}s')
+
+        self.stdout.write(self.style.SUCCESS(f'Done. Purged {purged} quizzes ({total} rows).'))
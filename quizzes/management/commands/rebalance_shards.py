@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quizzes import sharding
+
+
+class Command(BaseCommand):
+    help = 'Move submissions onto the shard their quiz hashes to (after enabling sharding or adding shards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Submissions moved per transaction')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be moved')
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('Sharding is off (set QUIZ_SUBMISSION_SHARDS).')
+
+        moved = 0
+        # The primary holds everything written before sharding was turned on
+        for source in ['default', *sharding.shard_aliases()]:
+            for quiz_id, target in sharding.misplaced_quizzes(source).items():
+                if options['dry_run']:
+                    self.stdout.write(f'Quiz {quiz_id}: {source} -> {target}')
+                    continue
+                for count in sharding.move_quiz(quiz_id, source, target, options['batch_size']):
+                    moved += count
+                    self.stdout.write(f'Quiz {quiz_id}: moved {count} submissions {source} -> {target}')
+
+        self.stdout.write(self.style.SUCCESS(f'Done. Moved {moved} submissions.'))
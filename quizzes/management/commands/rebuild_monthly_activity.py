@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import activity
+from quizzes.models import MonthlyActivity
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user monthly activity rollup from existing submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete existing rollup rows first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = MonthlyActivity.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} rollup rows')
+
+        written = activity.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} monthly activity rows.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quizzes import ranking
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the rank index from UserProfile totals, or check it against them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only compare the stored index with live data')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['check']:
+            mismatches = ranking.check()
+            if mismatches:
+                raise CommandError(
+                    f'Rank index is inconsistent at {len(mismatches)} positions '
+                    f'(first: {mismatches[:10]}). Run rebuild_rank_index to repair it.'
+                )
+            self.stdout.write(self.style.SUCCESS('Rank index matches live data.'))
+            return
+
+        nodes = ranking.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rank index ({nodes} nodes).'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import distributions
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-quiz score histograms from existing submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quiz', type=int, dest='quiz_id',
+                            help='Only rebuild this quiz')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        written = distributions.rebuild(quiz_id=options['quiz_id'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} score buckets.'))
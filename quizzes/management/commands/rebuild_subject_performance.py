@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from quizzes import subjects
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-user subject performance totals from existing submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        written = subjects.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} subject performance rows.'))
@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from quizzes.routers import REPLICA, replica_configured
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into the read replica with the online backup API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep refreshing every N seconds instead of once')
+        parser.add_argument('--pages', type=int, default=1024,
+                            help='Pages copied per step; the primary is only locked during a step')
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError('No "replica" database is configured (set QUIZ_REPLICA_DB).')
+        replica = connections[REPLICA].settings_dict['NAME']
+
+        while True:
+            started = time.perf_counter()
+            self.refresh(replica, options['pages'])
+            self.stdout.write(f'Refreshed {replica} in {(time.perf_counter() - started) * 1000:.0f}ms')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def refresh(self, replica, pages):
+        primary = connections['default']
+        primary.ensure_connection()
+        target = sqlite3.connect(replica, timeout=30)
+        try:
+            # Copying into the live file (rather than swapping in a new one)
+            # keeps persistent replica connections valid; readers just wait
+            # for the final step to finish
+            primary.connection.backup(target, pages=pages)
+        finally:
+            target.close()
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quizzes.grading import regrade_quiz
+from quizzes.models import Quiz
+
+
+class Command(BaseCommand):
+    help = 'Re-score all submissions of a quiz against its current answer key'
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_id', type=int)
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows streamed and written per batch')
+
+    def handle(self, *args, **options):
+        try:
+            quiz = Quiz.objects.get(pk=options['quiz_id'])
+        except Quiz.DoesNotExist:
+            raise CommandError(f'Quiz {options["quiz_id"]} does not exist')
+
+        seen = changed = 0
+        for seen, changed in regrade_quiz(quiz, chunk_size=options['chunk_size']):
+            self.stdout.write(f'{seen} submissions checked, {changed} re-scored')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Re-graded "{quiz.title}": {seen} submissions checked, {changed} re-scored.'
+        ))
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quizzes import broadcasts
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending notification broadcasts in batches (safe to restart at any point)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Notifications inserted per transaction (default: NOTIFICATION_BATCH_SIZE)')
+        parser.add_argument('--sleep', type=float, default=5.0,
+                            help='Seconds to wait when nothing is pending')
+        parser.add_argument('--once', action='store_true',
+                            help='Deliver what is pending and exit instead of polling')
+
+    def handle(self, *args, **options):
+        while True:
+            pending = list(broadcasts.pending())
+            if not pending:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            for broadcast in pending:
+                self.stdout.write(f'Broadcast {broadcast.id} "{broadcast.title}": resuming after user {broadcast.last_user_id}')
+                started = time.monotonic()
+                for progress in broadcasts.process(broadcast, options['batch_size']):
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f'  {progress.sent_count} sent, cursor at user {progress.last_user_id} '
+                        f'({elapsed:.1f}s)'
+                    )
+                if broadcast.status == 'cancelled':
+                    self.stdout.write(self.style.WARNING(
+                        f'Broadcast {broadcast.id} cancelled, its quiz was deleted: '
+                        f'{broadcast.sent_count} notifications.'
+                    ))
+                    continue
+                self.stdout.write(self.style.SUCCESS(
+                    f'Broadcast {broadcast.id} done: {broadcast.sent_count} notifications.'
+                ))
+
+        self.stdout.write(self.style.SUCCESS('No pending broadcasts.'))
@@ -0,0 +1,49 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from .routers import _sticky
+
+
+STICKY_COOKIE = 'primary_until'
+
+
+def _begin(request):
+    try:
+        until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+    except ValueError:
+        until = 0
+    return _sticky.set(until > time.time())
+
+
+def _finish(request, response):
+    # A write pins the user to the primary for a while, so the pages they
+    # go to next show it even before the replica is refreshed
+    if getattr(request, 'stick_to_primary', False) or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+        response.set_cookie(STICKY_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True, samesite='Lax')
+    return response
+
+
+@sync_and_async_middleware
+def primary_stickiness_middleware(get_response):
+    """Route a request to the primary while its user's sticky cookie is fresh"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = _begin(request)
+            try:
+                response = await get_response(request)
+            finally:
+                _sticky.reset(token)
+            return _finish(request, response)
+    else:
+        def middleware(request):
+            token = _begin(request)
+            try:
+                response = get_response(request)
+            finally:
+                _sticky.reset(token)
+            return _finish(request, response)
+    return middleware
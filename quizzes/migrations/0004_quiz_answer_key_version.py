@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0003_notification_studystreak_quizfeedback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='answer_key_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0005_queued_grading'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='accepted_answers',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='answer_match',
+            field=models.CharField(choices=[('normalized', 'Ignore case, spacing and punctuation'), ('exact', 'Exact text'), ('regex', 'Regular expression')], default='normalized', max_length=10),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_rank_index(apps, schema_editor):
+    UserProfile = apps.get_model('quizzes', 'UserProfile')
+    RankIndexNode = apps.get_model('quizzes', 'RankIndexNode')
+    size = getattr(settings, 'RANK_INDEX_SIZE', 2 ** 20)
+
+    rows = (
+        UserProfile.objects.filter(total_quizzes_taken__gt=0)
+        .values('total_score')
+        .annotate(users=Count('id'))
+        .order_by()
+    )
+    tree = {}
+    for row in rows:
+        position = size - min(max(row['total_score'], 0), size - 1)
+        while position <= size:
+            tree[position] = tree.get(position, 0) + row['users']
+            position += position & -position
+
+    RankIndexNode.objects.bulk_create(
+        [RankIndexNode(position=position, count=count) for position, count in tree.items()],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0006_short_answer_matching'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankIndexNode',
+            fields=[
+                ('position', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['total_score'], name='profile_total_score_idx'),
+        ),
+        migrations.RunPython(build_rank_index, migrations.RunPython.noop),
+    ]
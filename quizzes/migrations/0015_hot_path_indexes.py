@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:11
+
+import django.db.models.expressions
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0014_notification_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['submission', 'question'], name='answer_submission_question_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['quiz', 'order'], name='question_quiz_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='quiz_active_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['subject', '-created_at'], name='quiz_subject_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['creator', '-created_at'], name='quiz_creator_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizsubmission',
+            index=models.Index(fields=['user', '-submitted_at'], name='submission_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizsubmission',
+            index=models.Index(fields=['quiz', '-score'], name='submission_quiz_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizsubmission',
+            index=models.Index(fields=['-submitted_at'], name='submission_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(models.OrderBy(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast('total_score', models.FloatField()), '/', models.F('total_quizzes_taken')), descending=True), models.OrderBy(models.F('total_score'), descending=True), models.F('user_id'), condition=models.Q(('total_quizzes_taken__gt', 0)), name='profile_average_score_idx'),
+        ),
+    ]
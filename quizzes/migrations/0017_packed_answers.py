@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0016_submission_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizsubmission',
+            name='packed_answers',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
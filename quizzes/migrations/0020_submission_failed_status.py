@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0019_submission_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='quizsubmission',
+            name='status',
+            field=models.CharField(choices=[('graded', 'Graded'), ('pending', 'Pending Grading'), ('failed', 'Grading Failed')], default='graded', max_length=10),
+        ),
+    ]
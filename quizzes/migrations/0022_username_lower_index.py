@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('quizzes', '0021_archived_notification_count'),
+    ]
+
+    operations = [
+        # auth_user belongs to django.contrib.auth, so its index for the
+        # case-insensitive creator search is created by hand
+        migrations.RunSQL(
+            'CREATE INDEX quizzes_username_lower_idx ON auth_user (LOWER(username))',
+            'DROP INDEX quizzes_username_lower_idx',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0022_username_lower_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificationbroadcast',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('cancelled', 'Cancelled')], default='pending', max_length=10),
+        ),
+    ]
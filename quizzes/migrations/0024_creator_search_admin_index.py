@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0023_broadcast_cancelled_status'),
+    ]
+
+    operations = [
+        # The creator search is a substring match again, which LOWER(username)
+        # cannot serve; it walks the admins instead
+        migrations.RunSQL(
+            'DROP INDEX quizzes_username_lower_idx',
+            'CREATE INDEX quizzes_username_lower_idx ON auth_user (LOWER(username))',
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(condition=models.Q(('is_admin', True)), fields=['user'], name='profile_admin_idx'),
+        ),
+    ]
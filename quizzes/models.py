@@ -1,20 +1,43 @@
 from django.db import models
+from django.db.models import F, OrderBy
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
 from django.utils import timezone
 
 
+class Subject(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    slug = models.SlugField(max_length=100, unique=True)
+    
+    def __str__(self):
+        return self.name
+    
+    class Meta:
+        ordering = ['name']
+
+
 class Quiz(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
+    subject = models.ForeignKey(Subject, on_delete=models.SET_NULL, null=True, blank=True, related_name='quizzes')
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_quizzes')
     created_at = models.DateTimeField(default=timezone.now)
     time_limit = models.IntegerField(default=30)  # in minutes
     max_attempts = models.IntegerField(default=3)
     is_active = models.BooleanField(default=True)
+    answer_key_version = models.PositiveIntegerField(default=1, editable=False)
+    # Set by delete_quiz; purge_deleted_quizzes removes the rows later
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.title
 
+    def soft_delete(self):
+        """Hide the quiz at once and leave its rows to the background purge"""
+        self.deleted_at = timezone.now()
+        self.is_active = False
+        self.save(update_fields=['deleted_at', 'is_active'])
+
     @property
     def total_questions(self):
         return self.questions.count()
@@ -25,6 +48,16 @@ class Quiz(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # quiz_list and the dashboard only list active quizzes, newest first
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='quiz_active_recent_idx'),
+            models.Index(
+                fields=['subject', '-created_at'],
+                condition=models.Q(is_active=True),
+                name='quiz_subject_recent_idx',
+            ),
+            models.Index(fields=['creator', '-created_at'], name='quiz_creator_recent_idx'),
+        ]
 
 
 class Question(models.Model):
@@ -33,18 +66,28 @@ class Question(models.Model):
         ('tf', 'True/False'),
         ('sa', 'Short Answer'),
     )
+    ANSWER_MATCH_TYPES = (
+        ('normalized', 'Ignore case, spacing and punctuation'),
+        ('exact', 'Exact text'),
+        ('regex', 'Regular expression'),
+    )
     
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='questions')
     question_text = models.TextField()
     question_type = models.CharField(max_length=2, choices=QUESTION_TYPES, default='mc')
     order = models.IntegerField(default=0)
     points = models.IntegerField(default=1)
+    accepted_answers = models.JSONField(default=list, blank=True)  # For short answer questions
+    answer_match = models.CharField(max_length=10, choices=ANSWER_MATCH_TYPES, default='normalized')
     
     def __str__(self):
         return f"{self.quiz.title} - Q{self.order}: {self.question_text[:50]}..."
     
     class Meta:
         ordering = ['order']
+        indexes = [
+            models.Index(fields=['quiz', 'order'], name='question_quiz_order_idx'),
+        ]
 
 
 class Choice(models.Model):
@@ -57,16 +100,40 @@ class Choice(models.Model):
 
 
 class QuizSubmission(models.Model):
-    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='submissions')
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quiz_submissions')
+    STATUS_CHOICES = (
+        ('graded', 'Graded'),
+        ('pending', 'Pending Grading'),
+        # Grading ran out of attempts; the raw answers stay in PendingGrade
+        ('failed', 'Grading Failed'),
+    )
+    
+    # No database constraints: with sharding on, quizzes and users live in another file
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='submissions', db_constraint=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quiz_submissions', db_constraint=False)
     score = models.IntegerField(default=0)
     total_points = models.IntegerField(default=0)
     submitted_at = models.DateTimeField(default=timezone.now)
     time_taken = models.DurationField(null=True, blank=True)  # Time taken to complete
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='graded')
+    # Answers packed as parallel arrays instead of Answer rows (see packed_answers.py)
+    packed_answers = models.JSONField(null=True, blank=True)
     
     def __str__(self):
         return f"{self.user.username} - {self.quiz.title} - {self.score}/{self.total_points}"
     
+    def get_answers(self):
+        """Answers with their questions and choices, however they are stored"""
+        from .packed_answers import answers_for
+        return answers_for(self)
+    
+    @property
+    def is_pending(self):
+        return self.status == 'pending'
+    
+    @property
+    def is_failed(self):
+        return self.status == 'failed'
+    
     @property
     def percentage_score(self):
         if self.total_points > 0:
@@ -76,19 +143,70 @@ class QuizSubmission(models.Model):
     class Meta:
         ordering = ['-submitted_at']
         unique_together = ['quiz', 'user']  # One submission per user per quiz
+        indexes = [
+            models.Index(fields=['user', '-submitted_at'], name='submission_user_recent_idx'),
+            models.Index(fields=['quiz', '-score'], name='submission_quiz_score_idx'),
+            models.Index(fields=['-submitted_at'], name='submission_recent_idx'),
+        ]
+
+
+class PendingGrade(models.Model):
+    """Raw answers of a submission waiting for the grading worker"""
+    submission = models.OneToOneField(QuizSubmission, on_delete=models.CASCADE, related_name='pending_grade')
+    answers = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    
+    class Meta:
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"Pending grade for submission {self.submission_id}"
 
 
 class Answer(models.Model):
     submission = models.ForeignKey(QuizSubmission, on_delete=models.CASCADE, related_name='answers')
-    question = models.ForeignKey(Question, on_delete=models.CASCADE)
-    selected_choice = models.ForeignKey(Choice, on_delete=models.CASCADE, null=True, blank=True)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_constraint=False)
+    selected_choice = models.ForeignKey(Choice, on_delete=models.CASCADE, null=True, blank=True, db_constraint=False)
     text_answer = models.TextField(blank=True)  # For short answer questions
     is_correct = models.BooleanField(default=False)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['submission', 'question'], name='answer_submission_question_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.submission.user.username} - {self.question.question_text[:30]}..."
 
 
+class ArchivedSubmission(models.Model):
+    """Stand-in for a submission moved to a yearly archive file (see archive.py)
+
+    Keeps what rollups and lookups need; the answers live in the archive.
+    """
+    id = models.BigIntegerField(primary_key=True)  # the original QuizSubmission id
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='archived_submissions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_submissions')
+    score = models.IntegerField(default=0)
+    total_points = models.IntegerField(default=0)
+    submitted_at = models.DateTimeField()
+    year = models.PositiveSmallIntegerField()  # archive file holding the row
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['quiz', 'user']
+        indexes = [
+            models.Index(fields=['user', '-submitted_at'], name='archived_user_recent_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Submission {self.id} (archived {self.year})"
+
+
 class Achievement(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
@@ -161,12 +279,117 @@ class UserProfile(models.Model):
             self.save()
     
     def get_rank(self):
-        """Get user's rank based on average score"""
-        users_with_higher_score = UserProfile.objects.filter(
-            total_quizzes_taken__gt=0,
-            total_score__gt=self.total_score
-        ).count()
-        return users_with_higher_score + 1 if self.total_quizzes_taken > 0 else None
+        """Get user's rank based on total score"""
+        if self.total_quizzes_taken == 0:
+            return None
+        from .ranking import rank_for_score
+        return rank_for_score(self.total_score)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['total_score'], name='profile_total_score_idx'),
+            # Matches the all-time leaderboard's ORDER BY so it reads one page
+            models.Index(
+                OrderBy(Cast('total_score', models.FloatField()) / F('total_quizzes_taken'), descending=True),
+                F('total_score').desc(),
+                'user_id',
+                condition=models.Q(total_quizzes_taken__gt=0),
+                name='profile_average_score_idx',
+            ),
+            # Creator search matches usernames against the (few) admins only
+            models.Index(fields=['user'], condition=models.Q(is_admin=True), name='profile_admin_idx'),
+        ]
+
+
+class RankIndexNode(models.Model):
+    """One node of the Fenwick tree behind UserProfile.get_rank (see ranking.py)"""
+    position = models.PositiveIntegerField(primary_key=True)
+    count = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.position}: {self.count}"
+
+
+class ShardSequence(models.Model):
+    """Last id handed out for a sharded table (see sharding.py)"""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class QuizScoreBucket(models.Model):
+    """Number of graded submissions of a quiz that scored exactly ``score``"""
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='score_buckets')
+    score = models.IntegerField()
+    submissions = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['quiz', 'score']
+        ordering = ['quiz', 'score']
+    
+    def __str__(self):
+        return f"{self.quiz.title} - {self.score}: {self.submissions}"
+
+
+class SubjectPerformance(models.Model):
+    """A user's running totals for quizzes of one subject"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subject_performance')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='performance')
+    attempts = models.IntegerField(default=0)
+    score_sum = models.IntegerField(default=0)
+    points_sum = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['user', 'subject']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.subject.name}: {self.attempts} attempts"
+    
+    @property
+    def average_score(self):
+        if self.attempts > 0:
+            return round(self.score_sum / self.attempts, 2)
+        return 0
+    
+    @property
+    def percentage_score(self):
+        if self.points_sum > 0:
+            return round((self.score_sum / self.points_sum) * 100, 2)
+        return 0
+
+
+class DailyScoreBucket(models.Model):
+    """A user's quiz count and points for one day, for windowed leaderboards"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_scores')
+    day = models.DateField()
+    quizzes_taken = models.IntegerField(default=0)
+    total_score = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['user', 'day']
+        indexes = [
+            models.Index(fields=['day', 'user'], name='daily_score_day_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.day}: {self.total_score}"
+
+
+class MonthlyActivity(models.Model):
+    """A user's quiz count and points for one calendar month"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_activity')
+    month = models.DateField()  # First day of the month
+    quizzes_taken = models.IntegerField(default=0)
+    total_score = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['user', 'month']
+        ordering = ['user', 'month']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.month:%Y-%m}: {self.quizzes_taken} quizzes"
 
 
 class Notification(models.Model):
@@ -183,15 +406,79 @@ class Notification(models.Model):
     title = models.CharField(max_length=200)
     message = models.TextField()
     read = models.BooleanField(default=False)
+    # Number of events coalesced into this row (see create_notification)
+    count = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The dropdown and unread counts only ever read a user's unread rows
+            models.Index(
+                fields=['user', '-created_at'],
+                condition=models.Q(read=False),
+                name='notification_unread_idx',
+            ),
+            # Lets prune_notifications find old read rows without a scan
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(read=True),
+                name='notification_read_created_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.title}"
 
 
+class ArchivedNotification(models.Model):
+    """Read notification moved out of the hot table by prune_notifications"""
+    notification_id = models.BigIntegerField(unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notifications')
+    type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.title} (archived)"
+
+
+class NotificationBroadcast(models.Model):
+    """A notification sent to every active user, delivered in batches by a worker"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('cancelled', 'Cancelled'),
+    ]
+    
+    type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    quiz = models.ForeignKey(Quiz, on_delete=models.SET_NULL, null=True, blank=True, related_name='broadcasts')
+    exclude_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # Keyset cursor: every user with a lower or equal id has been delivered to
+    last_user_id = models.BigIntegerField(default=0)
+    sent_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='broadcast_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.title} ({self.status})"
+
+
 class StudyStreak(models.Model):
     """Track user study streaks"""
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -206,15 +493,15 @@ class StudyStreak(models.Model):
         """Update streak based on activity"""
         today = timezone.now().date()
         
-        if self.last_activity == today:
+        if self.last_activity == today and self.current_streak > 0:
             # Already updated today
             return
         
         if self.last_activity == today - timezone.timedelta(days=1):
             # Consecutive day
             self.current_streak += 1
-        elif self.last_activity < today - timezone.timedelta(days=1):
-            # Streak broken
+        else:
+            # First activity, or streak broken
             self.current_streak = 1
         
         if self.current_streak > self.longest_streak:
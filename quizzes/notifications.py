@@ -0,0 +1,185 @@
+"""Notification push channel.
+
+``create_notification`` and the read endpoints publish a small event for the
+user once their transaction commits. Every open tab holds one idle
+``text/event-stream`` connection (``api_views.notification_stream``) that is
+parked on an ``asyncio.Queue`` in this process, so apart from one query per
+heartbeat nothing touches the database until an event arrives and the tab
+refetches its list.
+
+``state()`` derives a stamp and the unread count from the user's unread
+rows with one query on the unread index. The stamp doubles as the ETag of
+``api_views.get_notifications``, so a poll that finds nothing new is answered
+with ``304`` without loading any notifications. Being read from the database
+it is the same in every worker process, unlike a per-process cache.
+
+Events published by other workers never reach this process's queues, so on
+every heartbeat a stream re-reads the stamp and tells the tab to refetch when
+it has changed. Broadcasts write in bulk without publishing and are picked
+up the same way.
+
+Streams need the ASGI application (``quizmaster/asgi.py``); under WSGI the
+stream endpoint answers ``204`` and the browser falls back to polling.
+
+``digest_window()`` and ``fold()`` implement the digest shared by
+``create_notification`` and broadcast delivery: an unread row of a type in
+``NOTIFICATION_DIGEST_TYPES`` absorbs later events of that type, its title
+becomes a count ("3 new quizzes") and its message keeps the latest
+``DIGEST_LINES`` event messages.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .models import Notification
+
+
+_subscribers = defaultdict(set)
+_subscribers_lock = threading.Lock()
+# user id -> in-flight state() read shared by that user's streams
+_stamp_reads = {}
+
+
+# Title of a row that stands for several events of its type
+DIGEST_TITLES = {
+    'achievement': '{count} achievements unlocked',
+    'quiz_result': '{count} new quiz results',
+    'rank_change': 'Your rank changed {count} times',
+    'new_quiz': '{count} new quizzes',
+    'system': '{count} updates',
+}
+DIGEST_LINES = 10
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def digest_window(notification_type):
+    """Seconds within which unread rows of this type absorb new events (0 for none)"""
+    if notification_type not in _setting('NOTIFICATION_DIGEST_TYPES', ()):
+        return 0
+    return _setting('NOTIFICATION_DIGEST_WINDOW', 3600)
+
+
+def fold(notification, message):
+    """``(title, message, count)`` of ``notification`` with one more event folded in"""
+    count = notification.count + 1
+    title = DIGEST_TITLES.get(notification.type, '{count} notifications').format(count=count)
+    lines = (notification.message.splitlines() + [message])[-DIGEST_LINES:]
+    return title, '\n'.join(lines), count
+
+
+def state(user_id):
+    """``(stamp, unread)`` for the user, read from the unread notifications index.
+
+    The stamp changes whenever a notification is created, coalesced (which
+    moves its ``created_at``) or read, whichever process did it.
+    """
+    totals = Notification.objects.filter(user_id=user_id, read=False).aggregate(
+        unread=Count('id'), last_id=Max('id'), latest=Max('created_at'),
+    )
+    latest = totals['latest']
+    stamp = f"{totals['unread']}.{totals['last_id'] or 0}.{int(latest.timestamp() * 1e6) if latest else 0}"
+    return stamp, totals['unread']
+
+
+def _deliver(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # The tab refetches on any event, so dropping extras loses nothing
+        pass
+
+
+def publish(user_id, event):
+    """Push ``event`` to every stream the user has open, from any thread"""
+    with _subscribers_lock:
+        targets = list(_subscribers.get(user_id, ()))
+    for loop, queue in targets:
+        try:
+            loop.call_soon_threadsafe(_deliver, queue, event)
+        except RuntimeError:
+            # The stream's event loop has already shut down
+            pass
+
+
+def publish_on_commit(user_id, event):
+    """Publish once the current transaction commits (immediately outside one)"""
+    transaction.on_commit(lambda: publish(user_id, event))
+
+
+def subscribe(user_id):
+    queue = asyncio.Queue(maxsize=_setting('NOTIFICATION_QUEUE_SIZE', 16))
+    with _subscribers_lock:
+        _subscribers[user_id].add((asyncio.get_running_loop(), queue))
+    return queue
+
+
+def unsubscribe(user_id, queue):
+    with _subscribers_lock:
+        entries = _subscribers.get(user_id)
+        if entries is None:
+            return
+        entries.difference_update([entry for entry in entries if entry[1] is queue])
+        if not entries:
+            del _subscribers[user_id]
+
+
+def connection_count():
+    with _subscribers_lock:
+        return sum(len(entries) for entries in _subscribers.values())
+
+
+def format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+async def _read_stamp(user_id):
+    """``state()``'s stamp, read once for all of the user's streams asking at the same time"""
+    loop = asyncio.get_running_loop()
+    read = _stamp_reads.get(user_id)
+    if read is None or read.get_loop() is not loop:
+        read = loop.create_task(sync_to_async(lambda: state(user_id)[0])())
+        _stamp_reads[user_id] = read
+
+        def forget(done):
+            if _stamp_reads.get(user_id) is done:
+                del _stamp_reads[user_id]
+        read.add_done_callback(forget)
+    # A stream that disconnects must not cancel the read for the others
+    return await asyncio.shield(read)
+
+
+async def event_stream(user_id):
+    """Server-sent events for one tab until the client disconnects"""
+    heartbeat = _setting('NOTIFICATION_HEARTBEAT', 25)
+
+    queue = subscribe(user_id)
+    try:
+        last_stamp = await _read_stamp(user_id)
+        yield f'retry: {_setting("NOTIFICATION_RETRY_MS", 5000)}\n\n'
+        yield format_event('ready', {'stamp': last_stamp})
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                event = None
+            # Catches changes made by other workers, whose events never reach this queue
+            stamp = await _read_stamp(user_id)
+            if event is None and stamp != last_stamp:
+                event = {'event': 'changed'}
+            last_stamp = stamp
+            if event is not None:
+                yield format_event('notification', dict(event, stamp=stamp))
+            else:
+                # Comment lines keep proxies from closing an idle connection
+                yield ': keepalive\n\n'
+    finally:
+        unsubscribe(user_id, queue)
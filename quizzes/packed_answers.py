@@ -0,0 +1,168 @@
+"""Packed answer storage.
+
+With ``ANSWER_STORAGE = 'packed'`` a graded submission keeps its answers in
+``QuizSubmission.packed_answers`` as parallel arrays instead of one ``Answer``
+row per question::
+
+    {"q": [question ids], "c": [choice id or null], "ok": [0 or 1],
+     "t": [text answers]}
+
+``t`` is left out when every answer is a choice. Answers are only ever read
+back a whole submission at a time, so one JSON value replaces the rows, their
+index entries and one insert per question.
+
+``QuizSubmission.get_answers()`` returns ``Answer`` objects for either format,
+so readers do not care which one a submission uses. ``manage.py pack_answers``
+converts existing rows in batches (and back, with ``--unpack``).
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Q
+
+from . import sharding
+from .models import Answer, Choice, Question, QuizSubmission
+from .retention import sqlite_table_bytes
+
+
+def answer_storage():
+    """Return ``'rows'`` or ``'packed'``"""
+    return getattr(settings, 'ANSWER_STORAGE', 'rows')
+
+
+def pack(answers):
+    """Pack ``Answer`` keyword dicts (as built by ``grading.grade_answers``)"""
+    packed = {'q': [], 'c': [], 'ok': []}
+    texts = []
+    for answer in answers:
+        packed['q'].append(answer['question_id'])
+        packed['c'].append(answer.get('selected_choice_id'))
+        packed['ok'].append(int(answer['is_correct']))
+        texts.append(answer.get('text_answer', ''))
+    if any(texts):
+        packed['t'] = texts
+    return packed
+
+
+def repack(answers):
+    """Pack ``Answer`` objects, e.g. ones from ``unpack`` after regrading"""
+    return pack(
+        {
+            'question_id': answer.question_id,
+            'selected_choice_id': answer.selected_choice_id,
+            'text_answer': answer.text_answer,
+            'is_correct': answer.is_correct,
+        }
+        for answer in answers
+    )
+
+
+def entries(packed):
+    """``(question_id, selected_choice_id, text_answer, is_correct)`` for each packed answer"""
+    texts = packed.get('t') or [''] * len(packed['q'])
+    for question_id, choice_id, is_correct, text in zip(packed['q'], packed['c'], packed['ok'], texts):
+        yield question_id, choice_id, text, bool(is_correct)
+
+
+def unpack(submission):
+    """Unsaved ``Answer`` objects for a packed submission, without related rows"""
+    return [
+        Answer(
+            submission=submission,
+            question_id=question_id,
+            selected_choice_id=choice_id,
+            text_answer=text,
+            is_correct=is_correct,
+        )
+        for question_id, choice_id, text, is_correct in entries(submission.packed_answers)
+    ]
+
+
+def answers_for(submission):
+    """A submission's answers with their questions and choices loaded"""
+    if submission.packed_answers is None:
+        return list(sharding.related(submission.answers.all(), 'question', 'selected_choice'))
+
+    answers = unpack(submission)
+    questions = Question.objects.in_bulk({answer.question_id for answer in answers})
+    choices = Choice.objects.in_bulk({answer.selected_choice_id for answer in answers} - {None})
+    loaded = []
+    for answer in answers:
+        # Deleting a question or choice deletes its answer rows; skip them here likewise
+        if answer.question_id not in questions:
+            continue
+        if answer.selected_choice_id is not None and answer.selected_choice_id not in choices:
+            continue
+        answer.question = questions[answer.question_id]
+        answer.selected_choice = choices.get(answer.selected_choice_id)
+        loaded.append(answer)
+    return loaded
+
+
+def pack_batch(alias, batch_size):
+    """Move the answer rows of up to ``batch_size`` submissions into their blobs"""
+    with sharding.atomic(alias):
+        submissions = list(
+            sharding.using(QuizSubmission, alias)
+            .filter(packed_answers__isnull=True, status='graded')
+            .order_by('id')
+            .only('id')[:batch_size]
+        )
+        if not submissions:
+            return 0
+        rows = {}
+        answers = sharding.using(Answer, alias).filter(submission__in=submissions).order_by('submission_id', 'id')
+        for answer in answers.values('submission_id', 'question_id', 'selected_choice_id', 'text_answer', 'is_correct'):
+            rows.setdefault(answer['submission_id'], []).append(answer)
+        for submission in submissions:
+            submission.packed_answers = pack(rows.get(submission.id, []))
+        sharding.using(QuizSubmission, alias).bulk_update(submissions, ['packed_answers'])
+        sharding.using(Answer, alias).filter(submission__in=submissions).delete()
+    return len(submissions)
+
+
+def unpack_batch(alias, batch_size):
+    """Write the blobs of up to ``batch_size`` submissions back out as rows"""
+    with sharding.atomic(alias):
+        submissions = list(
+            sharding.using(QuizSubmission, alias)
+            .filter(packed_answers__isnull=False)
+            .order_by('id')
+            .only('id', 'packed_answers')[:batch_size]
+        )
+        if not submissions:
+            return 0
+        answers = [answer for submission in submissions for answer in unpack(submission)]
+        sharding.using(Answer, alias).bulk_create(answers, batch_size=1000)
+        for submission in submissions:
+            submission.packed_answers = None
+        sharding.using(QuizSubmission, alias).bulk_update(submissions, ['packed_answers'])
+    return len(submissions)
+
+
+def convert(batch_size=500, reverse=False):
+    """Pack (or unpack) every submission, yielding ``(alias, submissions)`` per batch"""
+    step = unpack_batch if reverse else pack_batch
+    for alias in sharding.shard_aliases():
+        while True:
+            converted = step(alias, batch_size)
+            if not converted:
+                break
+            yield alias, converted
+
+
+def storage_stats():
+    """Row counts per storage format, plus table bytes where SQLite reports them"""
+    stats = sharding.totals(
+        QuizSubmission.objects.all(),
+        submissions=Count('id'),
+        packed=Count('id', filter=Q(packed_answers__isnull=False)),
+    )
+    stats['answer_rows'] = sharding.totals(Answer.objects.all(), rows=Count('id'))['rows']
+    for key, model in (('submission_bytes', QuizSubmission), ('answer_bytes', Answer)):
+        sizes = [
+            sqlite_table_bytes(model._meta.db_table, using=alias)
+            for alias in sharding.shard_aliases()
+            if connections[alias].vendor == 'sqlite'
+        ]
+        stats[key] = sum(sizes) if sizes and None not in sizes else None
+    return stats
@@ -2,11 +2,15 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.db.models import Count, Avg, Q, F
+from django.db.models import Count, Avg, Q
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.utils import timezone
-from .models import UserProfile, Quiz, QuizSubmission, Achievement, UserAchievement
+from .models import UserProfile, Quiz, QuizSubmission, UserAchievement
+from .activity import monthly_quizzes
+from .subjects import performance_for
+from .leaderboards import WINDOWS, top_users as top_users_for_window
+from .routers import use_replica
+from . import sharding
 import json
 
 
@@ -21,31 +25,27 @@ def profile_view(request, username=None):
     profile, created = UserProfile.objects.get_or_create(user=user)
     
     # Get user's quiz submissions with detailed stats
-    submissions = QuizSubmission.objects.filter(user=user).select_related('quiz')
-    
-    # Recent activity
-    recent_submissions = submissions.order_by('-submitted_at')[:5]
-    
-    # Subject-wise performance
-    subject_performance = {}
-    for submission in submissions:
-        subject = submission.quiz.subject
-        if subject not in subject_performance:
-            subject_performance[subject] = {'total': 0, 'scores': []}
-        subject_performance[subject]['total'] += 1
-        subject_performance[subject]['scores'].append(submission.score)
-    
-    # Calculate averages
-    for subject in subject_performance:
-        scores = subject_performance[subject]['scores']
-        subject_performance[subject]['average'] = sum(scores) / len(scores) if scores else 0
+    submissions = QuizSubmission.objects.filter(user=user)
+    
+    # Recent activity, gathered from every shard
+    recent_submissions = sharding.gather(
+        sharding.related(submissions.order_by('-submitted_at'), 'quiz'),
+        limit=5, key='submitted_at', reverse=True,
+    )
+    
+    # Subject-wise performance, from the per-subject totals
+    subject_performance = {
+        row.subject.name: {
+            'total': row.attempts,
+            'average': row.average_score,
+            'percentage': row.percentage_score,
+        }
+        for row in performance_for(user)
+    }
     
-    # Get achievements
+    # Get achievements (awarded when submissions are graded, see achievements.py)
     user_achievements = UserAchievement.objects.filter(user=user).select_related('achievement')
     
-    # Check for new achievements
-    check_achievements(user)
-    
     context = {
         'profile_user': user,
         'profile': profile,
@@ -95,133 +95,57 @@ def edit_profile(request):
 
 
 @login_required
+@use_replica
 def leaderboard(request):
     """Show leaderboard with top users"""
-    # Get top users by average score
-    top_users = UserProfile.objects.filter(
-        total_quizzes_taken__gt=0
-    ).annotate(
-        avg_score=F('total_score') / F('total_quizzes_taken')
-    ).order_by('-avg_score')[:50]
+    window = request.GET.get('window', 'all')
+    if window not in dict(WINDOWS):
+        window = 'all'
+    
+    # Top users by average score, merged from daily score buckets
+    top_users = top_users_for_window(window, limit=50)
     
     # Get current user's rank
-    current_user_profile = UserProfile.objects.get(user=request.user)
+    current_user_profile, created = UserProfile.objects.get_or_create(user=request.user)
     current_user_rank = current_user_profile.get_rank()
     
     context = {
         'top_users': top_users,
         'current_user_rank': current_user_rank,
-        'current_user_profile': current_user_profile
+        'current_user_profile': current_user_profile,
+        'window': window,
+        'windows': WINDOWS,
     }
     
     return render(request, 'quizzes/leaderboard.html', context)
 
 
-def check_achievements(user):
-    """Check and award achievements to user"""
-    profile = UserProfile.objects.get(user=user)
-    
-    # Define achievement criteria
-    achievement_checks = [
-        {
-            'name': 'First Steps',
-            'description': 'Complete your first quiz',
-            'icon': 'fa-star',
-            'color': 'text-success',
-            'requirement': 1,
-            'type': 'quiz_count'
-        },
-        {
-            'name': 'Quiz Master',
-            'description': 'Complete 10 quizzes',
-            'icon': 'fa-trophy',
-            'color': 'text-warning',
-            'requirement': 10,
-            'type': 'quiz_count'
-        },
-        {
-            'name': 'Perfect Score',
-            'description': 'Score 100% on a quiz',
-            'icon': 'fa-gem',
-            'color': 'text-primary',
-            'requirement': 100,
-            'type': 'high_score'
-        },
-        {
-            'name': 'Consistent Performer',
-            'description': 'Complete 25 quizzes',
-            'icon': 'fa-chart-line',
-            'color': 'text-info',
-            'requirement': 25,
-            'type': 'quiz_count'
-        }
-    ]
-    
-    for achievement_data in achievement_checks:
-        # Check if achievement exists
-        achievement, created = Achievement.objects.get_or_create(
-            name=achievement_data['name'],
-            defaults={
-                'description': achievement_data['description'],
-                'icon': achievement_data['icon'],
-                'color': achievement_data['color'],
-                'requirement': achievement_data['requirement'],
-                'achievement_type': achievement_data['type']
-            }
-        )
-        
-        # Check if user has earned this achievement
-        if not UserAchievement.objects.filter(user=user, achievement=achievement).exists():
-            earned = False
-            
-            if achievement_data['type'] == 'quiz_count':
-                earned = profile.total_quizzes_taken >= achievement_data['requirement']
-            elif achievement_data['type'] == 'high_score':
-                earned = QuizSubmission.objects.filter(
-                    user=user, 
-                    score__gte=achievement_data['requirement']
-                ).exists()
-            
-            if earned:
-                UserAchievement.objects.create(user=user, achievement=achievement)
-
-
 @csrf_exempt
 @login_required
+@use_replica
 def api_user_stats(request):
     """API endpoint for user statistics"""
     if request.method == 'GET':
-        profile = UserProfile.objects.get(user=request.user)
+        # get_or_create runs on the primary, so a profile the replica has not
+        # caught up with yet is still found
+        profile, created = UserProfile.objects.get_or_create(user=request.user)
         
-        # Get monthly quiz data for chart
-        monthly_data = []
-        for month in range(1, 13):
-            count = QuizSubmission.objects.filter(
-                user=request.user,
-                submitted_at__month=month,
-                submitted_at__year=timezone.now().year
-            ).count()
-            monthly_data.append(count)
+        # Quizzes per month over the last 12 months, from the activity rollup
+        monthly = monthly_quizzes(request.user)
         
         # Get subject performance
-        subject_stats = {}
-        submissions = QuizSubmission.objects.filter(user=request.user).select_related('quiz')
-        
-        for submission in submissions:
-            subject = submission.quiz.subject
-            if subject not in subject_stats:
-                subject_stats[subject] = {'count': 0, 'total_score': 0}
-            subject_stats[subject]['count'] += 1
-            subject_stats[subject]['total_score'] += submission.score
-        
-        # Calculate averages
-        for subject in subject_stats:
-            subject_stats[subject]['average'] = round(
-                subject_stats[subject]['total_score'] / subject_stats[subject]['count'], 2
-            )
+        subject_stats = {
+            row.subject.name: {
+                'count': row.attempts,
+                'total_score': row.score_sum,
+                'average': row.average_score,
+            }
+            for row in performance_for(request.user)
+        }
         
         data = {
-            'monthly_quizzes': monthly_data,
+            'monthly_quizzes': [count for month, count in monthly],
+            'monthly_labels': [month.strftime('%Y-%m') for month, count in monthly],
             'subject_performance': subject_stats,
             'total_quizzes': profile.total_quizzes_taken,
             'average_score': profile.average_score,
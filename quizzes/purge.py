@@ -0,0 +1,78 @@
+"""Background removal of soft-deleted quizzes.
+
+``delete_quiz`` only marks a quiz with ``deleted_at`` (and deactivates it),
+which hides it everywhere at once. ``manage.py purge_deleted_quizzes`` then
+removes its rows here, a bounded batch at a time, from the leaf tables up:
+answers and queued grades, submissions, score buckets and feedback, choices,
+questions, and finally the quiz itself. Each batch is one ``DELETE`` by
+primary key in its own short transaction, so nothing is loaded into memory
+and the SQLite write lock is released between batches. A purge that is
+interrupted simply continues where it stopped on the next run.
+
+The batches bypass Django's deletion collector and its signals, so the answer
+key is retired explicitly once a quiz is gone.
+"""
+import time
+
+from django.db import connections, transaction
+
+from . import sharding
+from .answer_keys import invalidate_answer_key
+from .models import (
+    Answer, ArchivedSubmission, Choice, NotificationBroadcast, PendingGrade, Question, Quiz, QuizFeedback,
+    QuizScoreBucket, QuizSubmission,
+)
+
+
+def pending():
+    """Soft-deleted quizzes waiting to be purged, oldest deletion first"""
+    return Quiz.objects.filter(deleted_at__isnull=False).order_by('deleted_at', 'id')
+
+
+def _steps(quiz_id):
+    """``(label, alias, queryset)`` in the order the rows must go"""
+    for alias in sharding.shard_aliases():
+        yield 'answers', alias, sharding.using(Answer, alias).filter(submission__quiz_id=quiz_id)
+        yield 'queued grades', alias, sharding.using(PendingGrade, alias).filter(submission__quiz_id=quiz_id)
+        yield 'submissions', alias, sharding.using(QuizSubmission, alias).filter(quiz_id=quiz_id)
+    yield 'archived submissions', 'default', ArchivedSubmission.objects.filter(quiz_id=quiz_id)
+    yield 'score buckets', 'default', QuizScoreBucket.objects.filter(quiz_id=quiz_id)
+    yield 'feedback', 'default', QuizFeedback.objects.filter(quiz_id=quiz_id)
+    yield 'choices', 'default', Choice.objects.filter(question__quiz_id=quiz_id)
+    yield 'questions', 'default', Question.objects.filter(quiz_id=quiz_id)
+
+
+def delete_batch(queryset, alias, batch_size):
+    """Delete up to ``batch_size`` rows of ``queryset`` with one statement"""
+    ids = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    connection = connections[alias]
+    meta = queryset.model._meta
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {connection.ops.quote_name(meta.db_table)} '
+            f'WHERE {connection.ops.quote_name(meta.pk.column)} IN ({", ".join(["%s"] * len(ids))})',
+            ids,
+        )
+    return len(ids)
+
+
+def purge_quiz(quiz, batch_size=1000, pause=0.0):
+    """Remove a soft-deleted quiz, yielding ``(label, rows)`` after each batch"""
+    for label, alias, queryset in _steps(quiz.id):
+        while True:
+            rows = delete_batch(queryset, alias, batch_size)
+            if not rows:
+                break
+            yield label, rows
+            if pause:
+                time.sleep(pause)
+
+    # Announcements outlive their quiz, as with the foreign key's SET_NULL
+    NotificationBroadcast.objects.filter(quiz_id=quiz.id).update(quiz=None)
+    # Nothing refers to the quiz any more, so the collector has nothing to load
+    deleted, _ = Quiz.objects.filter(pk=quiz.id, deleted_at__isnull=False).delete()
+    invalidate_answer_key(quiz.id)
+    if deleted:
+        yield 'quiz', 1
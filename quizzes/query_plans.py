@@ -0,0 +1,186 @@
+"""Query plan checks for the views' hot paths.
+
+``capture()`` builds a small throwaway data set inside a transaction, requests
+every page and API endpoint a student or quiz author hits, and records the
+SELECTs they issue before rolling everything back. ``full_scans()`` runs
+``EXPLAIN QUERY PLAN`` on a statement and returns the tables SQLite would
+read whole: every ``SCAN``, including one that walks an index from end to
+end, since only a ``SEARCH`` uses an index to narrow the rows read.
+The few deliberate walks of an index in order are listed in
+``ORDERED_SCANS``. ``temp_sorts()`` returns the sorts SQLite cannot take from
+an index.
+``missing_searches()`` checks the few queries whose plan matters beyond
+"uses some index" against the plan line they are expected to produce.
+``manage.py check_query_plans`` puts them together.
+"""
+import re
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Choice, Question, Quiz, Subject, UserProfile
+
+
+# Tables that are read whole on purpose: small catalogs listed in full
+ALLOWED_SCANS = {
+    'quizzes_subject',
+    'quizzes_achievement',
+}
+
+# (view, table) -> the one index that view may walk in order from its start:
+# top-N lists that stop at their LIMIT, the quiz catalog pages and the
+# creator search, whose substring match reads the partial index of admins
+ORDERED_SCANS = {
+    ('leaderboard', 'quizzes_userprofile'): 'profile_average_score_idx',
+    ('dashboard', 'quizzes_quiz'): 'quiz_active_recent_idx',
+    ('quiz_list', 'quizzes_quiz'): 'quiz_active_recent_idx',
+    ('search_creators', 'quizzes_userprofile'): 'profile_admin_idx',
+}
+
+# (view, table) -> a line every plan of that view's queries on the table must contain
+EXPECTED_SEARCHES = {
+    # Window leaderboards read a range of days, not every user's buckets
+    ('leaderboard', 'quizzes_dailyscorebucket'): 'USING COVERING INDEX daily_score_day_user_idx (day>?)',
+}
+
+CapturedQuery = namedtuple('CapturedQuery', ['view', 'sql'])
+
+_SCAN = re.compile(r'\bSCAN (\w+)')
+# An IN (subquery) answered by reading an entire index names only the index
+_IN_SCAN = re.compile(r'^USING (?:COVERING )?INDEX (\w+) FOR IN-OPERATOR')
+# Django's subquery and join aliases (U0, T3) stand in for table names in plans
+_ALIAS = re.compile(r'"(\w+)" (?:AS )?"?([UT]\d+)\b')
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _fixture():
+    author = User.objects.create_user('plan-author')
+    UserProfile.objects.create(user=author, is_admin=True)
+    student = User.objects.create_user('plan-student')
+    subject = Subject.objects.create(name='Plan Check', slug='plan-check')
+    quizzes = []
+    for number in range(2):
+        quiz = Quiz.objects.create(title=f'Plan {number}', description='', creator=author, subject=subject)
+        question = Question.objects.create(quiz=quiz, question_text='Q', question_type='mc', order=1)
+        Choice.objects.create(question=question, choice_text='A', is_correct=True)
+        Choice.objects.create(question=question, choice_text='B', is_correct=False)
+        Question.objects.create(quiz=quiz, question_text='S', question_type='sa', order=2,
+                                accepted_answers=['yes'])
+        quizzes.append(quiz)
+    return author, student, subject, quizzes
+
+
+def _requests(author, student, subject, quizzes):
+    """``(user, view name, method, url, data)`` for every hot path"""
+    taken, fresh = quizzes
+    mc, sa = taken.questions.order_by('order')
+    answers = {f'question_{mc.id}': mc.choices.first().id, f'question_{sa.id}': 'yes'}
+    yield student, 'take_quiz', 'post', reverse('take_quiz', args=[taken.id]), answers
+    submission = taken.submissions.get(user=student)
+    yield student, 'dashboard', 'get', reverse('dashboard'), None
+    yield student, 'quiz_list', 'get', reverse('quiz_list'), None
+    yield student, 'quiz_list', 'get', reverse('quiz_list'), {'subject': subject.slug}
+    yield student, 'quiz_list', 'get', reverse('quiz_list'), {'creator': author.username}
+    yield student, 'take_quiz', 'get', reverse('take_quiz', args=[fresh.id]), None
+    yield student, 'quiz_results', 'get', reverse('quiz_results', args=[submission.id]), None
+    yield student, 'profile', 'get', reverse('profile'), None
+    for window in ('week', 'month', 'all'):
+        yield student, 'leaderboard', 'get', reverse('leaderboard'), {'window': window}
+    yield student, 'api_user_stats', 'get', reverse('api_user_stats'), None
+    yield student, 'get_notifications', 'get', reverse('get_notifications'), None
+    yield student, 'submission_status', 'get', reverse('submission_status', args=[submission.id]), None
+    yield student, 'rankings', 'get', reverse('rankings'), None
+    yield student, 'get_user_streak', 'get', reverse('get_user_streak'), None
+    yield student, 'dashboard_stats', 'get', reverse('dashboard_stats'), None
+    yield author, 'dashboard', 'get', reverse('dashboard'), None
+    yield author, 'admin_quiz_results', 'get', reverse('admin_quiz_results', args=[taken.id]), None
+    cursor = f'{submission.score}.{submission.id}'
+    for direction in ('after', 'before'):
+        yield author, 'admin_quiz_results', 'get', reverse('admin_quiz_results', args=[taken.id]), {direction: cursor}
+    yield author, 'add_questions', 'get', reverse('add_questions', args=[taken.id]), None
+    yield author, 'search_creators', 'get', reverse('search_creators'), {'q': 'plan'}
+
+
+# A private cache keeps rolled-back rows out of the real one
+@override_settings(
+    ALLOWED_HOSTS=['testserver'],
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'query-plans'}},
+)
+def capture():
+    """SELECTs issued by the hot views, as ``CapturedQuery`` tuples"""
+    captured = []
+    try:
+        with transaction.atomic():
+            author, student, subject, quizzes = _fixture()
+            clients = {}
+            for user, view, method, url, data in _requests(author, student, subject, quizzes):
+                if user not in clients:
+                    clients[user] = Client()
+                    clients[user].force_login(user)
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(clients[user], method)(url, data)
+                if response.status_code >= 400:
+                    raise RuntimeError(f'{view} ({url}) returned {response.status_code}')
+                captured.extend(
+                    CapturedQuery(view, query['sql']) for query in queries.captured_queries
+                    if query['sql'].lstrip().upper().startswith('SELECT')
+                )
+            raise _Rollback
+    except _Rollback:
+        pass
+    return captured
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def temp_sorts(sql):
+    """Plan lines where SQLite sorts rows itself instead of reading an index in order"""
+    return [line for line in explain(sql) if 'USE TEMP B-TREE' in line]
+
+
+def _index_table(index):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT tbl_name FROM sqlite_master WHERE type = 'index' AND name = %s", [index])
+        row = cursor.fetchone()
+    return row[0] if row else index
+
+
+def full_scans(sql, allowed=ALLOWED_SCANS, view=None, ordered=ORDERED_SCANS):
+    """Tables the statement reads whole, with or without an index
+
+    A scan of the index ``ordered`` lists for ``view`` and the table is
+    accepted; any other scan of that table is not.
+    """
+    tables = set(connection.introspection.table_names())
+    aliases = {alias: table for table, alias in _ALIAS.findall(sql)}
+    scanned = set()
+    for line in explain(sql):
+        for match in _IN_SCAN.finditer(line):
+            scanned.add(_index_table(match.group(1)))
+        for match in _SCAN.finditer(line):
+            table = aliases.get(match.group(1), match.group(1))
+            index = ordered.get((view, table))
+            if index is not None and re.search(rf'USING (?:COVERING )?INDEX {index}\b', line):
+                continue
+            scanned.add(table)
+    return sorted(table for table in scanned if table in tables and table not in allowed)
+
+
+def missing_searches(view, sql, expected=EXPECTED_SEARCHES):
+    """Expected plan lines for ``view`` that the statement's plan lacks"""
+    wanted = [line for (name, table), line in expected.items() if name == view and f'"{table}"' in sql]
+    if not wanted:
+        return []
+    plan = explain(sql)
+    return [line for line in wanted if not any(line in step for step in plan)]
@@ -0,0 +1,263 @@
+"""Bulk import of questions from a JSON or CSV question bank.
+
+JSON banks are an array of question objects, or one object per line::
+
+    {"question": "Capital of France?", "type": "mc", "points": 1,
+     "choices": ["Paris", "Rome"], "correct": 0}
+    {"question": "The earth is flat.", "type": "tf", "correct": false}
+    {"question": "2 + 2?", "type": "sa", "accepted_answers": ["4", "four"],
+     "answer_match": "normalized"}
+
+``type`` defaults to ``mc`` and ``points`` to 1. ``correct`` is the index of
+the right choice (or a list of them) for multiple choice and true or false
+for true/false questions. CSV banks have the same keys as columns, with
+``choices`` and ``accepted_answers`` given one per line within the cell.
+
+``import_questions`` reads the bank twice: once to validate every question
+without writing anything, then again to insert the questions and their
+choices with ``bulk_create``, a chunk at a time, in one transaction. JSON is
+decoded incrementally, so neither pass holds more than one chunk of
+questions and memory does not grow with the size of the bank.
+"""
+import csv
+import json
+import re
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Max
+
+from .answer_keys import invalidate_answer_key
+from .models import Choice, Question
+
+
+FORMATS = ('json', 'csv')
+
+CHUNK_SIZE = 500
+READ_SIZE = 64 * 1024
+# Validation stops collecting after this many problems
+MAX_ERRORS = 50
+# Larger JSON objects are rejected instead of being buffered whole
+MAX_QUESTION_SIZE = 1024 * 1024
+
+QUESTION_TYPES = {value for value, _ in Question.QUESTION_TYPES}
+ANSWER_MATCH_TYPES = {value for value, _ in Question.ANSWER_MATCH_TYPES}
+CHOICE_MAX_LENGTH = Choice._meta.get_field('choice_text').max_length
+
+
+class QuestionBankError(Exception):
+    """A bank that cannot be imported; ``errors`` lists what is wrong with it"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def format_for(filename):
+    """Guess the bank format from a file name"""
+    return 'csv' if filename.lower().endswith('.csv') else 'json'
+
+
+def _json_items(stream):
+    """Objects from a JSON array or from one object per line, decoded incrementally"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def read():
+        nonlocal buffer, position, eof
+        data = stream.read(READ_SIZE)
+        eof = not data
+        buffer = buffer[position:] + data
+        position = 0
+
+    def peek():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or eof:
+                return buffer[position:position + 1]
+            read()
+
+    array = peek() == '['
+    if array:
+        position += 1
+    number = 0
+    while True:
+        char = peek()
+        if array and char == ']':
+            return
+        if array and number and char:
+            if char != ',':
+                raise ValueError(f'expected "," or "]" after question {number}')
+            position += 1
+            char = peek()
+        if not char:
+            if array:
+                raise ValueError('the JSON array is not closed')
+            return
+        while True:
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+                break
+            except json.JSONDecodeError as exc:
+                # Most likely the object continues past the end of the buffer
+                if eof or len(buffer) - position > MAX_QUESTION_SIZE:
+                    raise ValueError(f'invalid JSON in question {number + 1}: {exc.msg}')
+                read()
+        number += 1
+        yield item
+
+
+def _csv_items(stream):
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or 'question' not in reader.fieldnames:
+        raise ValueError('the CSV file needs a "question" column')
+    for row in reader:
+        item = {key: value for key, value in row.items() if key and value not in (None, '')}
+        for key in ('choices', 'accepted_answers'):
+            if key in item:
+                item[key] = [line for line in item[key].splitlines() if line.strip()]
+        yield item
+
+
+def _items(stream, fmt):
+    return _csv_items(stream) if fmt == 'csv' else _json_items(stream)
+
+
+def _index(value, count):
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value < count:
+        raise ValueError(f'"correct" must be a choice index from 0 to {count - 1}')
+    return value
+
+
+def parse(item):
+    """``(question fields, [(choice text, is correct), ...])`` for one bank entry
+
+    Raises ``ValueError`` describing the first problem found.
+    """
+    if not isinstance(item, dict):
+        raise ValueError('expected an object')
+    text = item.get('question')
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError('"question" is required')
+    question_type = item.get('type') or 'mc'
+    if not isinstance(question_type, str) or question_type not in QUESTION_TYPES:
+        raise ValueError(f'unknown type "{question_type}" (use {", ".join(sorted(QUESTION_TYPES))})')
+    points = item.get('points', 1)
+    try:
+        if isinstance(points, bool):
+            raise ValueError
+        points = int(points)
+    except (TypeError, ValueError):
+        raise ValueError('"points" must be a whole number')
+    if points < 1:
+        raise ValueError('"points" must be at least 1')
+
+    fields = {'question_text': text.strip(), 'question_type': question_type, 'points': points}
+    if question_type == 'mc':
+        options = item.get('choices')
+        if not isinstance(options, list) or len(options) < 2:
+            raise ValueError('a multiple choice question needs at least two "choices"')
+        for option in options:
+            if not isinstance(option, str) or not option.strip():
+                raise ValueError('every choice must be non-empty text')
+            if len(option.strip()) > CHOICE_MAX_LENGTH:
+                raise ValueError(f'choices are limited to {CHOICE_MAX_LENGTH} characters')
+        correct = item.get('correct')
+        correct = {_index(value, len(options)) for value in (correct if isinstance(correct, list) else [correct])}
+        if not correct:
+            raise ValueError('"correct" must name at least one choice')
+        return fields, [(option.strip(), index in correct) for index, option in enumerate(options)]
+
+    if question_type == 'tf':
+        answer = item.get('correct')
+        if isinstance(answer, str):
+            answer = {'true': True, 'false': False}.get(answer.strip().lower())
+        if not isinstance(answer, bool):
+            raise ValueError('a true/false question needs "correct": true or false')
+        # Graded by matching the submitted "True"/"False" against the correct choice
+        return fields, [('True', answer), ('False', not answer)]
+
+    accepted = item.get('accepted_answers')
+    if isinstance(accepted, str):
+        accepted = [accepted]
+    if not isinstance(accepted, list) or not all(isinstance(answer, str) for answer in accepted):
+        raise ValueError('"accepted_answers" must be a list of text')
+    accepted = [answer.strip() for answer in accepted if answer.strip()]
+    if not accepted:
+        raise ValueError('a short answer question needs at least one accepted answer')
+    answer_match = item.get('answer_match') or 'normalized'
+    if not isinstance(answer_match, str) or answer_match not in ANSWER_MATCH_TYPES:
+        raise ValueError(f'unknown answer_match "{answer_match}"')
+    if answer_match == 'regex':
+        for pattern in accepted:
+            try:
+                re.compile(pattern)
+            except re.error as exc:
+                raise ValueError(f'invalid regular expression "{pattern}": {exc}')
+    fields.update(accepted_answers=accepted, answer_match=answer_match)
+    return fields, []
+
+
+def validate(stream, fmt):
+    """Check a whole bank; returns ``(questions, errors)``"""
+    count = 0
+    errors = []
+    items = _items(stream, fmt)
+    while len(errors) < MAX_ERRORS:
+        try:
+            item = next(items)
+        except StopIteration:
+            break
+        except (ValueError, csv.Error) as exc:
+            # The file itself is unreadable past this point
+            errors.append(f'Question {count + 1}: {exc}')
+            break
+        count += 1
+        try:
+            parse(item)
+        except ValueError as exc:
+            errors.append(f'Question {count}: {exc}')
+    return count, errors
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def import_questions(quiz, stream, fmt, chunk_size=CHUNK_SIZE):
+    """Validate a bank, then append all of its questions to ``quiz``; returns how many
+
+    ``stream`` is a seekable text file. Nothing is written unless every
+    question is valid; otherwise ``QuestionBankError`` lists the problems.
+    """
+    count, errors = validate(stream, fmt)
+    if errors:
+        raise QuestionBankError(errors)
+    if not count:
+        raise QuestionBankError(['The file contains no questions.'])
+
+    stream.seek(0)
+    with transaction.atomic():
+        order = quiz.questions.aggregate(last=Max('order'))['last'] or 0
+        for chunk in _chunks((parse(item) for item in _items(stream, fmt)), chunk_size):
+            questions = []
+            for fields, _ in chunk:
+                order += 1
+                questions.append(Question(quiz=quiz, order=order, **fields))
+            Question.objects.bulk_create(questions)
+            Choice.objects.bulk_create([
+                Choice(question_id=question.id, choice_text=text, is_correct=is_correct)
+                for question, (_, choices) in zip(questions, chunk)
+                for text, is_correct in choices
+            ])
+    # bulk_create sends no post_save, so the answer key is retired here
+    invalidate_answer_key(quiz.id)
+    return count
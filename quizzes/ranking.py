@@ -0,0 +1,203 @@
+"""Rank index over ``UserProfile.total_score``.
+
+Ranks are answered from a Fenwick (binary indexed) tree stored in the
+``RankIndexNode`` table instead of a ``COUNT(*)`` over every profile. Position
+``p`` of the tree stands for the score ``RANK_INDEX_SIZE - p``, so higher
+scores sit at lower positions and a prefix sum counts the users ranked above
+a score.
+
+* rank of a score: one query reading at most log2(size) rows
+* moving a user to a new score: two statements touching log2(size) rows each,
+  applied with ``F()`` increments so concurrent workers never lose updates
+* the score at rank N: a log2(size) step descent, fetching every node the
+  next ``DESCENT_LEVELS`` steps could visit in one query
+
+Only profiles with at least one quiz taken are indexed, matching
+``UserProfile.get_rank``. Scores at or above ``RANK_INDEX_SIZE - 1`` share the
+top position. ``manage.py rebuild_rank_index`` rebuilds or checks the tree.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import RankIndexNode, UserProfile
+
+
+# Steps of the score_at_rank descent answered per query (2**5 - 1 nodes)
+DESCENT_LEVELS = 5
+
+
+def index_size():
+    return getattr(settings, 'RANK_INDEX_SIZE', 2 ** 20)
+
+
+def _position(score, size):
+    return size - min(max(score, 0), size - 1)
+
+
+def _prefix_path(position):
+    path = []
+    while position > 0:
+        path.append(position)
+        position -= position & -position
+    return path
+
+
+def _update_path(position, size):
+    path = []
+    while position <= size:
+        path.append(position)
+        position += position & -position
+    return path
+
+
+def count_above(score):
+    """Number of ranked users with a higher total score"""
+    size = index_size()
+    path = _prefix_path(_position(score, size) - 1)
+    if not path:
+        return 0
+    return RankIndexNode.objects.filter(position__in=path).aggregate(total=Sum('count'))['total'] or 0
+
+
+def rank_for_score(score):
+    return count_above(score) + 1
+
+
+def apply_moves(moves):
+    """Move users between scores in the index.
+
+    ``moves`` is an iterable of ``(old_score, new_score)`` pairs; use ``None``
+    for a side that is not ranked (e.g. a user's first quiz has no old score).
+    """
+    size = index_size()
+    deltas = defaultdict(int)
+    for old_score, new_score in moves:
+        if old_score == new_score:
+            continue
+        if old_score is not None:
+            for position in _update_path(_position(old_score, size), size):
+                deltas[position] -= 1
+        if new_score is not None:
+            for position in _update_path(_position(new_score, size), size):
+                deltas[position] += 1
+
+    by_delta = defaultdict(list)
+    for position, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(position)
+    if not by_delta:
+        return
+
+    with transaction.atomic():
+        RankIndexNode.objects.bulk_create(
+            [RankIndexNode(position=position) for positions in by_delta.values() for position in positions],
+            ignore_conflicts=True,
+        )
+        for delta, positions in by_delta.items():
+            RankIndexNode.objects.filter(position__in=positions).update(count=F('count') + delta)
+
+
+def score_at_rank(rank):
+    """Score held by the user at ``rank`` (1-based), or ``None`` past the end"""
+    size = index_size()
+    step = 1 << (size.bit_length() - 1)
+    position = 0
+    remaining = rank
+    while step:
+        # The next steps can only visit position + a multiple of the smallest one
+        levels = min(DESCENT_LEVELS, step.bit_length())
+        lowest = step >> (levels - 1)
+        candidates = [position + lowest * multiple for multiple in range(1, 1 << levels)]
+        counts = dict(
+            RankIndexNode.objects.filter(position__in=[candidate for candidate in candidates if candidate <= size])
+            .values_list('position', 'count')
+        )
+        for _ in range(levels):
+            candidate = position + step
+            if candidate <= size:
+                node = counts.get(candidate, 0)
+                if node < remaining:
+                    position = candidate
+                    remaining -= node
+            step >>= 1
+    if position >= size:
+        return None
+    return size - (position + 1)
+
+
+def profiles_ranked(start, end):
+    """Profiles ranked ``start`` to ``end`` inclusive (1-based).
+
+    Each profile gets a ``rank`` attribute; tied scores share a rank.
+    """
+    if start < 1 or end < start:
+        return []
+    threshold = score_at_rank(start)
+    if threshold is None:
+        return []
+    above = count_above(threshold)
+    # Only ties at the threshold score need to be skipped with OFFSET
+    offset = start - 1 - above
+    profiles = list(
+        UserProfile.objects.filter(total_quizzes_taken__gt=0, total_score__lte=threshold)
+        .select_related('user')
+        .order_by('-total_score', 'id')[offset:offset + end - start + 1]
+    )
+    previous = None
+    for place, profile in enumerate(profiles, start=start):
+        if previous is None:
+            profile.rank = above + 1
+        elif profile.total_score != previous.total_score:
+            profile.rank = place
+        else:
+            profile.rank = previous.rank
+        previous = profile
+    return profiles
+
+
+def build_tree(score_counts, size):
+    """Build Fenwick nodes from ``{score: user_count}`` in O(size)"""
+    tree = [0] * (size + 1)
+    for score, count in score_counts.items():
+        tree[_position(score, size)] += count
+    for position in range(1, size + 1):
+        parent = position + (position & -position)
+        if parent <= size:
+            tree[parent] += tree[position]
+    return {position: count for position, count in enumerate(tree) if position and count}
+
+
+def live_score_counts():
+    """``{score: user_count}`` for ranked profiles, from one grouped query"""
+    rows = (
+        UserProfile.objects.filter(total_quizzes_taken__gt=0)
+        .values('total_score')
+        .annotate(users=Count('id'))
+        .order_by()
+    )
+    return {row['total_score']: row['users'] for row in rows}
+
+
+def rebuild(batch_size=5000):
+    """Replace the stored tree with one built from live profiles"""
+    nodes = build_tree(live_score_counts(), index_size())
+    with transaction.atomic():
+        RankIndexNode.objects.all().delete()
+        RankIndexNode.objects.bulk_create(
+            [RankIndexNode(position=position, count=count) for position, count in nodes.items()],
+            batch_size=batch_size,
+        )
+    return len(nodes)
+
+
+def check():
+    """Compare the stored tree with live data; return mismatching positions"""
+    expected = build_tree(live_score_counts(), index_size())
+    stored = dict(RankIndexNode.objects.exclude(count=0).values_list('position', 'count'))
+    return sorted(
+        position for position in expected.keys() | stored.keys()
+        if expected.get(position, 0) != stored.get(position, 0)
+    )
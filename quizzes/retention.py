@@ -0,0 +1,106 @@
+"""Retention for the notification table.
+
+Unread notifications are the hot set and stay indefinitely. Read ones older
+than the retention period are deleted, or moved to ``ArchivedNotification``,
+by ``manage.py prune_notifications``. Every batch is its own short
+transaction, and the command can pause between batches, so the SQLite write
+lock is never held for long and request traffic keeps flowing.
+
+Only read rows are pruned, so unread counters and notification stamps are
+unaffected.
+"""
+import time
+from datetime import timedelta
+
+from django.db import connection, connections, transaction
+from django.db.utils import DatabaseError
+from django.utils import timezone
+
+from .models import ArchivedNotification, Notification
+
+
+def prunable(days):
+    """Read notifications older than ``days``, oldest first"""
+    cutoff = timezone.now() - timedelta(days=days)
+    return Notification.objects.filter(read=True, created_at__lt=cutoff).order_by('created_at', 'id')
+
+
+def prune_batch(days, batch_size, archive=False):
+    """Delete (or archive) up to ``batch_size`` old read notifications"""
+    with transaction.atomic():
+        rows = list(
+            prunable(days).values('id', 'user_id', 'type', 'title', 'message', 'count', 'created_at')[:batch_size]
+        )
+        if not rows:
+            return 0
+        ids = [row['id'] for row in rows]
+        if archive:
+            ArchivedNotification.objects.bulk_create(
+                [
+                    ArchivedNotification(
+                        notification_id=row['id'],
+                        user_id=row['user_id'],
+                        type=row['type'],
+                        title=row['title'],
+                        message=row['message'],
+                        count=row['count'],
+                        created_at=row['created_at'],
+                    )
+                    for row in rows
+                ],
+                ignore_conflicts=True,
+            )
+        Notification.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def prune(days, batch_size=1000, archive=False, pause=0.0, limit=None):
+    """Prune in batches, yielding ``(rows, seconds)`` for each one.
+
+    ``pause`` seconds are slept between batches to let other writers in;
+    ``limit`` caps the rows handled in one run.
+    """
+    pruned = 0
+    while limit is None or pruned < limit:
+        size = batch_size if limit is None else min(batch_size, limit - pruned)
+        started = time.perf_counter()
+        rows = prune_batch(days, size, archive)
+        if not rows:
+            break
+        pruned += rows
+        yield rows, time.perf_counter() - started
+        if pause:
+            time.sleep(pause)
+
+
+def table_stats():
+    """Row counts, plus on-disk bytes where the database can report them"""
+    stats = {
+        'notifications': Notification.objects.count(),
+        'unread': Notification.objects.filter(read=False).count(),
+        'archived': ArchivedNotification.objects.count(),
+        'notification_bytes': None,
+        'archive_bytes': None,
+    }
+    if connection.vendor == 'sqlite':
+        for key, table in (
+            ('notification_bytes', Notification._meta.db_table),
+            ('archive_bytes', ArchivedNotification._meta.db_table),
+        ):
+            stats[key] = sqlite_table_bytes(table)
+    return stats
+
+
+def sqlite_table_bytes(table, using='default'):
+    """On-disk bytes of a table and its indexes (``None`` without dbstat)"""
+    # dbstat is an optional SQLite extension; report nothing without it
+    try:
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                'SELECT SUM(pgsize) FROM dbstat WHERE name = %s '
+                'OR name IN (SELECT name FROM sqlite_master WHERE type = %s AND tbl_name = %s)',
+                [table, 'index', table],
+            )
+            return cursor.fetchone()[0]
+    except DatabaseError:
+        return None
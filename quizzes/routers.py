@@ -0,0 +1,142 @@
+"""Read replica and submission shard routing.
+
+When ``DATABASES`` has a ``replica`` alias, reads made inside a view
+decorated with ``use_replica`` (or a ``replica_reads()`` block) go to it and
+everything else stays on the primary. Writes always go to the primary, even
+for objects that were loaded from the replica.
+
+A replica lags the primary, so a user who has just written something is
+pinned to the primary for ``REPLICA_STICKY_SECONDS``: ``stick_to_primary``
+marks the request and ``middleware.primary_stickiness_middleware`` carries
+the mark across the following requests in a cookie.
+
+``ShardRouter`` comes first and only answers for the sharded submission
+models (see ``sharding.py``); everything else falls through to
+``ReplicaRouter``.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import sharding
+
+
+REPLICA = 'replica'
+
+_replica_reads = ContextVar('quizzes_replica_reads', default=False)
+_sticky = ContextVar('quizzes_sticky_to_primary', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def replica_reads():
+    """Route reads in the block to the replica (unless the request is sticky)"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def use_replica(view):
+    """Declare a view read-only so its queries may be served by the replica"""
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapped
+
+
+def replica_iterator(iterable):
+    """Iterate ``iterable`` with replica reads, e.g. a streaming response body
+
+    A streamed body is consumed after the view has returned, outside
+    ``use_replica``, so the generator has to route its own reads.
+    """
+    with replica_reads():
+        yield from iterable
+
+
+def _next_on_replica(iterator):
+    with replica_reads():
+        return next(iterator, None)
+
+
+async def async_replica_iterator(iterable):
+    """``replica_iterator`` for a response served under ASGI
+
+    Django drains a sync body with ``sync_to_async(list)`` before sending a
+    byte, so items are pulled one at a time in the worker thread instead.
+    Each pull routes its own reads: a context variable set in one
+    ``sync_to_async`` call cannot be reset in the next.
+    """
+    iterator = iter(iterable)
+    pull = sync_to_async(_next_on_replica)
+    while (item := await pull(iterator)) is not None:
+        yield item
+
+
+def stick_to_primary(request):
+    """Keep this user's reads on the primary until the replica has caught up"""
+    request.stick_to_primary = True
+    _sticky.set(True)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and not _sticky.get() and replica_configured():
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, so objects from either relate
+        return {obj1._state.db, obj2._state.db} <= {'default', REPLICA}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary when it is refreshed
+        return db != REPLICA
+
+
+class ShardRouter:
+    def _shard_for(self, model, instance=None, **hints):
+        if not sharding.enabled() or not sharding.is_sharded(model) or instance is None:
+            return None
+        if sharding.is_sharded(instance):
+            if instance._state.db:
+                return instance._state.db
+            # An unsaved answer or queue row follows its submission
+            submission = instance._state.fields_cache.get('submission')
+            if submission is not None:
+                return self._shard_for(model, instance=submission)
+            quiz_id = getattr(instance, 'quiz_id', None)
+            return sharding.shard_for_quiz(quiz_id) if quiz_id is not None else None
+        if instance._meta.model_name == 'quiz':
+            return sharding.shard_for_quiz(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._shard_for(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard_for(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Submissions point at catalog rows in another file by design
+        if sharding.enabled() and (sharding.is_sharded(obj1) or sharding.is_sharded(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards hold the sharded tables only; default keeps its full schema
+        if db.startswith('shard_'):
+            return app_label == 'quizzes' and model_name in sharding.SHARDED_MODELS
+        return None
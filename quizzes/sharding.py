@@ -0,0 +1,288 @@
+"""Optional sharding of submissions across SQLite files.
+
+With ``QUIZ_SUBMISSION_SHARDS = N`` (N > 0) the ``QuizSubmission``,
+``Answer`` and ``PendingGrade`` rows of a quiz live in database
+``shard_<crc32(quiz_id) % N>``, so submissions to different quizzes no longer
+share one write lock. Catalog tables (quizzes, questions, users, profiles and
+every rollup) stay on ``default``.
+
+``routers.ShardRouter`` sends sharded models to the right file whenever Django
+passes an instance hint (``quiz.submissions``, ``submission.answers``,
+``submission.save()``). Querysets built from the manager carry no hint, so
+code that reads or writes them picks a shard explicitly with
+``for_quiz()`` / ``shard_for_quiz()``, or spans all shards with the
+scatter-gather helpers below. With sharding off, every helper reduces to the
+plain single-database query.
+
+Submission ids must stay unique across shards (they appear in URLs and move
+with ``rebalance_shards``), so in sharded mode they come from
+``next_submission_id()`` in blocks rather than from each file's own
+sequence.
+"""
+import heapq
+import threading
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Max
+from django.http import Http404
+
+from .models import Answer, PendingGrade, QuizSubmission, ShardSequence
+
+
+SHARDED_MODELS = {'quizsubmission', 'answer', 'pendinggrade'}
+ID_BLOCK_SIZE = 100
+
+_id_block = {'next': 0, 'end': 0}
+_id_lock = threading.Lock()
+
+
+def shard_count():
+    return getattr(settings, 'QUIZ_SUBMISSION_SHARDS', 0)
+
+
+def enabled():
+    return shard_count() > 0
+
+
+def shard_aliases():
+    """Database aliases holding submissions (``['default']`` when not sharded)"""
+    if not enabled():
+        return ['default']
+    return [f'shard_{number}' for number in range(shard_count())]
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'quizzes' and model._meta.model_name in SHARDED_MODELS
+
+
+def shard_for_quiz(quiz_id):
+    if not enabled():
+        return 'default'
+    return f'shard_{zlib.crc32(str(quiz_id).encode()) % shard_count()}'
+
+
+def using(model, alias):
+    """``model.objects`` on ``alias`` (left to the routers when not sharded)"""
+    if not enabled():
+        return model.objects.all()
+    return model.objects.using(alias)
+
+
+def for_quiz(model, quiz_id):
+    """``model.objects`` on the shard holding ``quiz_id``"""
+    return using(model, shard_for_quiz(quiz_id))
+
+
+def _on(queryset, alias):
+    return queryset.using(alias) if enabled() else queryset
+
+
+@contextmanager
+def atomic(alias):
+    """A transaction on ``default`` wrapping one on ``alias``.
+
+    The shard commits first: if the primary then fails, the submission is kept
+    without its rollups, which the ``rebuild_*`` commands can restore.
+    """
+    if alias == 'default':
+        with transaction.atomic():
+            yield
+        return
+    with transaction.atomic(), transaction.atomic(using=alias):
+        yield
+
+
+def next_submission_id():
+    """A globally unique id for a new submission (``None`` when not sharded).
+
+    Ids are reserved on ``default`` in blocks of ``ID_BLOCK_SIZE``. Call this
+    outside any transaction, so a rolled-back submission cannot hand its block
+    back; unused ids simply leave a gap.
+    """
+    if not enabled():
+        return None
+    with _id_lock:
+        if _id_block['next'] >= _id_block['end']:
+            start = _reserve_ids(ID_BLOCK_SIZE)
+            _id_block.update(next=start, end=start + ID_BLOCK_SIZE)
+        value = _id_block['next']
+        _id_block['next'] += 1
+        return value
+
+
+def _reserve_ids(count):
+    with transaction.atomic():
+        if not ShardSequence.objects.filter(name='submission').exists():
+            # Start above every id already handed out, sharded or not
+            highest = max(_max_id(alias) for alias in {'default', *shard_aliases()})
+            ShardSequence.objects.get_or_create(name='submission', defaults={'value': highest})
+        ShardSequence.objects.filter(name='submission').update(value=F('value') + count)
+        end = ShardSequence.objects.get(name='submission').value
+    return end - count + 1
+
+
+def _max_id(alias):
+    if QuizSubmission._meta.db_table not in connections[alias].introspection.table_names():
+        return 0
+    return QuizSubmission.objects.using(alias).aggregate(highest=Max('id'))['highest'] or 0
+
+
+def related(queryset, *fields):
+    """``select_related`` where possible; catalog rows cannot be joined from a shard"""
+    if enabled():
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def gather(queryset, limit=None, key=None, reverse=False):
+    """Run ``queryset`` on every shard and merge the results.
+
+    ``queryset`` must already be ordered by ``key`` (an attribute name) for
+    the merge to keep that order.
+    """
+    if not enabled():
+        return list(queryset[:limit] if limit is not None else queryset)
+    parts = [
+        list(queryset.using(alias)[:limit] if limit is not None else queryset.using(alias))
+        for alias in shard_aliases()
+    ]
+    if key is not None:
+        rows = heapq.merge(*parts, key=attrgetter(key), reverse=reverse)
+    else:
+        rows = (row for part in parts for row in part)
+    rows = list(rows)
+    return rows[:limit] if limit is not None else rows
+
+
+def find_submission(**lookup):
+    """The submission matching ``lookup`` on whichever shard holds it"""
+    for alias in shard_aliases():
+        submission = using(QuizSubmission, alias).filter(**lookup).first()
+        if submission is not None:
+            return submission
+    raise QuizSubmission.DoesNotExist
+
+
+def get_submission_or_404(**lookup):
+    try:
+        return find_submission(**lookup)
+    except QuizSubmission.DoesNotExist:
+        raise Http404('No QuizSubmission matches the given query.')
+
+
+def totals(queryset, **aggregates):
+    """``aggregate()`` summed over shards (only for Sum and Count)"""
+    if not enabled():
+        return queryset.aggregate(**aggregates)
+    combined = dict.fromkeys(aggregates)
+    for alias in shard_aliases():
+        for name, value in queryset.using(alias).aggregate(**aggregates).items():
+            if value is not None:
+                combined[name] = (combined[name] or 0) + value
+    return combined
+
+
+def count_by(queryset, field):
+    """``{value: row count}`` of ``field`` over every shard"""
+    counts = defaultdict(int)
+    for alias in shard_aliases():
+        rows = _on(queryset, alias).values(field).annotate(rows=Count('id')).order_by().values_list(field, 'rows')
+        for value, rows_count in rows:
+            counts[value] += rows_count
+    return dict(counts)
+
+
+def count_distinct(queryset, field):
+    if not enabled():
+        return queryset.values(field).distinct().count()
+    values = set()
+    for alias in shard_aliases():
+        values.update(queryset.using(alias).values_list(field, flat=True).order_by().distinct())
+    return len(values)
+
+
+def exclude_taken(quizzes, user):
+    """``quizzes`` without the ones ``user`` has submitted (archived submissions included)"""
+    quizzes = quizzes.exclude(archived_submissions__user=user)
+    if not enabled():
+        return quizzes.exclude(submissions__user=user)
+    taken = set()
+    for alias in shard_aliases():
+        taken.update(QuizSubmission.objects.using(alias).filter(user=user).values_list('quiz_id', flat=True))
+    return quizzes.exclude(id__in=taken)
+
+
+def merged_rows(queryset, keys, combine, chunk_size=5000, also=()):
+    """Grouped ``values()`` rows from every shard, merged on ``keys``.
+
+    ``combine`` maps each value column to a function folding two shards'
+    values (e.g. ``operator.add`` for sums). ``also`` are more grouped
+    querysets with the same columns (such as the same query over archived
+    submissions) merged in as well. With one database and nothing else to
+    merge, the rows stream straight through.
+    """
+    if not enabled() and not also:
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+    merged = {}
+    sources = [_on(queryset, alias) for alias in shard_aliases()] + list(also)
+    for source in sources:
+        for row in source.iterator(chunk_size=chunk_size):
+            group = tuple(row[name] for name in keys)
+            if group in merged:
+                current = merged[group]
+                for name, fold in combine.items():
+                    current[name] = fold(current[name], row[name])
+            else:
+                merged[group] = row
+    yield from merged.values()
+
+
+def move_quiz(quiz_id, source, target, batch_size=500):
+    """Move one quiz's submissions from ``source`` to ``target`` in batches.
+
+    Each batch is committed on the target before it is deleted from the
+    source. A crash in between leaves a copy on both sides; the next run
+    replaces the target copy, so nothing is lost or duplicated. Yields the
+    number of submissions moved per batch.
+    """
+    while True:
+        with transaction.atomic(using=source):
+            submissions = list(
+                QuizSubmission.objects.using(source).filter(quiz_id=quiz_id).order_by('id')[:batch_size]
+            )
+            if not submissions:
+                return
+            ids = [submission.id for submission in submissions]
+            answers = list(Answer.objects.using(source).filter(submission_id__in=ids))
+            pending = list(PendingGrade.objects.using(source).filter(submission_id__in=ids))
+
+        with transaction.atomic(using=target):
+            QuizSubmission.objects.using(target).filter(id__in=ids).delete()
+            QuizSubmission.objects.using(target).bulk_create(submissions)
+            # Answer and queue ids are local to each file
+            for row in answers + pending:
+                row.pk = None
+            Answer.objects.using(target).bulk_create(answers)
+            PendingGrade.objects.using(target).bulk_create(pending)
+
+        with transaction.atomic(using=source):
+            QuizSubmission.objects.using(source).filter(id__in=ids).delete()
+        yield len(ids)
+
+
+def misplaced_quizzes(alias):
+    """``{quiz_id: target}`` for quizzes on ``alias`` that hash elsewhere"""
+    if QuizSubmission._meta.db_table not in connections[alias].introspection.table_names():
+        return {}
+    quiz_ids = QuizSubmission.objects.using(alias).values_list('quiz_id', flat=True).distinct().order_by()
+    return {
+        quiz_id: shard_for_quiz(quiz_id)
+        for quiz_id in quiz_ids
+        if shard_for_quiz(quiz_id) != alias
+    }
@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import ranking, sharding, subjects
+from .answer_keys import invalidate_answer_key
+from .models import Answer, Choice, Question, Quiz, QuizSubmission, UserProfile
+
+
+def _cascaded(sender, origin):
+    """Whether a delete was started by a parent row rather than by ``sender`` itself"""
+    if origin is None:
+        return False
+    model = type(origin) if isinstance(origin, models.Model) else origin.model
+    return model is not sender
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, origin=None, **kwargs):
+    """Retire the quiz's answer key when one of its questions changes"""
+    # Deleting a quiz takes its answer key with it
+    if not _cascaded(sender, origin):
+        invalidate_answer_key(instance.quiz_id)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, origin=None, **kwargs):
+    """Retire the quiz's answer key when one of its choices changes"""
+    # A deleted question retires the key once for all of its choices
+    if _cascaded(sender, origin):
+        return
+    if Choice.question.is_cached(instance):
+        quiz_id = instance.question.quiz_id
+    else:
+        quiz_id = Question.objects.filter(pk=instance.question_id).values_list('quiz_id', flat=True).first()
+    if quiz_id is not None:
+        invalidate_answer_key(quiz_id)
+
+
+@receiver(pre_save, sender=Quiz)
+def quiz_saving(sender, instance, update_fields=None, **kwargs):
+    """Remember the stored subject, so a change can move its totals"""
+    if instance._state.adding or (update_fields is not None and 'subject' not in update_fields):
+        instance._stored_subject_id = instance.subject_id
+    else:
+        instance._stored_subject_id = (
+            Quiz.objects.filter(pk=instance.pk).values_list('subject_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Quiz)
+def quiz_saved(sender, instance, created, **kwargs):
+    """Move the quiz's attempts to its new subject's totals"""
+    old_subject_id = getattr(instance, '_stored_subject_id', instance.subject_id)
+    if not created and old_subject_id != instance.subject_id:
+        subjects.change_subject(instance.pk, old_subject_id, instance.subject_id)
+    instance._stored_subject_id = instance.subject_id
+
+
+@receiver(post_delete, sender=UserProfile)
+def profile_deleted(sender, instance, **kwargs):
+    """Drop a deleted profile from the rank index"""
+    if instance.total_quizzes_taken > 0:
+        ranking.apply_moves([(instance.total_score, None)])
+
+
+def _delete_from_shards(model, **lookup):
+    if sharding.enabled():
+        for alias in sharding.shard_aliases():
+            model.objects.using(alias).filter(**lookup).delete()
+
+
+# Rows on shards are out of reach of the primary's cascades, so they are
+# deleted here along with the catalog rows they point at
+@receiver(pre_delete, sender=Quiz)
+def quiz_deleted(sender, instance, **kwargs):
+    _delete_from_shards(QuizSubmission, quiz_id=instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    _delete_from_shards(QuizSubmission, user_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    _delete_from_shards(Answer, question_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Choice)
+def choice_deleted(sender, instance, **kwargs):
+    _delete_from_shards(Answer, selected_choice_id=instance.pk)
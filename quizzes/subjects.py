@@ -0,0 +1,139 @@
+"""Per-user, per-subject performance.
+
+``SubjectPerformance`` keeps attempt count, score sum and points sum for every
+user and subject, updated with one counter increment when a submission is
+recorded. Profile and stats pages read a user's breakdown with a single
+lookup on the ``(user, subject)`` unique index. Quizzes without a subject are
+not tracked.
+
+When a quiz is saved with another subject, ``change_subject`` moves its
+attempts over (see ``signals.py``). A bulk ``Quiz.objects.update(subject=...)``
+sends no signals; run ``manage.py rebuild_subject_performance`` after one.
+"""
+import operator
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from . import sharding
+from .counters import bump
+from .models import ArchivedSubmission, Quiz, QuizSubmission, SubjectPerformance
+
+
+def record_attempt(submission, subject_id, score_delta=None, attempts_delta=1, points_delta=None):
+    """Add a graded submission to its user's totals for the quiz's subject"""
+    if subject_id is None:
+        return
+    bump(
+        SubjectPerformance,
+        {'user_id': submission.user_id, 'subject_id': subject_id},
+        attempts=attempts_delta,
+        score_sum=submission.score if score_delta is None else score_delta,
+        points_sum=submission.total_points if points_delta is None else points_delta,
+    )
+
+
+def change_subject(quiz_id, old_subject_id, new_subject_id, batch_size=5000):
+    """Move a quiz's attempts from its old subject's totals to the new one's"""
+    sums = {'attempts': operator.add, 'score_sum': operator.add, 'points_sum': operator.add}
+    rows = sharding.merged_rows(
+        _per_user(QuizSubmission.objects.filter(quiz_id=quiz_id, status='graded')),
+        keys=('user_id',), combine=sums, chunk_size=batch_size,
+        also=[_per_user(ArchivedSubmission.objects.filter(quiz_id=quiz_id))],
+    )
+    with transaction.atomic():
+        for row in rows:
+            for subject_id, sign in ((old_subject_id, -1), (new_subject_id, 1)):
+                if subject_id is not None:
+                    bump(
+                        SubjectPerformance,
+                        {'user_id': row['user_id'], 'subject_id': subject_id},
+                        **{name: sign * row[name] for name in sums},
+                    )
+        # rebuild() writes no row for a subject a user has no attempts in
+        SubjectPerformance.objects.filter(subject_id=old_subject_id, attempts__lte=0).delete()
+
+
+def performance_for(user):
+    """A user's ``SubjectPerformance`` rows with their subjects"""
+    return list(
+        SubjectPerformance.objects.filter(user=user, attempts__gt=0)
+        .select_related('subject')
+        .order_by('subject__name')
+    )
+
+
+def rebuild(batch_size=5000):
+    """Rebuild every row from ``QuizSubmission`` with one grouped query"""
+    rows = _grouped_submissions(batch_size)
+    with transaction.atomic():
+        SubjectPerformance.objects.all().delete()
+        written = 0
+        batch = []
+        for row in rows:
+            batch.append(SubjectPerformance(
+                user_id=row['user_id'],
+                subject_id=row['quiz__subject_id'],
+                attempts=row['attempts'],
+                score_sum=row['score_sum'],
+                points_sum=row['points_sum'],
+            ))
+            if len(batch) >= batch_size:
+                SubjectPerformance.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        SubjectPerformance.objects.bulk_create(batch)
+    return written + len(batch)
+
+
+def _grouped(queryset):
+    return (
+        queryset.filter(quiz__subject__isnull=False)
+        .values('user_id', 'quiz__subject_id')
+        .annotate(attempts=Count('id'), score_sum=Sum('score'), points_sum=Sum('total_points'))
+        .order_by()
+    )
+
+
+def _per_user(queryset):
+    return (
+        queryset.values('user_id')
+        .annotate(attempts=Count('id'), score_sum=Sum('score'), points_sum=Sum('total_points'))
+        .order_by()
+    )
+
+
+def _grouped_submissions(batch_size):
+    graded = QuizSubmission.objects.filter(status='graded')
+    archived = _grouped(ArchivedSubmission.objects.all())
+    sums = {'attempts': operator.add, 'score_sum': operator.add, 'points_sum': operator.add}
+    if not sharding.enabled():
+        yield from sharding.merged_rows(
+            _grouped(graded), keys=('user_id', 'quiz__subject_id'), combine=sums,
+            chunk_size=batch_size, also=[archived],
+        )
+        return
+    # Shards cannot join the quiz table, so subjects are looked up instead
+    subject_of = dict(Quiz.objects.filter(subject__isnull=False).values_list('id', 'subject_id'))
+    totals = {}
+    for alias in sharding.shard_aliases():
+        submissions = graded.using(alias).filter(quiz_id__in=subject_of)
+        for user_id, quiz_id, score, points in (
+            submissions.values_list('user_id', 'quiz_id', 'score', 'total_points').iterator(chunk_size=batch_size)
+        ):
+            row = totals.setdefault((user_id, subject_of[quiz_id]), {
+                'user_id': user_id,
+                'quiz__subject_id': subject_of[quiz_id],
+                'attempts': 0,
+                'score_sum': 0,
+                'points_sum': 0,
+            })
+            row['attempts'] += 1
+            row['score_sum'] += score
+            row['points_sum'] += points
+    for archived_row in archived.iterator(chunk_size=batch_size):
+        row = totals.setdefault((archived_row['user_id'], archived_row['quiz__subject_id']), archived_row)
+        if row is not archived_row:
+            for name, fold in sums.items():
+                row[name] = fold(row[name], archived_row[name])
+    yield from totals.values()
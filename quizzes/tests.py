@@ -1,3 +1,1205 @@
-from django.test import TestCase
+import contextvars
+import csv
+import io
+import json
+import random
+import tempfile
+import zlib
+from datetime import datetime, time, timedelta
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, connections
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    achievements, activity, answer_keys, archive, broadcasts, distributions, grading, leaderboards, notifications,
+    packed_answers, purge, query_plans, question_bank, ranking, retention, routers, sharding, subjects,
+)
+from .answer_keys import get_answer_key
+from .api_views import create_notification
+from .models import (
+    Answer, ArchivedNotification, Choice, DailyScoreBucket, MonthlyActivity, Notification, NotificationBroadcast,
+    PendingGrade, Question, Quiz, QuizFeedback, QuizSubmission, StudyStreak, Subject, SubjectPerformance,
+    UserAchievement, UserProfile,
+)
+from .middleware import STICKY_COOKIE
+from .routers import ReplicaRouter, ShardRouter
+
+
+class QuizTestCase(TestCase):
+    """Shared fixtures; caches are cleared because rolled-back ids are reused"""
+
+    # Submissions live on the shards when QUIZ_SUBMISSION_SHARDS is set
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # The test replica mirrors default; a connection of its own could not
+        # read the rows written inside the test transaction
+        if routers.replica_configured():
+            connections[routers.REPLICA] = connections['default']
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if routers.replica_configured():
+            del connections[routers.REPLICA]
+
+    def setUp(self):
+        cache.clear()
+        answer_keys._local_keys.clear()
+        achievements.reset_rules()
+        self.author = User.objects.create_user('author')
+        UserProfile.objects.create(user=self.author, is_admin=True)
+
+    def make_quiz(self, questions=2, choices=2, title='Quiz'):
+        """A quiz whose multiple choice questions have their first choice correct"""
+        quiz = Quiz.objects.create(title=title, description='', creator=self.author)
+        for number in range(questions):
+            question = Question.objects.create(quiz=quiz, question_text=f'Q{number}', order=number + 1)
+            for index in range(choices):
+                Choice.objects.create(question=question, choice_text=f'C{index}', is_correct=index == 0)
+        quiz.refresh_from_db()
+        return quiz
+
+    def make_user(self, username):
+        # No password: hashing one is most of the cost of a test user
+        return User.objects.create_user(username)
+
+    def answers(self, quiz, correct):
+        """Form data answering the first ``correct`` questions right and the rest wrong"""
+        data = {}
+        for number, question in enumerate(quiz.questions.order_by('order')):
+            choices = list(question.choices.order_by('id'))
+            data[f'question_{question.id}'] = choices[0 if number < correct else 1].id
+        return data
+
+
+def _updates(queries, table):
+    return [query for query in queries if query['sql'].startswith(f'UPDATE "{table}"')]
+
+
+class AnswerKeyVersionTests(QuizTestCase):
+    def version(self, quiz):
+        return Quiz.objects.values_list('answer_key_version', flat=True).get(pk=quiz.pk)
+
+    def test_question_and_choice_changes_retire_the_key(self):
+        quiz = self.make_quiz(questions=1)
+        key = get_answer_key(quiz)
+        question = quiz.questions.get()
+
+        question.points = 3
+        question.save()
+        quiz.refresh_from_db()
+        self.assertNotEqual(quiz.answer_key_version, key.version)
+        self.assertEqual(get_answer_key(quiz).total_points, 3)
+
+        before = self.version(quiz)
+        Choice.objects.create(question=question, choice_text='extra', is_correct=True)
+        self.assertEqual(self.version(quiz), before + 1)
+        quiz.refresh_from_db()
+        self.assertEqual(len(get_answer_key(quiz).entries[question.id].correct_ids), 2)
+
+    def test_choice_with_cached_question_skips_the_lookup(self):
+        quiz = self.make_quiz(questions=1)
+        question = quiz.questions.get()
+        with CaptureQueriesContext(connection) as queries:
+            Choice.objects.create(question=question, choice_text='extra')
+        selects = [query for query in queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(selects, [])
+        self.assertEqual(len(_updates(queries, 'quizzes_quiz')), 1)
+
+    def test_deleting_a_question_retires_the_key_once(self):
+        quiz = self.make_quiz(questions=2, choices=4)
+        before = self.version(quiz)
+        with CaptureQueriesContext(connection) as queries:
+            quiz.questions.first().delete()
+        self.assertEqual(len(_updates(queries, 'quizzes_quiz')), 1)
+        self.assertEqual(self.version(quiz), before + 1)
+
+    def test_add_questions_view_retires_the_key_once(self):
+        quiz = self.make_quiz(questions=0)
+        self.client.force_login(self.author)
+        before = self.version(quiz)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('add_questions', args=[quiz.id]), {
+                'question_text': 'Capital?', 'question_type': 'mc', 'points': 1, 'answer_match': 'normalized',
+                'choices': ['Paris', 'Rome', 'Oslo', 'Bern'], 'correct_choice': 0,
+            })
+        self.assertEqual(len(_updates(queries, 'quizzes_quiz')), 1)
+        self.assertEqual(self.version(quiz), before + 1)
+        quiz.refresh_from_db()
+        entry = get_answer_key(quiz).entries[quiz.questions.get().id]
+        self.assertEqual((len(entry.choice_ids), len(entry.correct_ids)), (4, 1))
+
+
+@override_settings(QUIZ_GRADING_MODE='sync', ANSWER_STORAGE='rows')
+class SubmissionGradingTests(QuizTestCase):
+    def submit(self, quiz, username, data):
+        self.login(username)
+        return self.post(quiz, data)
+
+    def login(self, username):
+        self.user = self.make_user(username)
+        self.client.force_login(self.user)
+
+    def post(self, quiz, data):
+        self.client.post(reverse('take_quiz', args=[quiz.id]), data)
+        return sharding.for_quiz(QuizSubmission, quiz.id).get(user=self.user)
+
+    def test_each_question_type_is_scored(self):
+        quiz = self.make_quiz(questions=2)
+        mc, stray = quiz.questions.order_by('order')
+        mc.points = 2
+        mc.save()
+        tf = Question.objects.create(quiz=quiz, question_text='True?', question_type='tf', order=3)
+        Choice.objects.create(question=tf, choice_text='True', is_correct=True)
+        Choice.objects.create(question=tf, choice_text='False', is_correct=False)
+        sa = Question.objects.create(
+            quiz=quiz, question_text='Capital?', question_type='sa', accepted_answers=['Paris'], order=4,
+        )
+        quiz.refresh_from_db()
+        right = mc.choices.get(is_correct=True)
+
+        submission = self.submit(quiz, 'right', {
+            f'question_{mc.id}': right.id,
+            # A correct choice of another question earns nothing here
+            f'question_{stray.id}': right.id,
+            f'question_{tf.id}': 'True',
+            f'question_{sa.id}': ' paris! ',
+        })
+        self.assertEqual((submission.score, submission.total_points), (4, 5))
+        answers = {answer.question_id: answer for answer in submission.answers.all()}
+        self.assertEqual(set(answers), {mc.id, tf.id, sa.id})
+        self.assertEqual((answers[mc.id].selected_choice_id, answers[sa.id].text_answer), (right.id, ' paris! '))
+
+        submission = self.submit(quiz, 'wrong', {
+            f'question_{mc.id}': mc.choices.get(is_correct=False).id,
+            f'question_{tf.id}': 'False',
+            f'question_{sa.id}': 'Lyon',
+        })
+        self.assertEqual(submission.score, 0)
+        self.assertEqual(sorted(submission.answers.values_list('is_correct', flat=True)), [False] * 3)
+
+    def test_queries_do_not_grow_with_the_quiz(self):
+        small, large = self.make_quiz(questions=2), self.make_quiz(questions=50)
+        # Loads the achievement rules, which later submissions reuse
+        self.submit(self.make_quiz(), 'warm', {})
+        self.login('small')
+        data = self.answers(small, correct=1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('take_quiz', args=[small.id]), data)
+        self.login('large')
+        data = self.answers(large, correct=30)
+        with self.assertNumQueries(len(queries)):
+            self.client.post(reverse('take_quiz', args=[large.id]), data)
+        self.assertEqual(sharding.for_quiz(QuizSubmission, large.id).get(user=self.user).score, 30)
+
+    def test_totals_are_kept_in_the_same_transaction(self):
+        quiz, other = self.make_quiz(questions=2), self.make_quiz(questions=3)
+        user = self.make_user('taker')
+        self.client.force_login(user)
+        self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct=2))
+        self.client.post(reverse('take_quiz', args=[other.id]), self.answers(other, correct=1))
+        profile = UserProfile.objects.get(user=user)
+        self.assertEqual((profile.total_quizzes_taken, profile.total_score), (2, 3))
+
+        # A failure while recording the rollups leaves no submission behind
+        third = self.make_quiz()
+        with patch('quizzes.grading.distributions.record_score', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('take_quiz', args=[third.id]), self.answers(third, correct=2))
+        self.assertFalse(sharding.for_quiz(QuizSubmission, third.id).filter(quiz=third).exists())
+        profile.refresh_from_db()
+        self.assertEqual((profile.total_quizzes_taken, profile.total_score), (2, 3))
+
+
+@override_settings(QUIZ_GRADING_MODE='queued')
+class GradingQueueTests(QuizTestCase):
+    def submit(self, quiz, username, correct=1):
+        user = self.make_user(username)
+        self.client.force_login(user)
+        self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct))
+        return sharding.for_quiz(QuizSubmission, quiz.id).get(user=user)
+
+    def test_claims_are_exclusive_until_they_time_out(self):
+        quiz = self.make_quiz()
+        for number in range(3):
+            self.submit(quiz, f'taker{number}')
+
+        first = grading.claim_pending(2, 'a')
+        second = grading.claim_pending(2, 'b')
+        self.assertEqual((len(first), len(second)), (2, 1))
+        self.assertFalse({item.id for item in first} & {item.id for item in second})
+        self.assertEqual(grading.claim_pending(2, 'c'), [])
+
+        sharding.for_quiz(PendingGrade, quiz.id).filter(id=first[0].id).update(claimed_at=timezone.now() - timedelta(seconds=301))
+        again = grading.claim_pending(2, 'c', claim_timeout=300)
+        self.assertEqual([item.id for item in again], [first[0].id])
+        self.assertEqual(again[0].attempts, 2)
+
+    def test_released_claims_are_graded_on_retry(self):
+        quiz = self.make_quiz()
+        submission = self.submit(quiz, 'taker', correct=2)
+
+        pending = grading.claim_pending(10, 'a')
+        self.assertEqual(grading.release_pending(pending, RuntimeError('boom')), 0)
+        self.assertEqual(sharding.for_quiz(PendingGrade, quiz.id).get().last_error, 'boom')
+
+        graded = grading.grade_pending(grading.claim_pending(10, 'b'))
+        self.assertEqual([item.id for item in graded], [submission.id])
+        submission.refresh_from_db()
+        self.assertEqual((submission.status, submission.score), ('graded', 2))
+        self.assertFalse(sharding.for_quiz(PendingGrade, quiz.id).exists())
+
+    def test_submission_fails_after_the_last_attempt(self):
+        quiz = self.make_quiz()
+        submission = self.submit(quiz, 'taker')
+
+        for attempt in range(1, grading.MAX_GRADING_ATTEMPTS + 1):
+            failed = grading.release_pending(grading.claim_pending(10, 'a'), f'error {attempt}')
+            self.assertEqual(failed, int(attempt == grading.MAX_GRADING_ATTEMPTS))
+        self.assertEqual(grading.claim_pending(10, 'a'), [])
+        submission.refresh_from_db()
+        self.assertTrue(submission.is_failed)
+        self.assertEqual(sharding.for_quiz(PendingGrade, quiz.id).get().last_error, f'error {grading.MAX_GRADING_ATTEMPTS}')
+
+        response = self.client.get(reverse('submission_status', args=[submission.id]))
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertContains(self.client.get(reverse('quiz_results', args=[submission.id])), 'could not grade')
+
+        self.assertEqual(grading.retry_failed(), 1)
+        grading.grade_pending(grading.claim_pending(10, 'a'))
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, 'graded')
+
+    def test_abandoned_last_attempt_is_marked_failed(self):
+        quiz = self.make_quiz()
+        submission = self.submit(quiz, 'taker')
+        sharding.for_quiz(PendingGrade, quiz.id).update(
+            attempts=grading.MAX_GRADING_ATTEMPTS, claimed_at=timezone.now() - timedelta(seconds=301),
+        )
+        self.assertEqual(grading.fail_exhausted(claim_timeout=300), 1)
+        submission.refresh_from_db()
+        self.assertEqual(submission.status, 'failed')
+        self.assertEqual(grading.fail_exhausted(claim_timeout=300), 0)
+
+
+# Submissions are taken as answer rows and packed by the tests themselves
+@override_settings(ANSWER_STORAGE='rows')
+class PackedAnswerTests(QuizTestCase):
+    def answer_tuples(self, submission):
+        return sorted(
+            (answer.question_id, answer.selected_choice_id, answer.text_answer, answer.is_correct)
+            for answer in packed_answers.answers_for(submission)
+        )
+
+    def test_pack_and_unpack_round_trip(self):
+        quiz = self.make_quiz(questions=3, choices=3)
+        data = self.answers(quiz, correct=2)
+        question = Question.objects.create(
+            quiz=quiz, question_text='Say hi', question_type='sa', accepted_answers=['hi'], order=4,
+        )
+        data[f'question_{question.id}'] = ' Hi '
+        quiz.refresh_from_db()
+        user = self.make_user('taker')
+        self.client.force_login(user)
+        self.client.post(reverse('take_quiz', args=[quiz.id]), data)
+        submission = sharding.for_quiz(QuizSubmission, quiz.id).get(user=user)
+        rows = self.answer_tuples(submission)
+        self.assertEqual(len(rows), 4)
+
+        self.assertEqual(sum(count for _, count in packed_answers.convert()), 1)
+        submission.refresh_from_db()
+        self.assertIsNotNone(submission.packed_answers)
+        self.assertFalse(sharding.for_quiz(Answer, quiz.id).exists())
+        self.assertEqual(self.answer_tuples(submission), rows)
+
+        self.assertEqual(sum(count for _, count in packed_answers.convert(reverse=True)), 1)
+        submission.refresh_from_db()
+        self.assertIsNone(submission.packed_answers)
+        self.assertEqual(self.answer_tuples(submission), rows)
+
+    def test_choice_only_answers_leave_out_texts(self):
+        packed = packed_answers.pack([
+            {'question_id': 1, 'selected_choice_id': 5, 'is_correct': True},
+            {'question_id': 2, 'selected_choice_id': None, 'is_correct': False},
+        ])
+        self.assertEqual(packed, {'q': [1, 2], 'c': [5, None], 'ok': [1, 0]})
+        self.assertEqual(list(packed_answers.entries(packed)), [(1, 5, '', True), (2, None, '', False)])
+
+
+class RegradeTests(QuizTestCase):
+    def test_regrade_reads_in_keyset_chunks(self):
+        quiz = self.make_quiz(questions=2)
+        takers = []
+        for number in range(5):
+            user = self.make_user(f'taker{number}')
+            self.client.force_login(user)
+            self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct=number % 3))
+            takers.append(user)
+        # Mixed storage: the first two submissions keep their answers packed
+        packed_answers.pack_batch(sharding.shard_for_quiz(quiz.id), 2)
+
+        question = quiz.questions.order_by('order').last()
+        question.choices.update(is_correct=True)
+        answer_keys.invalidate_answer_key(quiz.id)
+        quiz.refresh_from_db()
+
+        progress = list(grading.regrade_quiz(quiz, chunk_size=2))
+        self.assertEqual([seen for seen, _ in progress], [2, 4, 5])
+        scores = dict(sharding.for_quiz(QuizSubmission, quiz.id).values_list('user_id', 'score'))
+        self.assertEqual(scores, {
+            user.id: min(number % 3, 1) + 1 for number, user in enumerate(takers)
+        })
+        self.assertEqual(
+            dict(UserProfile.objects.filter(user__in=takers).values_list('user_id', 'total_score')),
+            scores,
+        )
+        self.assertEqual(list(grading.regrade_quiz(quiz, chunk_size=2))[-1], (5, 0))
+
+
+class RankIndexTests(QuizTestCase):
+    def rank_profiles(self, scores):
+        for number, score in enumerate(scores):
+            user = self.make_user(f'ranked{number}')
+            UserProfile.objects.create(user=user, total_score=score, total_quizzes_taken=1)
+        # A profile without quizzes is never ranked
+        UserProfile.objects.create(user=self.make_user('idle'), total_score=500)
+        ranking.rebuild()
+
+    @override_settings(RANK_INDEX_SIZE=1024)
+    def test_ranks_match_a_sorted_list(self):
+        scores = [random.Random(number).randrange(0, 300) for number in range(60)] + [0, 299, 299]
+        self.rank_profiles(scores)
+        ordered = sorted(scores, reverse=True)
+
+        for score in set(scores) | {1, 150, 400}:
+            self.assertEqual(ranking.rank_for_score(score), sum(other > score for other in scores) + 1)
+        for rank in range(1, len(ordered) + 1):
+            self.assertEqual(ranking.score_at_rank(rank), ordered[rank - 1])
+        self.assertIsNone(ranking.score_at_rank(len(ordered) + 1))
+        # 11 steps of descent, five per query
+        with self.assertNumQueries(3):
+            ranking.score_at_rank(1)
+
+        profiles = ranking.profiles_ranked(10, 20)
+        self.assertEqual([profile.total_score for profile in profiles], ordered[9:20])
+        for profile in profiles:
+            self.assertEqual(profile.rank, ordered.index(profile.total_score) + 1)
+
+    @override_settings(RANK_INDEX_SIZE=64)
+    def test_moves_keep_the_tree_consistent(self):
+        self.rank_profiles([5, 10, 10, 80])
+        ranking.apply_moves([(10, 70), (None, 3), (5, None)])
+        UserProfile.objects.filter(user__username='ranked1').update(total_score=70)
+        UserProfile.objects.filter(user__username='ranked0').update(total_quizzes_taken=0)
+        UserProfile.objects.create(user=self.make_user('new'), total_score=3, total_quizzes_taken=1)
+        self.assertEqual(ranking.check(), [])
+        # Scores past the top of the index share its first position
+        self.assertEqual([ranking.score_at_rank(rank) for rank in range(1, 5)], [63, 63, 10, 3])
+
+
+class WindowLeaderboardTests(QuizTestCase):
+    def test_windows_only_count_their_days(self):
+        today = timezone.localdate()
+        buckets = []
+        for number in range(6):
+            user = self.make_user(f'player{number}')
+            UserProfile.objects.create(user=user, is_admin=number == 0)
+            for back in (0, 3, 8, 20, 40):
+                if (number + back) % 3:
+                    buckets.append(DailyScoreBucket(
+                        user=user, day=today - timedelta(days=back),
+                        quizzes_taken=1 + back % 2, total_score=number * 3 + back,
+                    ))
+        DailyScoreBucket.objects.bulk_create(buckets)
+
+        for window in ('week', 'month'):
+            start = leaderboards.window_start(window)
+            totals = {}
+            for bucket in buckets:
+                if bucket.day >= start:
+                    score, quizzes = totals.get(bucket.user_id, (0, 0))
+                    totals[bucket.user_id] = (score + bucket.total_score, quizzes + bucket.quizzes_taken)
+            expected = sorted(totals, key=lambda user_id: (
+                -totals[user_id][0] / totals[user_id][1], -totals[user_id][0], user_id,
+            ))
+            entries = leaderboards.top_users(window, limit=4)
+            self.assertEqual([entry.user_id for entry in entries], expected[:4])
+            for entry in entries:
+                self.assertEqual((entry.total_score, entry.total_quizzes_taken), totals[entry.user_id])
+                self.assertEqual(entry.is_admin, entry.username == 'player0')
+
+
+class ScoreDistributionTests(QuizTestCase):
+    def test_percentiles_match_the_submissions(self):
+        quiz = self.make_quiz(questions=4)
+        scores = [0, 1, 1, 2, 3, 3, 3, 4]
+        for number, correct in enumerate(scores):
+            self.client.force_login(self.make_user(f'taker{number}'))
+            self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct))
+
+        counts = distributions.score_counts(quiz.id)
+        self.assertEqual(counts, [(0, 1), (1, 2), (2, 1), (3, 3), (4, 1)])
+        for score in range(-1, 6):
+            below = sum(other < score for other in scores)
+            self.assertEqual(distributions.percentile(quiz.id, score), round(below * 100 / len(scores), 1))
+
+        stats = distributions.summary(counts, total_points=4)
+        # 60% of 4 points needs 3 correct answers
+        self.assertEqual(stats, {'count': 8, 'average': 2.12, 'min': 0, 'max': 4, 'pass_rate': 50.0})
+        self.assertEqual(distributions.quiz_totals([quiz.id]), {quiz.id: (8, sum(scores))})
+
+        live = counts
+        distributions.rebuild(quiz.id)
+        self.assertEqual(distributions.score_counts(quiz.id), live)
+        self.assertEqual(distributions.percentile(self.make_quiz().id, 1), 0)
+
+
+class AchievementTests(QuizTestCase):
+    def take(self, user, quiz, correct):
+        self.client.force_login(user)
+        self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct))
+
+    def earned(self, user=None):
+        rows = UserAchievement.objects.all() if user is None else UserAchievement.objects.filter(user=user)
+        return set(rows.values_list('user__username', 'achievement__name'))
+
+    def test_rules_award_once(self):
+        user = self.make_user('taker')
+        self.take(user, self.make_quiz(), correct=2)
+        self.assertEqual(self.earned(user), {('taker', 'First Steps'), ('taker', 'Perfect Score')})
+        # Both land in one digest row
+        notification = Notification.objects.get(user=user, type='achievement')
+        self.assertEqual((notification.title, notification.count), ('2 achievements unlocked', 2))
+
+        self.take(user, self.make_quiz(), correct=2)
+        self.assertEqual(len(self.earned(user)), 2)
+        self.assertEqual(Notification.objects.get(user=user, type='achievement').count, 2)
+        self.assertEqual(achievements.award(user.id, {'quiz_count': 2, 'high_score': 100.0}), [])
+
+    def test_backfill_awards_what_submissions_did(self):
+        quizzes = [self.make_quiz(questions=1) for _ in range(10)]
+        veteran, perfect, streaker = (self.make_user(name) for name in ('veteran', 'perfect', 'streaker'))
+        for quiz in quizzes:
+            self.take(veteran, quiz, correct=0)
+        self.take(perfect, quizzes[0], correct=1)
+        StudyStreak.objects.create(
+            user=streaker, current_streak=6, longest_streak=6, last_activity=timezone.localdate() - timedelta(days=1),
+        )
+        self.take(streaker, quizzes[0], correct=0)
+        live = self.earned()
+        self.assertIn(('veteran', 'Quiz Master'), live)
+        self.assertIn(('streaker', 'On a Roll'), live)
+
+        UserAchievement.objects.all().delete()
+        output = io.StringIO()
+        call_command('backfill_achievements', batch_size=2, stdout=output)
+        self.assertIn('Batch 2:', output.getvalue())
+        self.assertEqual(self.earned(), live)
+        self.assertEqual(sum(achievements.backfill(batch_size=2)), 0)
+
+
+class MonthlyActivityTests(QuizTestCase):
+    def test_months_split_at_midnight_and_rebuild_matches(self):
+        user = self.make_user('taker')
+        self.client.force_login(user)
+        quizzes = [self.make_quiz(questions=2) for _ in range(4)]
+        for number, quiz in enumerate(quizzes):
+            self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct=number % 3))
+        self.assertEqual(MonthlyActivity.objects.get(user=user).quizzes_taken, 4)
+
+        this_month = activity.month_start(timezone.localdate())
+        start = timezone.make_aware(datetime.combine(this_month, time.min))
+        moved = [
+            start,
+            start - timedelta(microseconds=1),
+            start - timedelta(days=80),
+            start - timedelta(days=380),
+        ]
+        # Recorded again as if each had been submitted then
+        MonthlyActivity.objects.all().delete()
+        for quiz, submitted_at in zip(quizzes, moved):
+            submissions = sharding.for_quiz(QuizSubmission, quiz.id).filter(quiz=quiz, user=user)
+            submissions.update(submitted_at=submitted_at)
+            activity.record_activity(submissions.get())
+
+        months = activity.last_months()
+        self.assertEqual((len(months), months[-1]), (12, this_month))
+        expected = [0] * 12
+        for submitted_at in moved[:3]:
+            expected[months.index(activity.month_start(timezone.localdate(submitted_at)))] += 1
+        self.assertEqual(expected[-2:], [1, 1])
+        self.assertEqual(self.client.get(reverse('api_user_stats')).json()['monthly_quizzes'], expected)
+
+        incremental = set(MonthlyActivity.objects.values_list('user_id', 'month', 'quizzes_taken', 'total_score'))
+        self.assertEqual(len(incremental), 4)
+        call_command('rebuild_monthly_activity', clear=True, stdout=io.StringIO())
+        self.assertEqual(
+            set(MonthlyActivity.objects.values_list('user_id', 'month', 'quizzes_taken', 'total_score')),
+            incremental,
+        )
+
+
+class SubjectTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        self.math = Subject.objects.create(name='Math', slug='math')
+        self.art = Subject.objects.create(name='Art', slug='art')
+
+    def rows(self):
+        return set(SubjectPerformance.objects.values_list(
+            'user_id', 'subject_id', 'attempts', 'score_sum', 'points_sum',
+        ))
+
+    def rebuilt(self):
+        live = self.rows()
+        call_command('rebuild_subject_performance', stdout=io.StringIO())
+        return live, self.rows()
+
+    def test_quiz_list_filters_by_subject(self):
+        algebra = self.make_quiz(title='Algebra')
+        for quiz, subject in ((algebra, self.math), (self.make_quiz(title='Painting'), self.art)):
+            quiz.subject = subject
+            quiz.save()
+        self.make_quiz(title='Loose')
+        self.client.force_login(self.make_user('student'))
+        response = self.client.get(reverse('quiz_list'), {'subject': 'math'})
+        self.assertEqual([quiz.title for quiz in response.context['quizzes']], ['Algebra'])
+        self.assertEqual(response.context['current_subject'], self.math)
+        self.assertEqual(len(self.client.get(reverse('quiz_list')).context['quizzes']), 3)
+        self.assertEqual(self.client.get(reverse('quiz_list'), {'subject': 'nope'}).status_code, 404)
+
+    def test_totals_follow_the_quiz_subject(self):
+        quizzes = [self.make_quiz(questions=2) for _ in range(3)]
+        for quiz, subject in zip(quizzes, (self.math, self.math, None)):
+            quiz.subject = subject
+            quiz.save()
+        takers = [self.make_user(f'taker{number}') for number in range(2)]
+        for number, user in enumerate(takers):
+            self.client.force_login(user)
+            for quiz in quizzes[:2 + number]:
+                self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct=number + 1))
+
+        rows = subjects.performance_for(takers[1])
+        self.assertEqual([(row.subject, row.attempts, row.score_sum, row.points_sum) for row in rows], [
+            (self.math, 2, 4, 4),
+        ])
+        live, rebuilt = self.rebuilt()
+        self.assertEqual(live, rebuilt)
+
+        # Moving a quiz between subjects, into one and out of one
+        quizzes[1].subject = self.art
+        quizzes[1].save()
+        quizzes[2].subject = self.art
+        quizzes[2].save(update_fields=['subject'])
+        quizzes[0].subject = None
+        quizzes[0].save()
+        self.assertEqual(
+            [(row.subject, row.attempts) for row in subjects.performance_for(takers[1])], [(self.art, 2)],
+        )
+        live, rebuilt = self.rebuilt()
+        self.assertEqual(live, rebuilt)
+        self.assertFalse(SubjectPerformance.objects.filter(subject=self.math).exists())
+
+
+class NotificationStreamTests(QuizTestCase):
+    @override_settings(NOTIFICATION_HEARTBEAT=0.01)
+    async def test_heartbeat_picks_up_changes_from_other_workers(self):
+        user = await sync_to_async(self.make_user)('reader')
+        stream = notifications.event_stream(user.id)
+        self.assertTrue((await anext(stream)).startswith('retry:'))
+        self.assertIn('event: ready', await anext(stream))
+        self.assertEqual(await anext(stream), ': keepalive\n\n')
+
+        # Written without publishing, as a change made by another worker looks here
+        await Notification.objects.acreate(user=user, type='system', title='Hi', message='Hello')
+        self.assertIn('"event": "changed"', await anext(stream))
+        self.assertEqual(await anext(stream), ': keepalive\n\n')
+
+        await sync_to_async(notifications.publish)(user.id, {'event': 'created'})
+        self.assertIn('"event": "created"', await anext(stream))
+        await stream.aclose()
+        self.assertEqual(notifications.connection_count(), 0)
+
+
+class NotificationETagTests(QuizTestCase):
+    def poll(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(reverse('get_notifications'), **headers)
+
+    def test_etag_follows_the_unread_rows(self):
+        user = self.make_user('reader')
+        self.client.force_login(user)
+        first = self.poll()
+        self.assertEqual(first.json()['unread_count'], 0)
+        self.assertEqual(self.poll(first['ETag']).status_code, 304)
+
+        # Rows written by another process, with no cache or event involved
+        notification = Notification.objects.create(user=user, type='system', title='A', message='a')
+        second = self.poll(first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['unread_count'], 1)
+        self.assertEqual(self.poll(second['ETag']).status_code, 304)
+
+        Notification.objects.filter(id=notification.id).update(created_at=timezone.now() + timedelta(seconds=1))
+        third = self.poll(second['ETag'])
+        self.assertEqual(third.status_code, 200)
+
+        self.client.post(reverse('mark_notification_read', args=[notification.id]))
+        fourth = self.poll(third['ETag'])
+        self.assertEqual((fourth.status_code, fourth.json()['unread_count']), (200, 0))
+
+
+class BroadcastTests(QuizTestCase):
+    def test_cursor_resumes_without_double_delivery(self):
+        users = [self.make_user(f'user{number}') for number in range(7)]
+        User.objects.filter(id=users[3].id).update(is_active=False)
+        quiz = self.make_quiz()
+        broadcast = broadcasts.announce_quiz(quiz)
+
+        first = NotificationBroadcast.objects.get(id=broadcast.id)
+        stale = NotificationBroadcast.objects.get(id=broadcast.id)
+        self.assertEqual(broadcasts.deliver_batch(first, size=3), 3)
+        # A second worker holding the old cursor loses the compare-and-set
+        with self.assertRaises(broadcasts.CursorMoved):
+            broadcasts.deliver_batch(stale, size=3)
+        self.assertEqual(Notification.objects.count(), 3)
+
+        # A worker that died after its batch is resumed from the stored cursor
+        progress = [item.sent_count for item in broadcasts.process(stale, size=2)]
+        self.assertEqual(progress, [5, 6])
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.sent_count), ('done', 6))
+
+        recipients = list(Notification.objects.order_by('user_id').values_list('user_id', flat=True))
+        self.assertEqual(recipients, [user.id for user in users if user != users[3]])
+        self.assertEqual(list(broadcasts.pending()), [])
+
+    def test_quiz_is_announced_once_it_has_questions(self):
+        self.client.force_login(self.author)
+        self.client.post(reverse('create_quiz'), {
+            'title': 'Fresh', 'description': 'New', 'time_limit': 10, 'max_attempts': 1,
+        })
+        quiz = Quiz.objects.get(title='Fresh')
+        self.assertFalse(NotificationBroadcast.objects.exists())
+
+        question = {
+            'question_text': 'Capital?', 'question_type': 'mc', 'points': 1, 'answer_match': 'normalized',
+            'choices': ['Paris', 'Rome'], 'correct_choice': 0,
+        }
+        for _ in range(2):
+            self.client.post(reverse('add_questions', args=[quiz.id]), question)
+        self.assertEqual(quiz.questions.count(), 2)
+        broadcast = NotificationBroadcast.objects.get()
+        self.assertEqual((broadcast.quiz, broadcast.exclude_user), (quiz, self.author))
+        self.assertIsNone(broadcasts.announce_quiz(quiz))
+
+    def test_deleting_the_quiz_cancels_its_announcement(self):
+        for number in range(4):
+            self.make_user(f'user{number}')
+        quiz, other = self.make_quiz(), self.make_quiz(title='Other')
+        broadcast = broadcasts.announce_quiz(quiz)
+        self.assertEqual(broadcasts.deliver_batch(broadcast, size=2), 2)
+
+        # Deleted while a worker is between batches
+        Quiz.objects.filter(pk=quiz.pk).update(deleted_at=timezone.now())
+        self.assertEqual(list(broadcasts.process(broadcast, size=2)), [])
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.sent_count), ('cancelled', 2))
+        self.assertEqual(Notification.objects.count(), 2)
+
+        pending = broadcasts.announce_quiz(other)
+        self.client.force_login(self.author)
+        self.client.post(reverse('delete_quiz', args=[other.id]))
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'cancelled')
+        self.assertEqual(list(broadcasts.pending()), [])
+
+
+class NotificationDigestTests(QuizTestCase):
+    def test_digest_row_counts_and_keeps_every_message(self):
+        user = self.make_user('reader')
+        for number in range(3):
+            create_notification(user, 'system', f'Update {number}', f'News {number}')
+
+        row = Notification.objects.get(user=user)
+        self.assertEqual((row.type, row.title, row.count), ('system', '3 updates', 3))
+        self.assertEqual(row.message.splitlines(), ['News 0', 'News 1', 'News 2'])
+
+    def test_achievements_fold_and_other_types_stay_apart(self):
+        user = self.make_user('reader')
+        for name in ('First', 'Second'):
+            create_notification(user, 'achievement', f'Achievement Unlocked: {name}', f'{name} badge')
+        with override_settings(NOTIFICATION_DIGEST_TYPES=['achievement']):
+            for number in range(2):
+                create_notification(user, 'system', f'Update {number}', 'News')
+
+        rows = list(Notification.objects.filter(user=user).order_by('id').values_list('type', 'title', 'message', 'count'))
+        self.assertEqual(rows, [
+            ('achievement', '2 achievements unlocked', 'First badge\nSecond badge', 2),
+            ('system', 'Update 0', 'News', 1),
+            ('system', 'Update 1', 'News', 1),
+        ])
+
+    def test_broadcasts_fold_into_unread_rows(self):
+        reader, other = self.make_user('reader'), self.make_user('other')
+        create_notification(reader, 'new_quiz', 'New Quiz Available', 'First is ready.')
+        Notification.objects.create(user=other, type='new_quiz', title='Old', message='Seen', read=True)
+        for title in ('Second', 'Third'):
+            quiz = self.make_quiz(title=title)
+            list(broadcasts.process(broadcasts.announce_quiz(quiz)))
+
+        row = Notification.objects.get(user=reader)
+        self.assertEqual((row.title, row.count), ('3 new quizzes', 3))
+        self.assertEqual(row.message.splitlines(), [
+            'First is ready.', '"Second" is ready to take.', '"Third" is ready to take.',
+        ])
+        # A read notification is left alone
+        unread = Notification.objects.filter(user=other, read=False).get()
+        self.assertEqual((unread.title, unread.count), ('2 new quizzes', 2))
+        self.assertFalse(Notification.objects.filter(user=self.author).exists())
+
+    def test_archived_rows_keep_their_count(self):
+        user = self.make_user('reader')
+        for _ in range(2):
+            create_notification(user, 'system', 'Update', 'News')
+        Notification.objects.update(read=True, created_at=timezone.now() - timedelta(days=100))
+
+        self.assertEqual(retention.prune_batch(days=90, batch_size=10, archive=True), 1)
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(ArchivedNotification.objects.get().count, 2)
+
+
+class QueryPlanTests(QuizTestCase):
+    def test_index_walks_count_as_scans(self):
+        self.assertEqual(query_plans.full_scans('SELECT id FROM auth_user ORDER BY username'), ['auth_user'])
+        self.assertEqual(query_plans.full_scans("SELECT id FROM auth_user WHERE username = 'x'"), [])
+        # Subquery aliases are traced back to their table
+        sql = 'SELECT COUNT(*) FROM (SELECT DISTINCT U0."user_id" FROM "quizzes_quizsubmission" U0) subquery'
+        self.assertEqual(query_plans.full_scans(sql), ['quizzes_quizsubmission'])
+        # So is an IN (subquery) that reads a whole index
+        sql = 'SELECT id FROM auth_user WHERE id IN (SELECT U0."user_id" FROM "quizzes_userprofile" U0)'
+        self.assertEqual(query_plans.full_scans(sql), ['quizzes_userprofile'])
+
+    def test_hot_views_only_search(self):
+        call_command('check_query_plans', stdout=io.StringIO())
+
+    def test_creator_search_matches_anywhere_in_the_username(self):
+        for username, is_admin in (('Alice', True), ('alfred', True), ('malice', True), ('lichen', False)):
+            UserProfile.objects.create(user=self.make_user(username), is_admin=is_admin)
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('search_creators'), {'q': 'LIC'})
+        self.assertEqual(response.json()['creators'], [{'username': 'Alice'}, {'username': 'malice'}])
+
+    def test_dashboard_rank_comes_from_the_rank_index(self):
+        quiz = self.make_quiz(questions=2)
+        takers = {}
+        for username, correct in (('low', 0), ('high', 2), ('mid', 1)):
+            takers[username] = self.make_user(username)
+            self.client.force_login(takers[username])
+            self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct))
+        for username, rank in (('high', 1), ('mid', 2), ('low', 3)):
+            self.client.force_login(takers[username])
+            self.assertEqual(self.client.get(reverse('dashboard')).context['user_rank'], rank)
+
+
+class ReplicaRoutingTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        if not routers.replica_configured():
+            # Stand the default connection in for a replica
+            connections[routers.REPLICA] = connections['default']
+            self.addCleanup(connections.__delitem__, routers.REPLICA)
+            patcher = patch('quizzes.routers.replica_configured', return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client.force_login(self.make_user('reader'))
+
+    def routed_reads(self, url):
+        """Aliases the replica router picked for the reads of one GET"""
+        picked = []
+        route = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            picked.append(route(router, model, **hints))
+            return picked[-1]
+        with patch.object(ReplicaRouter, 'db_for_read', record):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return set(picked)
+
+    def test_read_only_views_read_from_the_replica(self):
+        # Session and user lookups happen before the view and stay on the primary
+        self.assertIn(routers.REPLICA, self.routed_reads(reverse('rankings')))
+
+    def test_reads_after_a_write_in_the_request_stay_on_the_primary(self):
+        def request():
+            router = ReplicaRouter()
+            with routers.replica_reads():
+                before = router.db_for_read(Quiz)
+                routers.stick_to_primary(self.client)
+                return before, router.db_for_read(Quiz), router.db_for_write(Quiz)
+        # A context of its own, as each request has, so the pin ends with it
+        self.assertEqual(contextvars.copy_context().run(request), (routers.REPLICA, 'default', 'default'))
+        self.assertEqual(ReplicaRouter().db_for_read(Quiz), 'default')
+
+    def test_sticky_cookie_keeps_the_next_requests_on_the_primary(self):
+        quiz = self.make_quiz()
+        response = self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, 1))
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.routed_reads(reverse('rankings')), {'default'})
+
+        self.client.cookies[STICKY_COOKIE] = str(timezone.now().timestamp() - 1)
+        self.assertIn(routers.REPLICA, self.routed_reads(reverse('rankings')))
+
+
+class ShardRoutingTests(QuizTestCase):
+    @override_settings(QUIZ_SUBMISSION_SHARDS=3)
+    def test_rows_follow_their_quiz(self):
+        router = ShardRouter()
+        for quiz_id in range(1, 20):
+            alias = f'shard_{zlib.crc32(str(quiz_id).encode()) % 3}'
+            self.assertEqual(sharding.shard_for_quiz(quiz_id), alias)
+            submission = QuizSubmission(quiz_id=quiz_id)
+            self.assertEqual(router.db_for_write(QuizSubmission, instance=submission), alias)
+            # An unsaved answer follows its submission, not a quiz of its own
+            answer = Answer(submission=submission)
+            self.assertEqual(router.db_for_write(Answer, instance=answer), alias)
+        self.assertIsNone(router.db_for_write(UserProfile, instance=UserProfile()))
+        self.assertFalse(router.allow_migrate('shard_0', 'quizzes', model_name='quiz'))
+        self.assertTrue(router.allow_migrate('shard_0', 'quizzes', model_name='answer'))
+
+
+@skipUnless(sharding.shard_count() >= 2, 'run with QUIZ_SUBMISSION_SHARDS=2 or more')
+class ShardMoveTests(QuizTestCase):
+    def test_move_quiz_carries_answers_and_queue_rows(self):
+        quiz = self.make_quiz(questions=2)
+        user = self.make_user('taker')
+        self.client.force_login(user)
+        self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, 1))
+        with override_settings(QUIZ_GRADING_MODE='queued'):
+            self.client.force_login(self.make_user('queued'))
+            self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, 2))
+
+        source = sharding.shard_for_quiz(quiz.id)
+        target = next(alias for alias in sharding.shard_aliases() if alias != source)
+        submission = sharding.find_submission(user=user, quiz=quiz)
+        self.assertEqual(submission._state.db, source)
+
+        self.assertEqual(sum(sharding.move_quiz(quiz.id, source, target, batch_size=1)), 2)
+        self.assertFalse(QuizSubmission.objects.using(source).exists())
+        self.assertEqual(QuizSubmission.objects.using(target).count(), 2)
+        self.assertEqual(Answer.objects.using(target).filter(submission_id=submission.id).count(), 2)
+        self.assertEqual(PendingGrade.objects.using(target).count(), 1)
+        self.assertEqual(sharding.misplaced_quizzes(target), {quiz.id: source})
+
+
+# The test counts the answer rows purged, which the packed layout does not write
+@override_settings(ANSWER_STORAGE='rows')
+class PurgeTests(QuizTestCase):
+    def take(self, quiz, username, correct=1):
+        self.client.force_login(self.make_user(username))
+        self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct))
+
+    def test_deleted_quiz_is_hidden_then_purged_leaves_first(self):
+        quiz = self.make_quiz(questions=2, choices=3)
+        kept = self.make_quiz(title='Kept')
+        for number in range(3):
+            self.take(quiz, f'taker{number}', correct=number)
+        self.take(kept, 'other')
+        with override_settings(QUIZ_GRADING_MODE='queued'):
+            self.take(quiz, 'queued')
+        QuizFeedback.objects.create(quiz=quiz, user=self.author, rating=4)
+        broadcast = NotificationBroadcast.objects.create(type='new_quiz', title='New', message='', quiz=quiz)
+
+        self.client.force_login(self.author)
+        self.client.post(reverse('delete_quiz', args=[quiz.id]))
+        quiz.refresh_from_db()
+        self.assertIsNotNone(quiz.deleted_at)
+        self.assertEqual(self.client.get(reverse('take_quiz', args=[quiz.id])).status_code, 404)
+        self.assertEqual(list(purge.pending()), [quiz])
+
+        batches = list(purge.purge_quiz(quiz, batch_size=2))
+        self.assertTrue(all(rows <= 2 for _, rows in batches))
+        labels = [label for number, (label, _) in enumerate(batches) if not number or batches[number - 1][0] != label]
+        self.assertEqual(labels, [
+            'answers', 'queued grades', 'submissions', 'score buckets', 'feedback', 'choices', 'questions', 'quiz',
+        ])
+        counts = {}
+        for label, rows in batches:
+            counts[label] = counts.get(label, 0) + rows
+        self.assertEqual((counts['answers'], counts['submissions'], counts['choices']), (6, 4, 6))
+
+        self.assertFalse(Quiz.objects.filter(pk=quiz.pk).exists())
+        self.assertFalse(sharding.for_quiz(QuizSubmission, quiz.id).filter(quiz=quiz).exists())
+        broadcast.refresh_from_db()
+        self.assertIsNone(broadcast.quiz_id)
+        self.assertEqual(sharding.for_quiz(QuizSubmission, kept.id).filter(quiz=kept).count(), 1)
+        self.assertEqual(Choice.objects.filter(question__quiz=kept).count(), 4)
+        for alias in sharding.shard_aliases():
+            connections[alias].check_constraints()
+
+        output = io.StringIO()
+        call_command('purge_deleted_quizzes', pause=0, stdout=output)
+        self.assertIn('Purged 0 quizzes', output.getvalue())
+
+
+class ArchiveTests(QuizTestCase):
+    def answer_tuples(self, submission):
+        return sorted(
+            (answer.question_id, answer.selected_choice_id, answer.is_correct)
+            for answer in packed_answers.answers_for(submission)
+        )
+
+    def test_archived_submissions_round_trip(self):
+        quiz = self.make_quiz(questions=3)
+        takers = []
+        for number in range(3):
+            takers.append(self.make_user(f'taker{number}'))
+            self.client.force_login(takers[-1])
+            self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct=number + 1))
+        submissions = list(sharding.for_quiz(QuizSubmission, quiz.id).filter(quiz=quiz).order_by('id'))
+        old = timezone.now().replace(month=6, day=1)
+        for years, submission in zip((2, 3, 0), submissions):
+            submission.submitted_at = old.replace(year=old.year - years)
+            submission.save(update_fields=['submitted_at'])
+        before = {submission.id: self.answer_tuples(submission) for submission in submissions}
+        # One submission already keeps its answers packed
+        packed_answers.pack_batch(sharding.shard_for_quiz(quiz.id), 1)
+        totals = dict(UserProfile.objects.values_list('user_id', 'total_score'))
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(SUBMISSION_ARCHIVE_DIR=directory):
+            self.assertEqual(sum(count for _, count, _ in archive.archive(days=365, batch_size=1)), 2)
+            self.assertEqual(
+                [(year, count) for year, count, _ in archive.year_stats()],
+                [(old.year - 3, 1), (old.year - 2, 1)],
+            )
+            live = sharding.for_quiz(QuizSubmission, quiz.id).filter(quiz=quiz)
+            self.assertEqual(list(live.values_list('id', flat=True)), [submissions[2].id])
+
+            for taker, submission in zip(takers, submissions):
+                found = archive.find_submission(id=submission.id, user=taker)
+                self.assertEqual((found.score, found.submitted_at), (submission.score, submission.submitted_at))
+                self.assertEqual(self.answer_tuples(found), before[submission.id])
+                self.assertTrue(archive.has_taken(quiz, taker))
+
+            self.client.force_login(takers[0])
+            response = self.client.get(reverse('quiz_results', args=[submissions[0].id]))
+            self.assertEqual(response.context['submission'].score, submissions[0].score)
+            self.assertRedirects(self.client.get(reverse('take_quiz', args=[quiz.id])), reverse('dashboard'))
+            # A second run finds nothing left to move and the rollups never changed
+            self.assertEqual(list(archive.archive(days=365)), [])
+            self.assertEqual(dict(UserProfile.objects.values_list('user_id', 'total_score')), totals)
+
+
+class ResultsPaginationTests(QuizTestCase):
+    def page(self, quiz, **cursor):
+        context = self.client.get(reverse('admin_quiz_results', args=[quiz.id]), cursor).context
+        return [submission.id for submission in context['submissions']], context
+
+    def test_cursors_walk_ties_in_both_directions(self):
+        quiz = self.make_quiz(questions=2)
+        for number, correct in enumerate([1, 2, 1, 0, 1, 2, 1, 0]):
+            self.client.force_login(self.make_user(f'taker{number}'))
+            self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, correct))
+        ranked = list(
+            sharding.for_quiz(QuizSubmission, quiz.id).filter(quiz=quiz).order_by('-score', 'id')
+            .values_list('id', flat=True)
+        )
+        self.client.force_login(self.author)
+
+        with patch('quizzes.views.RESULTS_PAGE_SIZE', 3):
+            pages = []
+            ids, context = self.page(quiz)
+            self.assertIsNone(context['previous_cursor'])
+            while True:
+                pages.append(ids)
+                if context['next_cursor'] is None:
+                    break
+                ids, context = self.page(quiz, after=context['next_cursor'])
+            self.assertEqual(pages, [ranked[0:3], ranked[3:6], ranked[6:8]])
+
+            backwards = [pages[-1]]
+            while context['previous_cursor'] is not None:
+                ids, context = self.page(quiz, before=context['previous_cursor'])
+                backwards.append(ids)
+            self.assertEqual(backwards, pages[::-1])
+            self.assertIsNotNone(context['next_cursor'])
+
+            # A malformed cursor falls back to the first page
+            self.assertEqual(self.page(quiz, after='x.y')[0], ranked[0:3])
+
+    def test_stats_say_how_many_archived_submissions_they_include(self):
+        quiz = self.make_quiz(questions=2)
+        for number in range(3):
+            self.client.force_login(self.make_user(f'taker{number}'))
+            self.client.post(reverse('take_quiz', args=[quiz.id]), self.answers(quiz, number))
+        live = sharding.for_quiz(QuizSubmission, quiz.id).filter(quiz=quiz)
+        live.filter(score__lt=2).update(submitted_at=timezone.now() - timedelta(days=800))
+        self.client.force_login(self.author)
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(SUBMISSION_ARCHIVE_DIR=directory):
+            list(archive.archive(days=365))
+            response = self.client.get(reverse('admin_quiz_results', args=[quiz.id]))
+        self.assertEqual(
+            (response.context['stats']['count'], len(response.context['submissions']), response.context['archived_count']),
+            (3, 1, 2),
+        )
+        self.assertContains(response, 'include 2 archived submissions, which are not listed below')
+
+
+class ExportTests(QuizTestCase):
+    def setUp(self):
+        super().setUp()
+        self.quiz = self.make_quiz(questions=1)
+        choices = self.answers(self.quiz, correct=1)
+        self.question = Question.objects.create(
+            quiz=self.quiz, question_text='-1 or +1?', question_type='sa', accepted_answers=['+1'], order=2,
+        )
+        self.quiz.refresh_from_db()
+        for username, text in (('=cmd', '+1'), ('plain', '@SUM(A1)')):
+            self.client.force_login(self.make_user(username))
+            data = {**choices, f'question_{self.question.id}': text}
+            self.client.post(reverse('take_quiz', args=[self.quiz.id]), data)
+        self.client.force_login(self.author)
+        self.url = reverse('export_quiz_results', args=[self.quiz.id])
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_escapes_cells_a_spreadsheet_would_run(self):
+        rows = list(csv.DictReader(io.StringIO(self.export())))
+        self.assertEqual([(row['username'], row['score']) for row in rows], [("'=cmd", '2'), ('plain', '1')])
+
+        rows = list(csv.DictReader(io.StringIO(self.export(answers='1'))))
+        texts = [(row['username'], row['question'], row['text_answer']) for row in rows if row['text_answer']]
+        self.assertEqual(texts, [("'=cmd", "'-1 or +1?", "'+1"), ('plain', "'-1 or +1?", "'@SUM(A1)")])
+        self.assertEqual(len(rows), 4)
+
+    def test_ndjson_keeps_values(self):
+        rows = [json.loads(line) for line in self.export(format='ndjson', answers='1').splitlines()]
+        self.assertEqual(
+            [row['text_answer'] for row in rows if row['question_id'] == self.question.id], ['+1', '@SUM(A1)'],
+        )
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 400)
+
+    async def test_asgi_response_streams_the_same_body(self):
+        expected = await sync_to_async(self.export)(answers='1')
+        await self.async_client.aforce_login(self.author)
+        response = await self.async_client.get(self.url, {'answers': '1'})
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(body, expected)
+
+
+class QuestionBankTests(QuizTestCase):
+    BANK = [
+        {'question': 'Capital of France?', 'choices': ['Paris', 'Rome', 'Oslo'], 'correct': 0, 'points': 2},
+        {'question': 'The earth is flat.', 'type': 'tf', 'correct': False},
+        {'question': '2 + 2?', 'type': 'sa', 'accepted_answers': ['4', ' four '], 'answer_match': 'exact'},
+        {'question': 'Primes?', 'choices': ['2', '4', '5'], 'correct': [0, 2]},
+    ]
+
+    def imported(self, quiz):
+        return [
+            (question.order, question.question_text, question.question_type, question.points,
+             question.accepted_answers, [(choice.choice_text, choice.is_correct) for choice in question.choices.all()])
+            for question in quiz.questions.order_by('order').prefetch_related('choices')[2:]
+        ]
+
+    def test_json_array_and_lines_match_at_any_read_size(self):
+        expected = None
+        for text in (json.dumps(self.BANK, indent=2), '\n'.join(json.dumps(item) for item in self.BANK) + '\n'):
+            # Tiny reads put buffer boundaries inside keys, strings and separators
+            for read_size in (1, 7, question_bank.READ_SIZE):
+                quiz = self.make_quiz()
+                with patch.object(question_bank, 'READ_SIZE', read_size):
+                    count = question_bank.import_questions(quiz, io.StringIO(text), 'json', chunk_size=3)
+                self.assertEqual(count, 4)
+                rows = self.imported(quiz)
+                expected = expected or rows
+                self.assertEqual(rows, expected)
+        self.assertEqual(expected[0], (3, 'Capital of France?', 'mc', 2, [], [
+            ('Paris', True), ('Rome', False), ('Oslo', False),
+        ]))
+        self.assertEqual(expected[2][4], ['4', 'four'])
+        self.assertEqual(expected[3][5], [('2', True), ('4', False), ('5', True)])
+
+    def test_csv_cells_hold_one_choice_per_line(self):
+        quiz = self.make_quiz()
+        text = 'question,type,choices,correct,accepted_answers\r\n"Pick",mc,"a\nb\n\nc",2,\r\nSay hi,sa,,,"hi\nhello"\r\n'
+        self.assertEqual(question_bank.import_questions(quiz, io.StringIO(text), 'csv'), 2)
+        rows = self.imported(quiz)
+        self.assertEqual(rows[0][5], [('a', False), ('b', False), ('c', True)])
+        self.assertEqual(rows[1][4], ['hi', 'hello'])
+
+    def test_invalid_banks_write_nothing(self):
+        quiz = self.make_quiz()
+        bank = [
+            self.BANK[0],
+            {'question': ' '},
+            {'question': 'One choice', 'choices': ['a'], 'correct': 0},
+            {'question': 'Bad index', 'choices': ['a', 'b'], 'correct': 2},
+            {'question': 'Maybe', 'type': 'tf', 'correct': 'perhaps'},
+            {'question': 'Regex', 'type': 'sa', 'accepted_answers': ['('], 'answer_match': 'regex'},
+            {'question': 'Zero', 'type': 'sa', 'accepted_answers': ['x'], 'points': 0},
+        ]
+        with self.assertRaises(question_bank.QuestionBankError) as raised:
+            question_bank.import_questions(quiz, io.StringIO(json.dumps(bank)), 'json')
+        self.assertEqual([error.split(':')[0] for error in raised.exception.errors], [
+            f'Question {number}' for number in range(2, 8)
+        ])
+        self.assertEqual(quiz.questions.count(), 2)
+
+        for text, error in (
+            ('[{"question": "A", "type": "tf", "correct": true} {"question": "B"}]',
+             'expected "," or "]" after question 1'),
+            ('[{"question": "A", "type": "tf", "correct": true},', 'the JSON array is not closed'),
+            ('{"question": "A", "type": "tf", "correct": tru}', 'invalid JSON in question 1'),
+            ('[]', 'The file contains no questions.'),
+        ):
+            with patch.object(question_bank, 'READ_SIZE', 5):
+                with self.assertRaises(question_bank.QuestionBankError) as raised:
+                    question_bank.import_questions(quiz, io.StringIO(text), 'json')
+            self.assertIn(error, raised.exception.errors[0])
+        with self.assertRaises(question_bank.QuestionBankError) as raised:
+            question_bank.import_questions(quiz, io.StringIO('text\r\nA\r\n'), 'csv')
+        self.assertIn('"question" column', raised.exception.errors[0])
+        self.assertEqual(quiz.questions.count(), 2)
+
+    def test_oversized_question_is_rejected(self):
+        text = json.dumps([{'question': 'x' * 200, 'type': 'tf', 'correct': True}])
+        self.assertEqual(question_bank.validate(io.StringIO(text), 'json'), (1, []))
+        # The object is never buffered past MAX_QUESTION_SIZE, however it is read
+        with patch.object(question_bank, 'READ_SIZE', 16), patch.object(question_bank, 'MAX_QUESTION_SIZE', 64):
+            count, errors = question_bank.validate(io.StringIO(text), 'json')
+        self.assertEqual(count, 0)
+        self.assertTrue(errors[0].startswith('Question 1: invalid JSON in question 1'))
+
+    def test_view_imports_posted_files_only(self):
+        quiz = self.make_quiz()
+        url = reverse('import_questions', args=[quiz.id])
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+        response = self.client.post(url, follow=True)
+        self.assertContains(response, 'Choose a question bank file to import.')
+        upload = SimpleUploadedFile('bank.json', b'\xef\xbb\xbf' + json.dumps(self.BANK).encode())
+        response = self.client.post(url, {'bank': upload}, follow=True)
+        self.assertContains(response, 'Imported 4 questions.')
+        upload = SimpleUploadedFile('bank.csv', b'question,type\r\nA,zz\r\n')
+        response = self.client.post(url, {'bank': upload}, follow=True)
+        self.assertContains(response, 'Nothing was imported. Question 1: unknown type')
+        self.assertEqual(quiz.questions.count(), 6)
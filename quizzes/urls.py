@@ -9,8 +9,10 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('create-quiz/', views.create_quiz, name='create_quiz'),
     path('quiz/<int:quiz_id>/add-questions/', views.add_questions, name='add_questions'),
+    path('quiz/<int:quiz_id>/import-questions/', views.import_questions, name='import_questions'),
     path('quiz/<int:quiz_id>/take/', views.take_quiz, name='take_quiz'),
     path('quiz/<int:quiz_id>/results/', views.admin_quiz_results, name='admin_quiz_results'),
+    path('quiz/<int:quiz_id>/results/export/', views.export_quiz_results, name='export_quiz_results'),
     path('quiz/<int:quiz_id>/delete/', views.delete_quiz, name='delete_quiz'),
     path('submission/<int:submission_id>/results/', views.quiz_results, name='quiz_results'),
     path('leaderboard/', profile_views.leaderboard, name='leaderboard'),
@@ -23,7 +25,10 @@ urlpatterns = [
     path('api/notifications/', api_views.get_notifications, name='get_notifications'),
     path('api/notifications/<int:notification_id>/read/', api_views.mark_notification_read, name='mark_notification_read'),
     path('api/notifications/read-all/', api_views.mark_all_notifications_read, name='mark_all_notifications_read'),
+    path('api/notifications/stream/', api_views.notification_stream, name='notification_stream'),
     path('api/quiz/<int:quiz_id>/feedback/', api_views.submit_quiz_feedback, name='submit_quiz_feedback'),
+    path('api/submission/<int:submission_id>/status/', api_views.submission_status, name='submission_status'),
+    path('api/rankings/', api_views.rankings, name='rankings'),
     path('api/streak/', api_views.get_user_streak, name='get_user_streak'),
     path('api/dashboard-stats/', api_views.dashboard_stats, name='dashboard_stats'),
 ]
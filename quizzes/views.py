@@ -4,15 +4,24 @@ from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib import messages
-from django.db.models import Count, Avg, Q
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast, Lower
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.utils import timezone
 from datetime import timedelta
+import io
 import json
 
-from .models import Quiz, Question, Choice, QuizSubmission, Answer, UserProfile
+from .models import Quiz, Question, Choice, QuizSubmission, Subject, UserProfile
 from .forms import QuizForm, QuestionForm
+from . import archive, broadcasts, distributions, exports, question_bank, ranking, sharding
+from .answer_keys import get_answer_key
+from .grading import enqueue_submission, grading_mode, submit_quiz
+from .routers import async_replica_iterator, replica_iterator, stick_to_primary, use_replica
 
 
 def landing_page(request):
@@ -85,80 +94,76 @@ def register_view(request):
 
 
 @login_required
+@use_replica
 def dashboard(request):
     """Enhanced dashboard for both admin and regular users"""
     profile, created = UserProfile.objects.get_or_create(user=request.user)
     
     if profile.is_admin:
         # Admin dashboard
-        quizzes = Quiz.objects.filter(creator=request.user).annotate(
-            submission_count=Count('submissions')
-        )
+        quizzes = list(Quiz.objects.filter(creator=request.user, deleted_at__isnull=True))
+        own_submissions = QuizSubmission.objects.filter(quiz_id__in=[quiz.id for quiz in quizzes])
+        # Counted from the score histograms, which also cover archived submissions
+        totals = distributions.quiz_totals([quiz.id for quiz in quizzes])
+        for quiz in quizzes:
+            quiz.submission_count = totals.get(quiz.id, (0, 0))[0]
         
         # Get recent submissions for admin's quizzes
-        recent_submissions = QuizSubmission.objects.filter(
-            quiz__creator=request.user
-        ).select_related('user', 'quiz').order_by('-submitted_at')[:10]
+        recent_submissions = sharding.gather(
+            sharding.related(own_submissions.order_by('-submitted_at'), 'user', 'quiz'),
+            limit=10, key='submitted_at', reverse=True,
+        )
         
         # Calculate admin stats
-        total_submissions = QuizSubmission.objects.filter(quiz__creator=request.user).count()
-        avg_score = QuizSubmission.objects.filter(quiz__creator=request.user).aggregate(
-            avg=Avg('score')
-        )['avg'] or 0
+        total_submissions = sum(count for count, score in totals.values())
+        score_sum = sum(score for count, score in totals.values())
+        avg_score = score_sum / total_submissions if total_submissions else 0
         
         context = {
             'is_admin': True,
             'user_profile': profile,
             'quizzes': quizzes,
-            'total_quizzes': quizzes.count(),
+            'total_quizzes': len(quizzes),
             'total_submissions': total_submissions,
             'average_score': avg_score,
             'recent_submissions': recent_submissions,
-            'progress_percentage': min(100, (quizzes.count() * 20)),  # Simple progress calculation
+            'progress_percentage': min(100, (len(quizzes) * 20)),  # Simple progress calculation
             'user_rank': 1,  # Admin is always rank 1 for their own quizzes
         }
     else:
         # User dashboard
-        submissions = QuizSubmission.objects.filter(user=request.user).select_related('quiz')
-        available_quizzes = Quiz.objects.filter(is_active=True).exclude(
-            submissions__user=request.user
+        submissions = QuizSubmission.objects.filter(user=request.user)
+        available_quizzes = sharding.exclude_taken(
+            Quiz.objects.filter(is_active=True), request.user
         )[:6]  # Limit to 6 for display
         
-        # Calculate user stats
-        total_quizzes_taken = submissions.count()
-        avg_score = submissions.aggregate(avg=Avg('score'))['avg'] or 0
-        
-        # Get recent submissions
-        recent_submissions = submissions.order_by('-submitted_at')[:5]
+        # Calculate user stats from the profile totals, which include archived submissions
+        total_quizzes_taken = profile.total_quizzes_taken
+        avg_score = profile.total_score / total_quizzes_taken if total_quizzes_taken else 0
         
-        # Calculate progress percentage based on quizzes taken
-        total_available_quizzes = Quiz.objects.filter(is_active=True).count()
-        if total_available_quizzes > 0:
-            progress_percentage = (total_quizzes_taken / total_available_quizzes) * 100
-        else:
-            progress_percentage = 0
+        # Get recent submissions (from every shard)
+        recent_submissions = sharding.gather(
+            sharding.related(submissions.order_by('-submitted_at'), 'quiz'),
+            limit=5, key='submitted_at', reverse=True,
+        )
         
-        # Get user rank (simplified ranking based on average score)
-        user_rank = QuizSubmission.objects.filter(
-            score__gt=avg_score
-        ).values('user').distinct().count() + 1 if avg_score > 0 else None
+        # Same rank as the profile page, from the rank index
+        user_rank = ranking.rank_for_score(profile.total_score) if total_quizzes_taken else None
         
-        # Get top performers
-        top_performers = QuizSubmission.objects.values('user__username').annotate(
-            avg_score=Avg('score'),
-            total_quizzes=Count('id')
-        ).filter(total_quizzes__gt=0).order_by('-avg_score')[:5]
+        # Get top performers from the profile totals kept by grading
+        top_performers = UserProfile.objects.filter(total_quizzes_taken__gt=0).annotate(
+            avg_score=Cast('total_score', FloatField()) / F('total_quizzes_taken'),
+            total_quizzes=F('total_quizzes_taken'),
+        ).order_by('-avg_score').values('user__username', 'avg_score', 'total_quizzes')[:5]
         
         context = {
             'is_admin': False,
             'user_profile': profile,
-            'submissions': submissions,
             'available_quizzes': available_quizzes,
             'total_quizzes': total_quizzes_taken,
             'total_submissions': total_quizzes_taken,
             'average_score': avg_score,
             'recent_submissions': recent_submissions,
-            'progress_percentage': progress_percentage,
             'user_rank': user_rank,
             'top_performers': top_performers,
         }
@@ -191,7 +196,7 @@ def create_quiz(request):
 @login_required
 def add_questions(request, quiz_id):
     """Add questions to a quiz (Admin only)"""
-    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user, deleted_at__isnull=True)
     
     if request.method == 'POST':
         form = QuestionForm(request.POST)
@@ -199,27 +204,35 @@ def add_questions(request, quiz_id):
             question = form.save(commit=False)
             question.quiz = quiz
             question.order = quiz.questions.count() + 1
-            question.save()
             
-            # Add choices for multiple choice questions
-            if question.question_type == 'mc':
-                choices_data = request.POST.getlist('choices')
-                correct_choice = int(request.POST.get('correct_choice', 0))
+            # Saving the question retires the answer key; the choices go in the
+            # same transaction, so no key is compiled from the question alone
+            with transaction.atomic():
+                question.save()
                 
-                for i, choice_text in enumerate(choices_data):
-                    if choice_text.strip():
-                        Choice.objects.create(
+                # Add choices for multiple choice questions
+                if question.question_type == 'mc':
+                    choices_data = request.POST.getlist('choices')
+                    correct_choice = int(request.POST.get('correct_choice', 0))
+                    
+                    Choice.objects.bulk_create([
+                        Choice(
                             question=question,
                             choice_text=choice_text,
                             is_correct=(i == correct_choice)
                         )
+                        for i, choice_text in enumerate(choices_data) if choice_text.strip()
+                    ])
             
+            # The first question makes the quiz worth announcing; delivered to
+            # every user by the send_broadcasts worker
+            broadcasts.announce_quiz(quiz)
             messages.success(request, 'Question added successfully!')
             return redirect('add_questions', quiz_id=quiz.id)
     else:
         form = QuestionForm()
     
-    questions = quiz.questions.all()
+    questions = quiz.questions.annotate(choice_count=Count('choices'))
     return render(request, 'quizzes/add_questions.html', {
         'quiz': quiz,
         'form': form,
@@ -227,66 +240,57 @@ def add_questions(request, quiz_id):
     })
 
 
+@login_required
+@require_POST
+def import_questions(request, quiz_id):
+    """Add every question in an uploaded JSON or CSV question bank (Admin only)"""
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user, deleted_at__isnull=True)
+    upload = request.FILES.get('bank')
+    if upload is None:
+        messages.error(request, 'Choose a question bank file to import.')
+        return redirect('add_questions', quiz_id=quiz.id)
+    
+    # Large uploads are spooled to a temporary file, which the importer reads twice
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    try:
+        count = question_bank.import_questions(quiz, stream, question_bank.format_for(upload.name))
+    except question_bank.QuestionBankError as exc:
+        shown = exc.errors[:10]
+        more = len(exc.errors) - len(shown)
+        messages.error(
+            request,
+            'Nothing was imported. ' + ' '.join(shown) + (f' ...and {more} more problems.' if more else ''),
+        )
+    else:
+        broadcasts.announce_quiz(quiz)
+        messages.success(request, f'Imported {count} questions.')
+    return redirect('add_questions', quiz_id=quiz.id)
+
+
 @login_required
 def take_quiz(request, quiz_id):
     """Take a quiz"""
     quiz = get_object_or_404(Quiz, id=quiz_id, is_active=True)
     
     # Check if user has already taken this quiz
-    if QuizSubmission.objects.filter(quiz=quiz, user=request.user).exists():
+    if archive.has_taken(quiz, request.user):
         messages.error(request, 'You have already taken this quiz.')
         return redirect('dashboard')
     
     questions = quiz.questions.prefetch_related('choices').all()
     
     if request.method == 'POST':
-        # Process quiz submission
-        submission = QuizSubmission.objects.create(
-            quiz=quiz,
-            user=request.user,
-            total_points=sum(q.points for q in questions)
-        )
-        
-        score = 0
-        for question in questions:
-            if question.question_type == 'mc':
-                selected_choice_id = request.POST.get(f'question_{question.id}')
-                if selected_choice_id:
-                    selected_choice = Choice.objects.get(id=selected_choice_id)
-                    is_correct = selected_choice.is_correct
-                    if is_correct:
-                        score += question.points
-                    
-                    Answer.objects.create(
-                        submission=submission,
-                        question=question,
-                        selected_choice=selected_choice,
-                        is_correct=is_correct
-                    )
-            elif question.question_type == 'tf':
-                answer = request.POST.get(f'question_{question.id}')
-                correct_answer = question.choices.filter(is_correct=True).first()
-                is_correct = answer == correct_answer.choice_text if correct_answer else False
-                if is_correct:
-                    score += question.points
-                
-                Answer.objects.create(
-                    submission=submission,
-                    question=question,
-                    text_answer=answer,
-                    is_correct=is_correct
-                )
-        
-        submission.score = score
-        submission.save()
-        
-        # Update user profile
-        profile, created = UserProfile.objects.get_or_create(user=request.user)
-        profile.total_quizzes_taken += 1
-        profile.total_score += score
-        profile.save()
-        
-        messages.success(request, f'Quiz submitted! Your score: {score}/{submission.total_points}')
+        # Grade the whole submission in memory against the answer key
+        key = get_answer_key(quiz)
+        if grading_mode() == 'queued':
+            # Only store the raw answers; the grading worker scores them
+            submission = enqueue_submission(quiz, request.user, request.POST, key)
+            messages.success(request, 'Quiz submitted! Your answers are being graded.')
+        else:
+            submission = submit_quiz(quiz, request.user, request.POST, key)
+            messages.success(request, f'Quiz submitted! Your score: {submission.score}/{submission.total_points}')
+        # The next pages (results, dashboard) must show this submission
+        stick_to_primary(request)
         return redirect('quiz_results', submission_id=submission.id)
     
     return render(request, 'quizzes/take_quiz.html', {
@@ -298,12 +302,19 @@ def take_quiz(request, quiz_id):
 @login_required
 def quiz_results(request, submission_id):
     """View quiz results"""
-    submission = get_object_or_404(QuizSubmission, id=submission_id, user=request.user)
-    answers = submission.answers.select_related('question', 'selected_choice').all()
+    # Old submissions are loaded from the yearly archive files
+    submission = archive.get_submission_or_404(id=submission_id, user=request.user)
+    
+    if submission.is_pending or submission.is_failed:
+        # Still queued (or failed); the grading page polls until the worker is done
+        return render(request, 'quizzes/quiz_grading.html', {'submission': submission})
+    
+    answers = submission.get_answers()
     
     return render(request, 'quizzes/quiz_results.html', {
         'submission': submission,
-        'answers': answers
+        'answers': answers,
+        'percentile': distributions.percentile(submission.quiz_id, submission.score),
     })
 
 
@@ -316,9 +327,10 @@ def leaderboard(request):
     ).order_by('-total_score')[:10]
     
     # Get recent submissions
-    recent_submissions = QuizSubmission.objects.select_related(
-        'user', 'quiz'
-    ).order_by('-submitted_at')[:10]
+    recent_submissions = sharding.gather(
+        sharding.related(QuizSubmission.objects.order_by('-submitted_at'), 'user', 'quiz'),
+        limit=10, key='submitted_at', reverse=True,
+    )
     
     return render(request, 'quizzes/leaderboard.html', {
         'top_users': top_users,
@@ -331,37 +343,118 @@ def quiz_list(request):
     """List all available quizzes for users"""
     if request.GET.get('creator'):
         creator_username = request.GET.get('creator')
-        quizzes = Quiz.objects.filter(
+        quizzes = sharding.exclude_taken(Quiz.objects.filter(
             creator__username=creator_username,
             is_active=True
-        ).exclude(submissions__user=request.user)
+        ), request.user)
     else:
-        quizzes = Quiz.objects.filter(is_active=True).exclude(
-            submissions__user=request.user
-        )
+        quizzes = sharding.exclude_taken(Quiz.objects.filter(is_active=True), request.user)
+    
+    # Filter by subject using the indexed subject foreign key
+    subject = None
+    if request.GET.get('subject'):
+        subject = get_object_or_404(Subject, slug=request.GET.get('subject'))
+        quizzes = quizzes.filter(subject=subject)
     
-    return render(request, 'quizzes/quiz_list.html', {'quizzes': quizzes})
+    return render(request, 'quizzes/quiz_list.html', {
+        'quizzes': quizzes.select_related('subject'),
+        'subjects': Subject.objects.all(),
+        'current_subject': subject,
+    })
+
+
+RESULTS_PAGE_SIZE = 50
+
+
+def _results_cursor(value):
+    """``(score, id)`` from a ``<score>.<id>`` page cursor, or None"""
+    try:
+        score, submission_id = value.split('.')
+        return int(score), int(submission_id)
+    except (AttributeError, ValueError):
+        return None
 
 
 @login_required
+@use_replica
 def admin_quiz_results(request, quiz_id):
     """View all results for a specific quiz (Admin only)"""
-    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
-    submissions = quiz.submissions.select_related('user').order_by('-score')
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user, deleted_at__isnull=True)
+    answer_key = get_answer_key(quiz)
+    
+    # Summary and score distribution from the maintained per-quiz histogram,
+    # which still counts archived submissions; the table lists live ones only
+    score_counts = distributions.score_counts(quiz.id)
+    
+    # Keyset pagination on (score, id): highest score first, earliest submission
+    # first among equals, which is the order of the (quiz, -score) index
+    after = _results_cursor(request.GET.get('after'))
+    before = _results_cursor(request.GET.get('before'))
+    submissions = quiz.submissions.all()
+    if before:
+        score, submission_id = before
+        submissions = submissions.filter(
+            Q(score__gte=score) & (Q(score__gt=score) | Q(id__lt=submission_id))
+        ).order_by('score', '-id')
+    else:
+        if after:
+            score, submission_id = after
+            submissions = submissions.filter(
+                Q(score__lte=score) & (Q(score__lt=score) | Q(id__gt=submission_id))
+            )
+        submissions = submissions.order_by('-score', 'id')
+    page = list(sharding.related(submissions, 'user')[:RESULTS_PAGE_SIZE + 1])
+    more = len(page) > RESULTS_PAGE_SIZE
+    page = page[:RESULTS_PAGE_SIZE]
+    if before:
+        page.reverse()
     
     return render(request, 'quizzes/admin_quiz_results.html', {
         'quiz': quiz,
-        'submissions': submissions
+        'submissions': page,
+        'stats': distributions.summary(score_counts, answer_key.total_points),
+        'archived_count': quiz.archived_submissions.count(),
+        'pass_percentage': distributions.pass_percentage(),
+        'total_points': answer_key.total_points,
+        'total_questions': len(answer_key),
+        'previous_cursor': f'{page[0].score}.{page[0].id}' if page and (more if before else after) else None,
+        'next_cursor': f'{page[-1].score}.{page[-1].id}' if page and (before or more) else None,
+        'distribution': distributions.chart(score_counts, answer_key.total_points),
     })
 
 
+@login_required
+@use_replica
+def export_quiz_results(request, quiz_id):
+    """Stream a quiz's submissions, or their answers, as CSV or NDJSON (Admin only)"""
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user, deleted_at__isnull=True)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return JsonResponse({'error': f'Unknown format: {fmt}'}, status=400)
+    answers = request.GET.get('answers') == '1'
+    
+    # The body is read after this view returns, so it routes its own reads to
+    # the replica; under ASGI it has to be async or Django buffers all of it
+    body = exports.stream(quiz, fmt, answers)
+    if isinstance(request, ASGIRequest):
+        body = async_replica_iterator(body)
+    else:
+        body = replica_iterator(body)
+    response = StreamingHttpResponse(body, content_type=exports.FORMATS[fmt])
+    name = f'quiz-{quiz.id}-{"answers" if answers else "submissions"}.{fmt}'
+    response['Content-Disposition'] = f'attachment; filename="{name}"'
+    return response
+
+
 @login_required
 def delete_quiz(request, quiz_id):
     """Delete a quiz (Admin only)"""
-    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user)
+    quiz = get_object_or_404(Quiz, id=quiz_id, creator=request.user, deleted_at__isnull=True)
     
     if request.method == 'POST':
-        quiz.delete()
+        # Hidden at once; purge_deleted_quizzes removes its rows in the background
+        quiz.soft_delete()
+        broadcasts.cancel_for_quiz(quiz.id)
         messages.success(request, 'Quiz deleted successfully!')
         return redirect('dashboard')
     
@@ -370,11 +463,13 @@ def delete_quiz(request, quiz_id):
 
 def search_creators(request):
     """AJAX endpoint to search for quiz creators"""
-    query = request.GET.get('q', '')
+    query = request.GET.get('q', '').strip()
     if query:
+        # Substring matches can't use an index on username, so the search
+        # walks the admins (profile_admin_idx) rather than every user
         creators = User.objects.filter(
             username__icontains=query,
-            userprofile__is_admin=True
-        ).values('username')[:10]
+            id__in=UserProfile.objects.filter(is_admin=True).values('user_id'),
+        ).order_by(Lower('username')).values('username')[:10]
         return JsonResponse({'creators': list(creators)})
     return JsonResponse({'creators': []})